@@ -7,7 +7,9 @@ name = 'birdsong'
 
 from .view import CanaryView
 from .sender import CanarySender
-from .values import Tvq, Property, Annotation
+from .values import Tvq, Property, Annotation, TvqSeries
+from .aio import AsyncCanaryView, AsyncCanarySender
 
 
-__all__ = ['CanaryView', 'CanarySender', 'Tvq', 'Property', 'Annotation']
\ No newline at end of file
+__all__ = ['CanaryView', 'CanarySender', 'Tvq', 'Property', 'Annotation', 'TvqSeries',
+           'AsyncCanaryView', 'AsyncCanarySender']
\ No newline at end of file
@@ -0,0 +1,1297 @@
+"""
+	Asyncio flavors of the Canary interfaces.
+
+	AsyncCanaryView and AsyncCanarySender mirror CanaryView and CanarySender,
+	but every call that goes over the wire is a coroutine (or an async generator,
+	for calls that page through continuations). That lets one event loop keep
+	many historian requests in flight at once.
+
+	Tokens are awaitable here, so where the blocking classes use self.userToken
+	these use (await self.userToken).
+
+	Requires aiohttp (pip install birdsong[async])
+
+"""
+import asyncio
+import time
+import warnings
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .rest import RestInterface, chunks, DEFAULT_MAX_WORKERS
+from .tokens import keyring
+from .tokencache import getTokenCache, tokenCacheKey
+from .tagcache import getTagDataCache, fetchArgSets, _isoTimestamp, READ_PAST_END
+from .namespace import getTagNamespace
+from .metacache import getMetadataCache
+from .planner import getQueryPlanner, getTagSharder
+from .live import (AsyncLiveDataEngine, tvqsFromLiveValues,
+                   DEFAULT_MIN_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL, DEFAULT_MAX_LIVE_TOKENS)
+from .view import (DEFAULT_VIEW_PORT_ANONYMOUS_HTTP, DEFAULT_VIEW_PORT_USERNAME_HTTPS,
+                   DEFAULT_TAG_CHUNK_SIZE, _prepConstraints, _valueDecoder, _seriesAs)
+from .sender import (DEFAULT_SENDER_PORT_ANONYMOUS_HTTP, DEFAULT_SENDER_PORT_USERNAME_HTTPS,
+                     _packageData, _pageData, _pageTags)
+from .values import Tvq, TvqSeries
+
+
+# Connectors shared between interfaces, by event loop and pool key (see sharePool)
+_sharedConnectors = {}
+
+
+class AsyncRestInterface(RestInterface):
+    """Interface methods for talking to Canary, awaitably."""
+
+    @property
+    def session(self):
+        if not self._session:
+            if aiohttp is None:
+                raise ImportError("The asyncio interfaces need aiohttp (pip install birdsong[async])")
+            # aiohttp turns on TCP keep-alive for its connections itself
+            timeout = aiohttp.ClientTimeout(connect=self.connectTimeout, sock_read=self.readTimeout)
+            if self.sharePool:
+                self._session = aiohttp.ClientSession(connector=self._sharedConnector(), connector_owner=False, timeout=timeout)
+            else:
+                self._session = aiohttp.ClientSession(connector=self._newConnector(), timeout=timeout)
+        return self._session
+
+    def _newConnector(self):
+        return aiohttp.TCPConnector(limit=self.poolMaxSize, limit_per_host=self.poolMaxSize)
+
+    def _sharedConnector(self):
+        key = (id(asyncio.get_running_loop()),) + self._poolKey
+        connector = _sharedConnectors.get(key)
+        if connector is None or connector.closed:
+            connector = _sharedConnectors[key] = self._newConnector()
+        return connector
+
+    async def close(self):
+        """Close the HTTP session. Further calls will open a new one.
+        (A shared pool stays open for the other interfaces using it)
+        """
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def aclose(self):
+        """Everything leaving the async with block does (revoking tokens, closing the session...),
+        for when the interface isn't used as an async context manager.
+        """
+        await self.__aexit__(None, None, None)
+
+    def __del__(self):
+        # Nothing can be awaited here, so the most that can be done is to schedule the close
+        session = getattr(self, '_session', None)
+        if session is not None and not session.closed:
+            warnings.warn('%s was never closed - use it with async with, or await aclose(). '
+                          'Its tokens are left to expire.' % type(self).__name__, ResourceWarning)
+            try:
+                asyncio.get_running_loop().create_task(session.close())
+            except RuntimeError:
+                pass # No loop left to close it on
+
+    async def _backoff(self, reason, retry):
+        """Wait before the given retry, if the policy allows another. (See RestInterface._backoff)"""
+        if retry > self.retryPolicy.maxRetries:
+            self._countRetry('exhausted')
+            return False
+        self._countRetry(reason)
+        await asyncio.sleep(self.retryPolicy.delay(retry))
+        return True
+
+    async def _mapConcurrently(self, function, argSets, maxWorkers=DEFAULT_MAX_WORKERS):
+        """Await the coroutine function on each of the argSets, with up to maxWorkers in flight at once.
+        Results are returned in the same order as the argSets.
+        """
+        throttle = asyncio.Semaphore(maxWorkers)
+
+        async def throttled(args):
+            async with throttle:
+                return await function(args)
+
+        return await asyncio.gather(*[throttled(args) for args in argSets])
+
+    # Context management
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    # REST API methods
+
+    async def _post(self, apiUrl, jsonData):
+        """Post to the API and return the results.
+        The results are also kept in lastResults, but with many calls in flight
+          that's only the most recent to finish, so use what's returned instead.
+        """
+        payload = self._packagePayload(jsonData)
+        body, headers = self._compressPayload(payload)
+        url = self._url(apiUrl)
+
+        # Dropped connections, timeouts and server errors are retried as the policy allows
+        retry = 0
+        while True:
+            self._allowCall()
+            try:
+                async with self.session.post(url, data=body, headers=headers, ssl=bool(self.https and self.verifySSL)) as response:
+                    if response.status >= 500:
+                        response.raise_for_status()
+                    content = await response.read()
+                    # aiohttp decompresses as it reads, so go by what Canary said it sent
+                    wireBytes = response.content_length if response.headers.get('Content-Encoding') else None
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError) as error:
+                self.circuitBreaker.recordFailure()
+                retry += 1
+                if not self._mayRetry(apiUrl, error) or not await self._backoff('transport', retry):
+                    raise
+                continue
+            except asyncio.CancelledError:
+                self.circuitBreaker.recordAbandoned()
+                raise
+            except Exception:
+                self.circuitBreaker.recordFailure()
+                raise
+            self.circuitBreaker.recordSuccess()
+            break
+
+        self._countTransfer(apiUrl, len(payload), len(body), len(content), wireBytes or len(content))
+        responseJson = self._unpackageResults(content)
+        self.lastResults = responseJson
+        return responseJson
+
+    @staticmethod
+    def _neverSent(error):
+        return isinstance(error, (aiohttp.ClientConnectorError, getattr(aiohttp, 'ConnectionTimeoutError', aiohttp.ClientConnectorError)))
+
+    async def _iterPost(self, apiUrl, jsonData, resultKey):
+        while True:
+            results = await self._post(apiUrl, jsonData)
+            self._raiseUnhandledPostError(apiUrl, jsonData, results)
+
+            entries = results[resultKey]
+            if isinstance(entries, (list,tuple)):
+                for item in entries:
+                    yield item
+            else:
+                yield entries
+
+            if not results.get('continuation', False):
+                break
+            jsonData['continuation'] = results['continuation']
+
+    async def _singlePost(self, apiUrl, jsonData, resultKey):
+        results = await self._post(apiUrl, jsonData)
+        self._raiseUnhandledPostError(apiUrl, jsonData, results)
+
+        return results[resultKey]
+
+
+class AsyncUserTokenManagement(AsyncRestInterface):
+
+    def __init__(self, username='', password='', tokenCache=None,
+                 autoKeepAlive=False, userTokenLifetime=None,
+                 **configuration):
+
+        self._userToken = None
+        self._userTokenLock = asyncio.Lock()
+        self._userTokenTime = 0
+        self._tokenCache = getTokenCache(tokenCache)
+
+        # Kept alive by a task instead of a thread (see keepalive.py)
+        self.autoKeepAlive = autoKeepAlive
+        self.userTokenLifetime = userTokenLifetime
+        self._keepAliveTask = None
+        self._username = username
+        keyring.set_password('birdsong', self.__self_id, password)
+
+        if self._username and self.__password:
+            configuration['https'] = True
+
+        super().__init__(**configuration)
+
+
+    @property
+    def __self_id(self):
+        return '<%s at %s>' % (self.__class__.__name__, hex(id(self)))
+
+    @property
+    def __password(self):
+        return keyring.get_password('birdsong', self.__self_id)
+
+
+    @property
+    def userToken(self):
+        """Awaitable user token. Requests one first if needed."""
+        return self._requireUserToken()
+
+    async def _requireUserToken(self):
+        if not self._userToken:
+            # Only the first of many waiting calls needs to actually log in
+            async with self._userTokenLock:
+                if not self._userToken:
+                    await self._getUserToken()
+        return self._userToken
+
+
+    @property
+    def _userTokenCacheKey(self):
+        return tokenCacheKey('userToken', self._poolKey, self._username)
+
+
+    # User token API calls
+
+    async def _getUserToken(self):
+        if self._tokenCache:
+            cachedToken = self._tokenCache.get(self._userTokenCacheKey)
+            if cachedToken:
+                self._userToken = cachedToken
+                self._userTokenTime = time.monotonic()
+                return
+        jsonData = {
+            "username":self._username,
+            "password":self.__password,
+            "application":"getData"
+        }
+        self._userToken = await self._singlePost('getUserToken', jsonData, 'userToken')
+        self._userTokenTime = time.monotonic()
+        if self._tokenCache:
+            self._tokenCache.put(self._userTokenCacheKey, self._userToken)
+
+
+    async def _revokeUserToken(self):
+        if self._userToken:
+            # Cached tokens are left open for the next process
+            if not self._tokenCache:
+                await self._post('revokeUserToken', {"userToken":self._userToken})
+            self._userToken = None
+
+
+    # Keep alive
+
+    @property
+    def _keepAliveInterval(self):
+        """Seconds between keep alive checks (None if there's nothing to keep alive)"""
+        if self.userTokenLifetime:
+            return self.userTokenLifetime / 4.0
+        return None
+
+    def _startKeepAlive(self):
+        interval = self._keepAliveInterval
+        if self.autoKeepAlive and interval and not self._keepAliveTask:
+            self._keepAliveTask = asyncio.ensure_future(self._keepAliveLoop(interval))
+
+    async def _stopKeepAlive(self):
+        task, self._keepAliveTask = self._keepAliveTask, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _keepAliveLoop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._keepTokensAlive()
+            except Exception:
+                # The calls themselves will still recover the tokens if need be
+                pass
+
+    async def _keepTokensAlive(self):
+        """Get a new user token if the current one is getting old. (See UserTokenManagement)"""
+        if (    self.userTokenLifetime and self._userToken
+            and time.monotonic() - self._userTokenTime > self.userTokenLifetime / 2.0):
+            async with self._userTokenLock:
+                if self._tokenCache:
+                    self._tokenCache.discard(self._userTokenCacheKey, self._userToken)
+                await self._getUserToken()
+
+
+    # Context management
+
+    async def __aenter__(self):
+        await self._requireUserToken()
+        self._startKeepAlive()
+        return self
+
+    async def __aexit__(self, *args):
+        try:
+            await self._stopKeepAlive()
+            await self._revokeUserToken()
+            if self._username:
+                self._username = ''
+                keyring.delete_password('birdsong', self.__self_id)
+        finally:
+            await super().__aexit__(*args)
+
+    def __del__(self):
+        # The password at least can be cleared without awaiting anything
+        if getattr(self, '_username', None):
+            self._username = ''
+            keyring.delete_password('birdsong', self.__self_id)
+        super().__del__()
+
+
+    async def _post(self, apiUrl, jsonData):
+        """Error Handling context for user tokens"""
+        retry = 0
+        while True:
+            results = await super()._post(apiUrl, jsonData)
+
+            # Check if it failed. If so, reload and try again (if the retry policy allows)
+            if results['statusCode'] != 'BadUserToken':
+                return results
+            retry += 1
+            if not await self._backoff('BadUserToken', retry):
+                return results
+            assert 'userToken' in jsonData, "API '%s' called with bad user token without including one." % apiUrl
+            # Another call may have already replaced the token
+            if self._userToken == jsonData['userToken']:
+                self._userToken = None
+            if self._tokenCache:
+                self._tokenCache.discard(self._userTokenCacheKey, jsonData['userToken'])
+            jsonData['userToken'] = await self.userToken
+
+
+class AsyncLiveDataTokenManagement(AsyncUserTokenManagement):
+
+    def __init__(self,
+            liveTags=None,
+            liveMode='AllValues',
+            liveIncludeQuality=False,
+            **configuration):
+        super().__init__(**configuration)
+
+        self._liveDataTokens = {}
+        self._liveDataConfigurations = {}
+        self._rotatedLiveDataTokens = {} # old token -> its replacement
+        self._liveDataLock = asyncio.Lock()
+
+        # Can't post from here, so the live data token is set up on entry
+        self._initialLiveTags = (liveTags, {'mode': liveMode, 'includeQuality': liveIncludeQuality})
+
+
+    # Context management
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        liveTags, configuration = self._initialLiveTags
+        if liveTags:
+            await self._getLiveDataToken(liveTags, **configuration)
+        return self
+
+    async def __aexit__(self, *args):
+        try:
+            await self._revokeLiveDataToken()
+        finally:
+            await super().__aexit__(*args)
+
+
+    # Live data methods
+
+    async def _getLiveDataToken(self, tags, key=None, **configuration):
+        """Get a live data token for the tags, kept under key (the tag set, unless given)"""
+        tags = self._coerceToList(list(tags) if isinstance(tags, frozenset) else tags)
+        if key is None:
+            key = frozenset(tags)
+        if key in self._liveDataTokens:
+            return
+        # Only one call asks for the token - the others wait and find it
+        async with self._liveDataLock:
+            if not key in self._liveDataTokens:
+                await self._requestLiveDataToken(tags, key, configuration)
+
+    async def _requestLiveDataToken(self, tags, key, configuration):
+        """Ask for the token (with _liveDataLock held)"""
+        jsonData = {
+            "userToken": await self.userToken,
+            "tags": tags
+        }
+        # Set default mode if not specified
+        if 'mode' not in configuration:
+            configuration['mode'] = 'AllValues'
+        jsonData.update(configuration)
+        self._liveDataTokens[key] = await self._singlePost('getLiveDataToken', jsonData, 'liveDataToken')
+        self._liveDataConfigurations[key] = (tags, configuration.copy())
+
+
+    async def _revokeLiveDataToken(self, tags=None, key=None):
+        if self._liveDataTokens:
+            # If not specific, purge all tokens
+            if not tags and key is None:
+                for key in list(self._liveDataTokens):
+                    await self._revokeLiveDataToken(key=key)
+            else:
+                if key is None:
+                    key = frozenset(tags)
+                jsonData = {
+                    "userToken":self._userToken,
+                    "liveDataToken":self._liveDataTokens[key],
+                }
+                await self._post('revokeLiveDataToken', jsonData)
+                del self._liveDataTokens[key]
+                del self._liveDataConfigurations[key]
+
+
+    async def _revokeUserToken(self):
+        await self._revokeLiveDataToken()
+        await super()._revokeUserToken()
+
+
+    async def _rotateLiveDataToken(self, liveDataToken):
+        """Rotate the live data token, maintaining the current configuration."""
+        async with self._liveDataLock:
+            for key,activeLiveDataToken in self._liveDataTokens.items():
+                if liveDataToken == activeLiveDataToken:
+                    break
+            else:
+                # Another call may have already rotated it
+                if liveDataToken in self._rotatedLiveDataTokens:
+                    return self._rotatedLiveDataTokens[liveDataToken]
+                raise KeyError("The liveDataToken could not be rotated because it was not cached.")
+
+            tags, configuration = self._liveDataConfigurations[key]
+
+            del self._liveDataTokens[key]
+            await self._requestLiveDataToken(tags, key, dict(configuration))
+
+            self._rotatedLiveDataTokens[liveDataToken] = self._liveDataTokens[key]
+            return self._liveDataTokens[key]
+
+
+    async def _post(self, apiUrl, jsonData):
+        """Error Handling context for live data tokens"""
+        retry = 0
+        while True:
+            results = await super()._post(apiUrl, jsonData)
+
+            # Check if it failed. If so, reload and try again (if the retry policy allows)
+            if results['statusCode'] != 'BadLiveDataToken':
+                return results
+            retry += 1
+            if not await self._backoff('BadLiveDataToken', retry):
+                return results
+            assert 'liveDataToken' in jsonData, "API '%s' called with bad user token without including one." % apiUrl
+
+            jsonData['liveDataToken'] = await self._rotateLiveDataToken(jsonData['liveDataToken'])
+
+
+class AsyncSessionTokenManagement(AsyncUserTokenManagement):
+
+    def __init__(self, historians=None, clientID="ClientID",
+                 clientTimeout=60000,       # Timeout before Canary session closes
+                 fileSize=32,               # MB for buffer file rollover
+                 packetSize=1024000,        # Bytes per request
+                 packetDelay=0,             # Useful for throttling
+                 packetZip=False,           # Zip packets?
+                 receiverPort=None,         # If the historian's reciever is different...
+                 trackErrors=False,         # Op errors reported to /getErrors?
+                 suppressInfoMessages=False,# Don't return Info as errors on /getErrors?
+                 autoCreateDatasets=False,  # Create dataset if missing?
+                 autoWriteNoData=True,      # "No Data" one tick after session closes?
+                 extendData=True,           # Data extends w/active session but no updates?
+                 insertReplaceData=False,   # Insert old data?
+                 suppressTimestampErrors=False, # Don't return timestamp errors in /getErrors?
+                 **configuration):
+
+        self._sessionToken = None
+        self._sessionTokenLock = asyncio.Lock()
+
+        if not historians:
+            self.historians = ['localhost']
+        elif isinstance(historians, list):
+            self.historians = historians
+        elif isinstance(historians, str):
+            self.historians = historians.split(',')
+        else:
+            self.historians = [historians]
+
+        self.clientID = clientID
+
+        self._settings = {
+            'clientTimeout': clientTimeout,
+            'fileSize': fileSize,
+            'packetSize': packetSize,
+            'packetDelay': packetDelay,
+            'packetZip': packetZip,
+            'receiverPort': receiverPort,
+            'trackErrors': trackErrors,
+            'suppressInfoMessages': suppressInfoMessages,
+            'autoCreateDatasets': autoCreateDatasets,
+            'autoWriteNoData': autoWriteNoData,
+            'extendData': extendData,
+            'insertReplaceData': insertReplaceData,
+            'suppressTimestampErrors': suppressTimestampErrors,
+        }
+
+        # If the session zips its packets, zip what we send it too (unless told otherwise)
+        if packetZip:
+            configuration.setdefault('compression', 'gzip')
+
+        super().__init__(**configuration)
+
+
+    # Context management
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        await self._requireSessionToken()
+        return self
+
+    async def __aexit__(self, *args):
+        try:
+            await self._stopKeepAlive()
+            await self._revokeSessionToken()
+        finally:
+            await super().__aexit__(*args)
+
+
+    # Keep alive
+
+    @property
+    def _keepAliveInterval(self):
+        # Check six times per clientTimeout (which is in milliseconds), so a
+        #   keepAlive after a third of it idle always lands before half of it
+        interval = self._settings['clientTimeout'] / 6000.0
+        userTokenInterval = super()._keepAliveInterval
+        return min(interval, userTokenInterval) if userTokenInterval else interval
+
+    async def _keepTokensAlive(self):
+        await super()._keepTokensAlive()
+        # Only bother Canary if nothing else has in a while
+        if self._sessionToken and time.monotonic() - self._lastCallTime >= self._settings['clientTimeout'] / 3000.0:
+            await self.keepAlive()
+
+
+    # Session token API calls
+
+    @property
+    def _sessionTokenCacheKey(self):
+        return tokenCacheKey('sessionToken', self._poolKey, self._username, self.historians, self.clientID, self._settings)
+
+    @property
+    def sessionToken(self):
+        """Awaitable session token. Requests one first if needed."""
+        return self._requireSessionToken()
+
+    async def _requireSessionToken(self):
+        if not self._sessionToken:
+            async with self._sessionTokenLock:
+                if not self._sessionToken:
+                    await self._getSessionToken()
+        return self._sessionToken
+
+
+    async def _getSessionToken(self):
+        if self._tokenCache:
+            cachedToken = self._tokenCache.get(self._sessionTokenCacheKey)
+            if cachedToken:
+                self._sessionToken = cachedToken
+                return
+        jsonData = {
+            "userToken": await self.userToken,
+            "historians":self.historians,
+            "clientID":self.clientID,
+            "settings": self._settings,
+        }
+        self._sessionToken = await self._singlePost('getSessionToken', jsonData, 'sessionToken')
+        if self._tokenCache:
+            self._tokenCache.put(self._sessionTokenCacheKey, self._sessionToken)
+
+
+    async def _revokeSessionToken(self):
+        if self._sessionToken:
+            assert self._userToken, "Session token without user token!"
+            # Cached tokens are left open for the next process
+            if not self._tokenCache:
+                jsonData = {
+                    "userToken":self._userToken,
+                    "sessionToken":self._sessionToken
+                }
+                await self._post('revokeSessionToken', jsonData)
+            self._sessionToken = None
+
+
+    # Session management
+
+    async def getErrors(self):
+        assert self._sessionToken, "Session token missing - can't get errors of missing session."
+        jsonData = {
+            "userToken":self._userToken,
+            "sessionToken":self._sessionToken
+        }
+        return await self._singlePost('getErrors', jsonData, 'errors')
+
+
+    async def keepAlive(self):
+        jsonData = {
+            "userToken": await self.userToken,
+            "sessionToken": await self.sessionToken
+        }
+        await self._post('keepAlive', jsonData)
+
+
+    async def updateSettings(self, **settings):
+        """Modify the active session settings. See the class init
+        arguments for options.
+
+        Args:
+            settings: (dict) sessiont properties to set.
+        """
+        jsonData = {
+            "userToken": await self.userToken,
+            "sessionToken": await self.sessionToken,
+            "settings": settings
+        }
+        results = await self._post("updateSettings", jsonData)
+        if results['statusCode'] == "Good":
+            self._settings.update(settings)
+
+
+    # Error Handling
+
+    async def _post(self, apiUrl, jsonData):
+        retry = 0
+        while True:
+            results = await super()._post(apiUrl, jsonData)
+
+            # Check if it failed. If so, reload and try again (if the retry policy allows)
+            if not (   results['statusCode'] == 'BadSessionToken'
+                    or (    results['statusCode'] == 'Error'
+                        and 'Session token is invalid or has expired' in results['errors'])):
+                return results
+            retry += 1
+            if not await self._backoff('BadSessionToken', retry):
+                return results
+            assert 'sessionToken' in jsonData, "API '%s' called with bad session token without including one." % apiUrl
+            if self._sessionToken == jsonData['sessionToken']:
+                self._sessionToken = None
+            if self._tokenCache:
+                self._tokenCache.discard(self._sessionTokenCacheKey, jsonData['sessionToken'])
+            jsonData['sessionToken'] = await self.sessionToken
+
+
+class AsyncCanaryView(AsyncLiveDataTokenManagement):
+
+    apiVersion = 'api/v2'
+
+    def __init__(self,
+                 httpPort =DEFAULT_VIEW_PORT_ANONYMOUS_HTTP,
+                 httpsPort=DEFAULT_VIEW_PORT_USERNAME_HTTPS,
+                 tagDataCache=None,
+                 tagNamespace=None,
+                 metadataCache=None,
+                 queryPlanner=None,
+                 tagSharder=None,
+                 liveMinPollInterval=DEFAULT_MIN_POLL_INTERVAL,
+                 liveMaxPollInterval=DEFAULT_MAX_POLL_INTERVAL,
+                 liveMaxTokens=DEFAULT_MAX_LIVE_TOKENS,
+                 lazyTimestamps=False,
+                 **configuration):
+        """Canary View interface for asyncio. See CanaryView for the details of each call.
+
+        Use with an async context manager for automatic token management:
+
+            async with AsyncCanaryView() as view:
+                values = await view.getTagData(tagPath)
+        """
+        super().__init__(httpPort =httpPort, httpsPort=httpsPort, **configuration)
+        self.lazyTimestamps = lazyTimestamps
+        self.tagDataCache = getTagDataCache(tagDataCache)
+        self.tagNamespace = getTagNamespace(tagNamespace)
+        self._tagNamespaceLock = asyncio.Lock()
+        self.metadataCache = getMetadataCache(metadataCache)
+        self.queryPlanner = getQueryPlanner(queryPlanner)
+        self.tagSharder = getTagSharder(tagSharder)
+        self.liveDataEngine = AsyncLiveDataEngine(self, liveMinPollInterval, liveMaxPollInterval,
+                                                  maxTokens=liveMaxTokens)
+
+    async def __aexit__(self, *args):
+        try:
+            await self.liveDataEngine.stop()
+            if self.metadataCache is not None:
+                self.metadataCache.flush()
+        finally:
+            await super().__aexit__(*args)
+
+    @property
+    def _cacheOwner(self):
+        """Keeps cached results apart for different hosts and users"""
+        return (self._poolKey, self._username)
+
+
+    # Browse Methods
+
+    async def browseNodes(self, path=''):
+        jsonData = {
+            "userToken": await self.userToken,
+            "path":path
+        }
+        return await self._singlePost("browseNodes", jsonData, 'nodes')
+
+    async def browseTags(self, path='', search='', deep=False):
+        """Async generator of tag paths (from the tagNamespace, if the view has one)"""
+        if self.tagNamespace is not None:
+            await self.refreshTagNamespace()
+            for tagPath in self.tagNamespace.tags(path, search, deep):
+                yield tagPath
+            return
+        async for tagPath in self._browseTags(path, search, deep):
+            yield tagPath
+
+    async def _browseTags(self, path='', search='', deep=False):
+        jsonData = {
+            "userToken": await self.userToken,
+            "path":path,
+            "deep": deep,
+            "search": search
+        }
+        async for tagPath in self._iterPost("browseTags", jsonData, "tags"):
+            yield tagPath
+
+    async def refreshTagNamespace(self, force=False):
+        """Browse the views whose sequence changed again. (See CanaryView.refreshTagNamespace)"""
+        namespace = self.tagNamespace
+        if namespace is None:
+            raise ValueError('This view has no tagNamespace to refresh - pass tagNamespace=True when making it.')
+        async with self._tagNamespaceLock:
+            if not (force or namespace.due):
+                return []
+            viewNames = list(await self.browseNodes())
+            sequences = dict(await self.browseStatus(viewNames))
+            staleViews = namespace.stale(sequences)
+            if force:
+                staleViews = viewNames
+
+            async def browse(viewName):
+                return [tagPath async for tagPath in self._browseTags(viewName, deep=True)]
+
+            browsed = await self._mapConcurrently(browse, staleViews)
+            for viewName, tagPaths in zip(staleViews, browsed):
+                namespace.load(viewName, sequences.get(viewName), tagPaths)
+            namespace.keepOnly(viewNames)
+            return staleViews
+
+    async def browseStatus(self, views):
+        jsonData = {
+            "userToken": await self.userToken,
+            'views': self._coerceToList(views)
+        }
+        statuses = await self._singlePost('browseStatus', jsonData, 'views')
+
+        if isinstance(views, str):
+            return statuses.get(views,{}).get('sequence', None)
+        else:
+            return ((viewName,statuses.get(viewName,{}).get('sequence',None))
+                    for viewName in views)
+
+    # Data methods
+
+    async def getAggregates(self):
+        if self.metadataCache is not None:
+            found, missing = self.metadataCache.lookup('getAggregates', self._cacheOwner, [''])
+            if not missing:
+                return found['']
+        jsonData = {
+            'userToken': await self.userToken
+        }
+        aggregates = await self._singlePost('getAggregates', jsonData, 'aggregates')
+        if self.metadataCache is not None:
+            self.metadataCache.store('getAggregates', self._cacheOwner, {'': aggregates})
+        return aggregates
+
+    async def getQualities(self, qualities):
+        qualities = self._coerceToList(qualities)
+        if self.metadataCache is not None:
+            found, missing = self.metadataCache.lookup('getQualities', self._cacheOwner, [str(quality) for quality in qualities])
+            if not missing:
+                return found
+            # (Cached by the codes as strings, like Canary's answer, but asked for as given)
+            missing = set(missing)
+            qualities = [quality for quality in qualities if str(quality) in missing]
+        jsonData = {
+            'userToken': await self.userToken,
+            'qualities': qualities
+        }
+        qualityDict = await self._singlePost('getQualities', jsonData, 'qualities')
+        if self.metadataCache is not None and isinstance(qualityDict, dict):
+            self.metadataCache.store('getQualities', self._cacheOwner, qualityDict)
+            found.update(qualityDict)
+            return found
+        return qualityDict
+
+    async def getTagProperties(self, tags):
+        tagPaths = self._coerceToList(tags)
+        if self.metadataCache is not None:
+            tagPropDict, tagPaths = self.metadataCache.lookup('getTagProperties', self._cacheOwner, tagPaths)
+        if tagPaths or self.metadataCache is None:
+            jsonData = {
+                'userToken': await self.userToken,
+                'tags': tagPaths
+            }
+            fetched = await self._singlePost('getTagProperties', jsonData, 'properties')
+            if self.metadataCache is None:
+                tagPropDict = fetched
+            else:
+                fetched = {tagPath: fetched.get(tagPath, {}) for tagPath in tagPaths}
+                self.metadataCache.store('getTagProperties', self._cacheOwner, fetched)
+                tagPropDict.update(fetched)
+
+        if isinstance(tags, str):
+            return tagPropDict.get(tags, {})
+        else:
+            return ((tagPath, tagPropDict.get(tagPath, {})) for tagPath in tags)
+
+
+    async def _getTagData(self, tags, apiUrl='getTagData', **constraints):
+        jsonData = {
+            'userToken': await self.userToken,
+            'tags': self._coerceToList(tags)
+        }
+        jsonData.update(constraints)
+        async for page in self._iterPost(apiUrl, jsonData, 'data'):
+            yield page
+
+    async def _collectTagData(self, apiUrl, tags, constraints, stream=False, output='tvq'):
+        start, addItems, finish = _valueDecoder(output, self.lazyTimestamps)
+        _prepConstraints(constraints, anonymous=not self._username, timeExtension=True)
+
+        if stream:
+            return self._streamTagData(apiUrl, tags, constraints, output)
+
+        if self.tagDataCache is not None:
+            window = self.tagDataCache.window(self._cacheOwner, constraints)
+            if window:
+                return await self._readCachedTagData(apiUrl, tags, constraints, window, output)
+            self.tagDataCache.bypassed += 1 if isinstance(tags, str) else len(tags)
+
+        if self.queryPlanner is not None:
+            window = self.queryPlanner.window(constraints)
+            if window:
+                return await self._readPlannedTagData(apiUrl, tags, constraints, window, output)
+
+        if self.tagSharder is not None and self.tagSharder.applies(apiUrl, tags, constraints):
+            return await self._readShardedTagData(apiUrl, tags, constraints, output)
+
+        # If only a single tag path was provided, simply return values
+        if isinstance(tags, str):
+            values = start()
+            async for valueChunk in self._getTagData([tags], apiUrl, **constraints):
+                addItems(values, valueChunk.get(tags, []))
+            return finish(values)
+        else:
+            tagData = {tagPath: start() for tagPath in tags}
+            async for tagChunk in self._getTagData(tags, apiUrl, **constraints):
+                for tagPath,items in tagChunk.items():
+                    if tagPath in tagData:
+                        addItems(tagData[tagPath], items)
+            return ((tagPath, finish(tagData[tagPath])) for tagPath in tags)
+
+    async def _readCachedTagData(self, apiUrl, tags, constraints, window, output='tvq'):
+        """getTagData thru the tagDataCache (see CanaryView._readCachedTagData)"""
+        cache = self.tagDataCache
+        cacheKey, start, end = window
+        tagList = [tags] if isinstance(tags, str) else list(tags)
+        cached, tagsByMissing = cache.plan(cacheKey, start, cache.readEnd(cacheKey, end), tagList)
+
+        await self.userToken
+        argSets = fetchArgSets(tagsByMissing)
+        fetches = await self._fetchRanges(apiUrl, constraints, argSets)
+        for (rangeStart, rangeEnd, tagGroup), fetched in zip(argSets, fetches):
+            cache.putAll(cacheKey, rangeStart, rangeEnd, fetched)
+        results = cache.stitch(start, cached, tagsByMissing, fetches)
+
+        probe = cache.endProbe(self._cacheOwner, cacheKey, end, argSets, fetches, results)
+        if probe is not None:
+            probed = await self._fetchTagSeries(apiUrl, constraints, end - READ_PAST_END, end, [probe])
+            cache.learnEnd(self._cacheOwner, end, probed[probe])
+        results = cache.cutAtEnd(self._cacheOwner, cacheKey, end, results)
+
+        if isinstance(tags, str):
+            return _seriesAs(results[tags], output)
+        return ((tagPath, _seriesAs(results[tagPath], output)) for tagPath in tagList)
+
+    async def _readPlannedTagData(self, apiUrl, tags, constraints, window, output='tvq'):
+        """getTagData split up by the queryPlanner (see CanaryView._readPlannedTagData)"""
+        planner = self.queryPlanner
+        start, end = window
+        tagList = [tags] if isinstance(tags, str) else list(tags)
+
+        await self.userToken
+        contexts = await self.getTagContext(tagList) if planner.useContext else None
+        argSets = planner.plan(start, end, planner.bounds(start, end, tagList, contexts))
+        fetches = await self._fetchRanges(apiUrl, constraints, argSets)
+        results = planner.stitch(end, tagList, argSets, fetches)
+
+        if isinstance(tags, str):
+            return _seriesAs(results[tags], output)
+        return ((tagPath, _seriesAs(results[tagPath], output)) for tagPath in tagList)
+
+    async def _readShardedTagData(self, apiUrl, tags, constraints, output='tvq'):
+        """getTagData for a long tag list, a shard at a time (see CanaryView._readShardedTagData)"""
+        start, addItems, finish = _valueDecoder(output, self.lazyTimestamps)
+        tagList = list(tags)
+
+        async def fetchShard(shard):
+            shardData = {tagPath: start() for tagPath in shard}
+            valueCount = 0
+            async for tagChunk in self._getTagData(shard, apiUrl, **constraints):
+                for tagPath,items in tagChunk.items():
+                    if tagPath in shardData:
+                        addItems(shardData[tagPath], items)
+                        valueCount += len(items)
+            self.tagSharder.observe(len(shard), valueCount)
+            return shardData
+
+        await self.userToken
+        tagData = {}
+        for shardData in await self._mapConcurrently(fetchShard, self.tagSharder.split(tagList)):
+            tagData.update(shardData)
+        return ((tagPath, finish(tagData[tagPath])) for tagPath in tagList)
+
+    async def _fetchRanges(self, apiUrl, constraints, argSets):
+        """_fetchTagSeries for each of the argSets, sharded (see CanaryView._fetchRanges)"""
+        shardsByArgSet = [self.tagSharder.split(tagGroup) if self.tagSharder is not None else [tagGroup]
+                          for rangeStart, rangeEnd, tagGroup in argSets]
+        shardArgSets = [(rangeStart, rangeEnd, shard)
+                        for (rangeStart, rangeEnd, tagGroup), tagShards in zip(argSets, shardsByArgSet)
+                        for shard in tagShards]
+
+        async def fetch(argSet):
+            return await self._fetchTagSeries(apiUrl, constraints, *argSet)
+
+        shardFetches = iter(await self._mapConcurrently(fetch, shardArgSets))
+        fetches = []
+        for tagShards in shardsByArgSet:
+            fetched = {}
+            for shard in tagShards:
+                fetched.update(next(shardFetches))
+            fetches.append(fetched)
+        return fetches
+
+    async def _fetchTagSeries(self, apiUrl, constraints, rangeStart, rangeEnd, tagGroup):
+        """Each of the tags' samples from rangeStart to rangeEnd (in nanoseconds), as TvqSeries."""
+        fetched = {tagPath: TvqSeries() for tagPath in tagGroup}
+        rangeConstraints = dict(constraints, startTime=_isoTimestamp(rangeStart), endTime=_isoTimestamp(rangeEnd))
+        async for tagChunk in self._getTagData(tagGroup, apiUrl, **rangeConstraints):
+            for tagPath,items in tagChunk.items():
+                if tagPath in fetched:
+                    fetched[tagPath].extendItems(items)
+        if self.tagSharder is not None:
+            self.tagSharder.observe(len(tagGroup), sum(len(series) for series in fetched.values()))
+        return fetched
+
+    async def _streamTagData(self, apiUrl, tags, constraints, output='tvq'):
+        start, addItems, finish = _valueDecoder(output, self.lazyTimestamps)
+        if isinstance(tags, str):
+            async for valueChunk in self._getTagData([tags], apiUrl, **constraints):
+                values = finish(addItems(start(), valueChunk.get(tags, [])))
+                if output == 'tvq':
+                    for value in values:
+                        yield value
+                else:
+                    yield values
+        else:
+            wanted = set(tags)
+            async for tagChunk in self._getTagData(tags, apiUrl, **constraints):
+                for tagPath,items in tagChunk.items():
+                    if tagPath in wanted:
+                        yield tagPath, finish(addItems(start(), items))
+
+    async def getTagData(self, tags, stream=False, output='tvq', **constraints):
+        """Returns the data for the given tags. (See CanaryView.getTagData)
+        A single tag path returns its list of values, while a list of tags
+          returns an iterable of tag paths and their values.
+        With stream=True an async generator is returned instead, yielding 
+          results as each page arrives. output='numpy' gives column arrays 
+          instead of Tvqs.
+        Unlike CanaryView.getTagData, a failed call raises its error
+          (rather than printing it and handing back empty results).
+        """
+        return await self._collectTagData('getTagData', tags, constraints, stream, output)
+
+    async def getTagData2(self, tags, stream=False, output='tvq', **constraints):
+        """Like getTagData, but maxSize is per tag. (See CanaryView.getTagData2)"""
+        return await self._collectTagData('getTagData2', tags, constraints, stream, output)
+
+
+    async def getLiveData(self, tags=None, **configuration):
+        """Async generator of the live data for the given tag(s). (See CanaryView.getLiveData)"""
+        if not tags:
+            if not len(self._liveDataTokens) == 1:
+                raise ValueError("getLiveData() called without a tag list _and_ did not have only one live data token.")
+            justThatTagMaam = False
+            liveDataToken = list(self._liveDataTokens.values())[0]
+        else:
+            justThatTagMaam = isinstance(tags, str)
+
+            tags = self._coerceToList(tags)
+            tagSet = frozenset(tags)
+            if not tagSet in self._liveDataTokens:
+                await self._getLiveDataToken(tags, **configuration)
+            liveDataToken = self._liveDataTokens[tagSet]
+
+        jsonData = {
+            "userToken": await self.userToken,
+            "liveDataToken":liveDataToken,
+        }
+        if justThatTagMaam:
+            tagPath = tags[0]
+            async for page in self._iterPost('getLiveData', jsonData, 'data'):
+                if not tagPath in page:
+                    continue
+                for value in page[tagPath]:
+                    yield Tvq(*value)
+        else:
+            async for page in self._iterPost('getLiveData', jsonData, 'data'):
+                for tagPath,values in page.items():
+                    yield tagPath, [Tvq(*value) for value in values]
+
+
+    async def subscribeLiveData(self, tags, callback=None, maxQueued=None, **configuration):
+        """Follow the live data for the given tag(s) with a background task. (See CanaryView.subscribeLiveData)
+        The subscription's queue is read with await get() or async for.
+        """
+        await self.userToken
+        return await self.liveDataEngine.subscribe(tags, callback, maxQueued, **configuration)
+
+    async def _pollLiveData(self, key):
+        jsonData = {
+            "userToken": await self.userToken,
+            "liveDataToken": self._liveDataTokens[key],
+        }
+        batch = {}
+        async for page in self._iterPost('getLiveData', jsonData, 'data'):
+            for tagPath,values in page.items():
+                batch.setdefault(tagPath, []).extend(tvqsFromLiveValues(values, self.lazyTimestamps))
+        return batch
+
+    async def _getAnnotations(self, tags, startTime, endTime, **constraints):
+        jsonData = {
+            'userToken': await self.userToken,
+            'tags': self._coerceToList(tags),
+            'startTime': startTime,
+            'endTime': endTime
+        }
+        jsonData.update(constraints)
+        async for annotationChunk in self._iterPost('getAnnotations', jsonData, 'annotations'):
+            yield annotationChunk
+
+    async def getAnnotations(self, tags, startTime, endTime,
+                             chunkSize=DEFAULT_TAG_CHUNK_SIZE, maxWorkers=DEFAULT_MAX_WORKERS, **constraints):
+        """Get annotations from requested tags within the given time interval.
+        Tags are requested chunkSize at a time, with up to maxWorkers requests in flight.
+        """
+        _prepConstraints(constraints, anonymous=not self._username)
+
+        async def getChunk(tagChunk):
+            return [annotationChunk async for annotationChunk 
+                    in self._getAnnotations(tagChunk, startTime, endTime, **constraints)]
+
+        tagAnnotations = {tagPath: [] for tagPath in self._coerceToList(tags)}
+        await self.userToken
+        for annotationChunks in await self._mapConcurrently(getChunk, chunks(list(tagAnnotations), chunkSize), maxWorkers):
+            for annotationChunk in annotationChunks:
+                if isinstance(annotationChunk, dict) and annotationChunk.get('tagName') in tagAnnotations:
+                    tagAnnotations[annotationChunk['tagName']].extend(annotationChunk.get('annotations', []))
+
+        if isinstance(tags, str):
+            return tagAnnotations[tags]
+        return tagAnnotations
+
+
+    async def _getTagContext(self, tags, **constraints):
+        jsonData = {
+            'userToken': await self.userToken,
+            'tags': self._coerceToList(tags)
+        }
+        jsonData.update(constraints)
+        async for contextChunk in self._iterPost('getTagContext', jsonData, 'data'):
+            yield contextChunk
+
+    async def getTagContext(self, tags,
+                            chunkSize=DEFAULT_TAG_CHUNK_SIZE, maxWorkers=DEFAULT_MAX_WORKERS, **constraints):
+        """Get context for requested tags including both the oldest and latest timestamps.
+        Tags are requested chunkSize at a time, with up to maxWorkers requests in flight.
+        """
+        _prepConstraints(constraints, anonymous=not self._username)
+
+        async def getChunk(tagChunk):
+            return [contextChunk async for contextChunk in self._getTagContext(tagChunk, **constraints)]
+
+        tagContexts = {tagPath: {} for tagPath in self._coerceToList(tags)}
+        await self.userToken
+        for contextChunks in await self._mapConcurrently(getChunk, chunks(list(tagContexts), chunkSize), maxWorkers):
+            for contextChunk in contextChunks:
+                if isinstance(contextChunk, dict) and contextChunk.get('tagName') in tagContexts:
+                    tagContexts[contextChunk['tagName']] = contextChunk.get('tagContext', {})
+
+        if isinstance(tags, str):
+            return tagContexts[tags]
+        return tagContexts
+
+
+    # Error Handling
+
+    async def _post(self, apiUrl, jsonData):
+        results = await super()._post(apiUrl, jsonData)
+
+        if results['statusCode'] == 'BadLicense':
+            raise RuntimeError("The target Canary instance is not licensed for third party View usage.")
+        return results
+
+    def _raiseUnhandledPostError(self, apiUrl, jsonData, results=None):
+        if results is None:
+            results = self.lastResults
+        if results['statusCode'] != 'Good':
+            if jsonData and 'password' in jsonData:
+                jsonData['password'] = '****'
+            raise RuntimeError('Canary API call to "%s" had errors: %r.\nData passed: %r' % (
+                apiUrl, results.get('errors', []), jsonData))
+
+
+class AsyncCanarySender(AsyncSessionTokenManagement):
+
+    def __init__(self,
+                 httpPort =DEFAULT_SENDER_PORT_ANONYMOUS_HTTP,
+                 httpsPort=DEFAULT_SENDER_PORT_USERNAME_HTTPS,
+                 **configuration):
+        """Canary Sender interface for asyncio. See CanarySender for the details of each call.
+
+        Use with an async context manager for automatic token management:
+
+            async with AsyncCanarySender() as send:
+                await send.storeData(tvqs)
+        """
+        self._lastStoredTags = set()
+        super().__init__(httpPort =httpPort, httpsPort=httpsPort, **configuration)
+
+
+    # Storage - File options
+
+    async def createNewFile(self, dataset, timestamp):
+        jsonData = {
+            "userToken": await self.userToken,
+            "sessionToken": await self.sessionToken,
+            "dataset":dataset,
+            "fileTime":timestamp
+        }
+        await self._post('createNewFile', jsonData)
+
+    async def fileRollover(self, dataset, timestamp):
+        jsonData = {
+            "userToken": await self.userToken,
+            "sessionToken": await self.sessionToken,
+            "dataset":dataset,
+            "fileTime":timestamp
+        }
+        await self._post('fileRollOver', jsonData)
+
+
+    # Storage - Configuration
+
+    async def configureTags(self, tags):
+        jsonData = {
+            "userToken": await self.userToken,
+            "sessionToken": await self.sessionToken,
+            "tags": tags
+        }
+        await self._post("configureTags", jsonData)
+
+
+    # Storage - Data
+
+    async def storeData(self, tvqs={}, properties={}, annotations={}, maxPageSize=25000, maxPageBytes=None, maxWorkers=DEFAULT_MAX_WORKERS):
+        """Store data in the historian. (See CanarySender.storeData)
+        Up to maxWorkers pages are sent at once, but each tag's pages land in order.
+        """
+        dataToSend = _packageData(tvqs, properties, annotations)
+
+        await self._storePages(_pageData(dataToSend, maxPageSize, maxPageBytes, self._packagePayload), maxWorkers)
+
+        self._lastStoredTags = set(tvqs.keys()) | set(properties.keys()) | set(annotations.keys())
+
+    async def _storePages(self, pages, maxWorkers=DEFAULT_MAX_WORKERS):
+        """Send the storeData pages, each waiting for the earlier pages that share any of its tags."""
+        # Get the tokens up front so the pages don't race for them
+        await self.sessionToken
+
+        throttle = asyncio.Semaphore(max(1, maxWorkers))
+
+        async def storePageAfter(waitFor, pageDict):
+            for earlier in waitFor:
+                await earlier
+            async with throttle:
+                await self._storeData(**pageDict)
+
+        lastSentFor = {}
+        inFlight = []
+        try:
+            for pageDict in pages:
+                tags = _pageTags(pageDict)
+                waitFor = {lastSentFor[tag] for tag in tags if tag in lastSentFor}
+                sent = asyncio.ensure_future(storePageAfter(waitFor, pageDict))
+                for tag in tags:
+                    lastSentFor[tag] = sent
+                inFlight.append(sent)
+                # Don't slice out pages much faster than they're sent
+                if len(inFlight) > 2 * maxWorkers:
+                    await inFlight.pop(0)
+            await asyncio.gather(*inFlight)
+        finally:
+            for sent in inFlight:
+                sent.cancel()
+
+    async def _storeData(self, tvqs={}, properties={}, annotations={}):
+        """The call that executes storeData."""
+        dataEntry = {
+            "userToken": await self.userToken,
+            "sessionToken": await self.sessionToken,
+        }
+        if any((tvqs, properties, annotations)):
+            if tvqs:
+                dataEntry['tvqs'] = tvqs
+            if properties:
+                dataEntry['properties'] = properties
+            if annotations:
+                dataEntry['annotations'] = annotations
+            await self._post('storeData', dataEntry)
+
+    async def noData(self, tags=[]):
+        if not tags:
+            assert self._lastStoredTags, "Can't set 'No Data' without context. No tags given and _lastStoredTags is empty."
+            tags = self._lastStoredTags
+
+        dataEntry = {
+            "userToken": await self.userToken,
+            "sessionToken": await self.sessionToken,
+            "tags": self._coerceToList(tags)
+        }
+        await self._post('noData', dataEntry)
+
+
+    # Info services
+
+    async def version(self):
+        jsonData = {
+            "userToken": await self.userToken
+        }
+        return await self._singlePost("version", jsonData, "version")
+
+    async def compatibleVersion(self):
+        jsonData = {
+            "userToken": await self.userToken
+        }
+        return await self._singlePost("compatibleVersion", jsonData, "compatibleVersion")
+
+    async def getDatasets(self, historian):
+        jsonData = {
+            "userToken": await self.userToken,
+            "historian": historian
+        }
+        return await self._singlePost("getDatasets", jsonData, "datasets")
@@ -0,0 +1,128 @@
+"""
+	JSON codecs for the wire.
+
+	Payloads and responses can run to megabytes, so encoding and decoding them is
+	often where the client spends most of its CPU. orjson is used if it's installed,
+	then ujson, then the standard library's json. Every codec turns objects into
+	UTF-8 bytes and takes raw response bytes back, so nothing has to be decoded
+	to a str first.
+
+	Dates and times (including arrow.Arrow) are sent as ISO8601 strings by all of them.
+
+	Pick one explicitly with the jsonCodec argument, by name or as an instance:
+
+		CanaryView(jsonCodec='json')
+
+"""
+import json
+
+# For JSON payload packaging, import these for easier/auto serializing
+from datetime import datetime, date
+import arrow
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _coerceForJSON(thing):
+    """JSON serializes directly or not at all.
+    Dates are easy though.
+    (orjson handles datetimes itself, so it only needs this for Arrow)
+    """
+    if isinstance(thing, (datetime, date, arrow.Arrow)):
+        return thing.isoformat()
+    raise TypeError('Object of type %s is not JSON serializable' % type(thing).__name__)
+
+
+class JsonCodec(object):
+    """The standard library's json. Always there, and the slowest."""
+
+    __slots__ = ('_encoder',)
+
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(default=_coerceForJSON)
+
+    def dumps(self, thing):
+        return self._encoder.encode(thing).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson, with datetime handling built in.
+    Anything orjson won't take (like NaN in a response) falls back to the standard library.
+    """
+
+    __slots__ = ()
+
+    name = 'orjson'
+
+    def dumps(self, thing):
+        try:
+            return orjson.dumps(thing, default=_coerceForJSON, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            return super().dumps(thing)
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return super().loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    """ujson, for when orjson isn't around.
+    Anything ujson won't take falls back to the standard library.
+    """
+
+    __slots__ = ()
+
+    name = 'ujson'
+
+    def dumps(self, thing):
+        try:
+            return ujson.dumps(thing, default=_coerceForJSON, escape_forward_slashes=False).encode('utf-8')
+        except (TypeError, ValueError, OverflowError):
+            return super().dumps(thing)
+
+    def loads(self, data):
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return super().loads(data)
+
+
+# In order of preference
+CODECS = {}
+if orjson is not None:
+    CODECS['orjson'] = OrjsonCodec
+if ujson is not None:
+    CODECS['ujson'] = UjsonCodec
+CODECS['json'] = JsonCodec
+
+_codecInstances = {}
+
+
+def getCodec(codec=None):
+    """Get a JSON codec by name ('orjson', 'ujson' or 'json'), or the fastest installed if None.
+    Codec instances are passed thru as-is.
+    """
+    if codec is None:
+        codec = next(iter(CODECS))
+    if not isinstance(codec, str):
+        return codec
+    if codec not in CODECS:
+        raise ValueError("JSON codec '%s' isn't available. Installed: %s" % (codec, ', '.join(CODECS)))
+    if codec not in _codecInstances:
+        _codecInstances[codec] = CODECS[codec]()
+    return _codecInstances[codec]
@@ -0,0 +1,597 @@
+"""
+	An in-process stand-in for Canary's REST services, for testing and benchmarking.
+
+	FakeCanary serves the view and sender endpoints birdsong calls, over plain
+	HTTP on localhost, from a background thread. Point a CanaryView or
+	CanarySender (or their asyncio flavors) at it with **fake.connection and
+	everything from getTagData continuations to live data tokens and storeData
+	works without a real historian.
+
+	Tags come from two places:
+	 - Synthetic tags have a sample every interval seconds from their start,
+	   worked out on demand, so millions of samples cost nothing until they're read.
+	   Without an end they keep going up to the present, and so make live data too.
+	 - Stored tags hold whatever storeData sent them (or addSamples put there).
+	The fake keeps one namespace, so a tag stored as 'Plant.Line1.Speed' is read
+	back under that same path.
+
+	To look like the real thing over a network, each call can be held up by
+	latency seconds, and getTagData answers pageSize values at a time. To test
+	error handling, inject() makes the next calls fail with a Canary status
+	(like BadUserToken or BadSessionToken, which also drop the token involved)
+	or an HTTP error (or a response that won't decompress). expireTokens() drops
+	every token, as a restart would.
+
+	Windows run from startTime up to (but not including) endTime, or thru it with
+	endInclusive=True. Timestamps are written in UTC, or at utcOffset seconds
+	from it. Aggregates and includeBounds aren't calculated - aggregate calls 
+	are answered with an error.
+
+"""
+import gzip
+import json
+import re
+import threading
+import time
+import zlib
+from bisect import bisect_left, insort
+from collections import Counter, deque
+from datetime import timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from operator import itemgetter
+
+import ciso8601
+
+from .values import _asEpochNanoseconds, _epochDatetime
+
+
+DEFAULT_PAGE_SIZE = 10000  # values per getTagData page
+DEFAULT_BROWSE_PAGE_SIZE = 1000  # tags per browseTags page
+
+GOOD_QUALITY = 192
+
+# inject() this to answer a call with a body that claims to be gzipped but isn't
+CORRUPT_RESPONSE = 'CorruptResponse'
+
+FAKE_QUALITIES = {
+    '0': 'Bad',
+    '64': 'Uncertain',
+    '192': 'Good',
+}
+
+FAKE_AGGREGATES = {
+    'TimeAverage2': 'Time weighted average of the values in each interval',
+    'Count': 'Number of values in each interval',
+}
+
+# Relative times like 'Now', 'Now-1Day' or 'now - 30s'
+RELATIVE_TIME_PATTERN = re.compile(r'^\s*now\s*(?:([+-])\s*(\d+(?:\.\d+)?)\s*([a-z]*))?\s*$', re.IGNORECASE)
+RELATIVE_TIME_UNITS = {
+    '': 1, 's': 1, 'sec': 1, 'second': 1, 'seconds': 1,
+    'm': 60, 'min': 60, 'minute': 60, 'minutes': 60,
+    'h': 3600, 'hour': 3600, 'hours': 3600,
+    'd': 86400, 'day': 86400, 'days': 86400,
+    'w': 604800, 'week': 604800, 'weeks': 604800,
+}
+
+_sampleTime = itemgetter(0)
+
+
+def _isoTimestamp(nanoseconds, tz=None):
+    timestamp = _epochDatetime(nanoseconds)
+    return (timestamp.astimezone(tz) if tz else timestamp).isoformat()
+
+
+def _parseTime(timestamp, default):
+    """Nanoseconds since the epoch for an absolute or 'Now-1Day' style time (None gives the default)"""
+    if timestamp is None or timestamp == '':
+        return default
+    match = RELATIVE_TIME_PATTERN.match(str(timestamp))
+    if match:
+        sign, amount, unit = match.groups()
+        offset = float(amount or 0) * RELATIVE_TIME_UNITS[(unit or '').lower()]
+        return time.time_ns() + int((-offset if sign == '-' else offset) * 1e9)
+    return _asEpochNanoseconds(ciso8601.parse_datetime(timestamp) if isinstance(timestamp, str) else timestamp)
+
+
+def defaultSyntheticValue(tagIndex, sampleIndex):
+    """A sawtooth, offset per tag so tags can be told apart"""
+    return float(tagIndex * 1000 + sampleIndex % 1000)
+
+
+class SyntheticTag(object):
+    """A sample every interval from start (until end, if there is one)"""
+
+    __slots__ = ('tagIndex', 'start', 'interval', 'end', 'valueOf')
+
+    def __init__(self, tagIndex, start, interval, end=None, valueOf=defaultSyntheticValue):
+        self.tagIndex = tagIndex
+        self.start = start
+        self.interval = interval
+        self.end = end
+        self.valueOf = valueOf
+
+    def _range(self, start, end):
+        """Sample indexes from start up to end"""
+        end = min(end, self.end if self.end is not None else time.time_ns() + 1)
+        first = max(0, -(-(start - self.start) // self.interval))
+        last = max(0, -(-(end - self.start) // self.interval))
+        return first, max(first, last)
+
+    def count(self, start, end):
+        first, last = self._range(start, end)
+        return last - first
+
+    def samples(self, start, end, lo=0, hi=None):
+        """The (timestamp, value, quality) samples from start up to end, sliced [lo:hi]"""
+        first, last = self._range(start, end)
+        last = last if hi is None else min(last, first + hi)
+        return [(self.start + ix * self.interval, self.valueOf(self.tagIndex, ix), GOOD_QUALITY)
+                for ix in range(first + lo, last)]
+
+
+class StoredTag(object):
+    """Samples sent in by storeData, kept in time order"""
+
+    __slots__ = ('_samples',)
+
+    def __init__(self):
+        self._samples = []
+
+    def add(self, timestamp, value, quality=GOOD_QUALITY):
+        insort(self._samples, (timestamp, value, quality), key=_sampleTime)
+
+    def _range(self, start, end):
+        return (bisect_left(self._samples, start, key=_sampleTime),
+                bisect_left(self._samples, end, key=_sampleTime))
+
+    def count(self, start, end):
+        first, last = self._range(start, end)
+        return last - first
+
+    def samples(self, start, end, lo=0, hi=None):
+        first, last = self._range(start, end)
+        last = last if hi is None else min(last, first + hi)
+        return self._samples[first + lo:last]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Hands each POST to the FakeCanary the server belongs to"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+
+        apiName = self.path.rstrip('/').rsplit('/', 1)[-1]
+        status, results = fake.handle(apiName, json.loads(body or b'{}'))
+
+        content = json.dumps(results).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if results.get('statusCode') == CORRUPT_RESPONSE:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeCanary(object):
+    """A Canary look-alike serving the view and sender APIs on localhost.
+
+    Use it as a context manager (or call start and stop):
+
+        with FakeCanary(latency=0.02, pageSize=1000) as fake:
+            fake.addSyntheticTags(['Fake.Line1.Speed'], start='2024-01-01T00:00:00Z', interval=60)
+            with CanaryView(**fake.connection) as view:
+                values = view.getTagData('Fake.Line1.Speed', start='2024-01-01T00:00:00Z', end='2024-01-02T00:00:00Z')
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0,
+                 pageSize=DEFAULT_PAGE_SIZE, browsePageSize=DEFAULT_BROWSE_PAGE_SIZE,
+                 utcOffset=0, endInclusive=False):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.pageSize = pageSize
+        self.browsePageSize = browsePageSize
+        self.endInclusive = endInclusive
+        self._timezone = timezone(timedelta(seconds=utcOffset)) if utcOffset else None
+
+        # Calls answered, by endpoint
+        self.calls = Counter()
+
+        self._tags = {}
+        self._properties = {}
+        self._annotations = {}
+        self._sequences = Counter()
+        self._userTokens = set()
+        self._sessionTokens = set()
+        self._liveDataTokens = {}
+        self._injected = deque()
+        self._tokenCount = 0
+        self._lock = threading.RLock()
+        self._server = None
+
+    # Running the server
+
+    def start(self):
+        if self._server is None:
+            self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+            self._server.daemon_threads = True
+            self._server.fake = self
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, name='birdsong-FakeCanary', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def connection(self):
+        """Arguments that point a view or sender at the fake"""
+        return {'host': self.host, 'https': False, 'httpPort': self.port}
+
+    # Setting up data
+
+    def addSyntheticTags(self, tags, start, interval=1.0, end=None, valueOf=defaultSyntheticValue):
+        """Add tags that have a sample every interval seconds from start (until end, or forever).
+        Give a list of tag paths, or a number of tags to make up (named Fake.Synthetic.Tag0, ...).
+        valueOf(tagIndex, sampleIndex) gives each value. Returns the tag paths.
+        """
+        if isinstance(tags, int):
+            tags = ['Fake.Synthetic.Tag%d' % ix for ix in range(tags)]
+        start = _parseTime(start, None)
+        end = _parseTime(end, None)
+        with self._lock:
+            for tagPath in tags:
+                self._addTag(tagPath, SyntheticTag(len(self._tags), start, int(interval * 1e9), end, valueOf))
+        return list(tags)
+
+    def addSamples(self, tagPath, samples):
+        """Store (timestamp, value[, quality]) samples for the tag, as storeData would"""
+        with self._lock:
+            tag = self._storedTag(tagPath)
+            for sample in samples:
+                tag.add(_parseTime(sample[0], None), *sample[1:3])
+
+    def samples(self, tagPath, start=None, end=None):
+        """The tag's (nanoseconds, value, quality) samples in the window (all of them by default)"""
+        with self._lock:
+            tag = self._tags.get(tagPath)
+            if tag is None:
+                return []
+            return tag.samples(_parseTime(start, -2**62), _parseTime(end, 2**62))
+
+    def setProperties(self, tagPath, properties):
+        with self._lock:
+            self._properties.setdefault(tagPath, {}).update(properties)
+
+    # Failures
+
+    def inject(self, statusCode, apiName=None, count=1):
+        """Fail the next count calls (to apiName, or to anything) with the status code.
+        A string is answered as a Canary statusCode (BadUserToken and BadSessionToken also drop
+          the token the call used), and a number as that HTTP status.
+          CORRUPT_RESPONSE answers with a body that can't be decompressed.
+        """
+        with self._lock:
+            for _ in range(count):
+                self._injected.append((statusCode, apiName))
+
+    def expireTokens(self):
+        """Forget every user, session and live data token, as if Canary restarted"""
+        with self._lock:
+            self._userTokens.clear()
+            self._sessionTokens.clear()
+            self._liveDataTokens.clear()
+
+    # Answering calls
+
+    def handle(self, apiName, request):
+        """The HTTP status and results for a call"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[apiName] += 1
+
+            failure = self._takeInjected(apiName)
+            if isinstance(failure, int):
+                return failure, {'statusCode': 'Error', 'errors': ['HTTP %d' % failure]}
+            if failure:
+                if failure == 'BadUserToken':
+                    self._userTokens.discard(request.get('userToken'))
+                elif failure == 'BadSessionToken':
+                    self._sessionTokens.discard(request.get('sessionToken'))
+                return 200, self._bad(failure)
+
+            endpoint = getattr(self, '_api_' + apiName, None)
+            if endpoint is None:
+                return 404, self._bad('Error', 'Unknown API "%s"' % apiName)
+            if apiName != 'getUserToken' and request.get('userToken') not in self._userTokens:
+                return 200, self._bad('BadUserToken')
+            if 'sessionToken' in request and apiName != 'revokeSessionToken' \
+                    and request['sessionToken'] not in self._sessionTokens:
+                return 200, self._bad('BadSessionToken')
+            try:
+                results = endpoint(request) or {}
+            except Exception as e:
+                return 200, self._bad('Error', '%s: %s' % (e.__class__.__name__, e))
+        results.setdefault('statusCode', 'Good')
+        results.setdefault('errors', [])
+        return 200, results
+
+    def _takeInjected(self, apiName):
+        for ix, (statusCode, injectedApi) in enumerate(self._injected):
+            if injectedApi is None or injectedApi == apiName:
+                del self._injected[ix]
+                return statusCode
+        return None
+
+    @staticmethod
+    def _bad(statusCode, message=None):
+        return {'statusCode': statusCode, 'errors': [message or statusCode]}
+
+    def _newToken(self, kind):
+        self._tokenCount += 1
+        return '%s-%d' % (kind, self._tokenCount)
+
+    def _addTag(self, tagPath, tag):
+        if tagPath not in self._tags:
+            self._sequences[tagPath.split('.', 1)[0]] += 1
+        self._tags[tagPath] = tag
+
+    def _storedTag(self, tagPath):
+        tag = self._tags.get(tagPath)
+        if tag is None:
+            tag = StoredTag()
+            self._addTag(tagPath, tag)
+        elif not isinstance(tag, StoredTag):
+            raise ValueError('%s is a synthetic tag and can\'t be stored to' % tagPath)
+        return tag
+
+    # Tokens
+
+    def _api_getUserToken(self, request):
+        token = self._newToken('userToken')
+        self._userTokens.add(token)
+        return {'userToken': token}
+
+    def _api_revokeUserToken(self, request):
+        self._userTokens.discard(request['userToken'])
+
+    def _api_getSessionToken(self, request):
+        token = self._newToken('sessionToken')
+        self._sessionTokens.add(token)
+        return {'sessionToken': token}
+
+    def _api_revokeSessionToken(self, request):
+        self._sessionTokens.discard(request.get('sessionToken'))
+
+    def _api_keepAlive(self, request):
+        pass
+
+    def _api_getErrors(self, request):
+        return {'errors': []}
+
+    def _api_updateSettings(self, request):
+        pass
+
+    # Browsing
+
+    def _children(self, path):
+        """Tag paths under the path (all of them for '')"""
+        prefix = path + '.' if path else ''
+        return [tagPath for tagPath in sorted(self._tags) if tagPath.startswith(prefix)]
+
+    def _api_browseNodes(self, request):
+        path = request.get('path') or ''
+        depth = len(path.split('.')) if path else 0
+        nodes = {tagPath.split('.')[depth] for tagPath in self._children(path)
+                 if len(tagPath.split('.')) > depth + 1}
+        return {'nodes': sorted(nodes)}
+
+    def _api_browseTags(self, request):
+        path = request.get('path') or ''
+        search = (request.get('search') or '').lower()
+        depth = len(path.split('.')) if path else 0
+        tags = [tagPath for tagPath in self._children(path)
+                if (request.get('deep') or len(tagPath.split('.')) == depth + 1) and search in tagPath.lower()]
+        offset = int(request.get('continuation') or 0)
+        page = tags[offset:offset + self.browsePageSize]
+        more = offset + self.browsePageSize < len(tags)
+        return {'tags': page, 'continuation': offset + self.browsePageSize if more else None}
+
+    def _api_browseStatus(self, request):
+        return {'views': {viewName: {'sequence': self._sequences[viewName]}
+                          for viewName in request.get('views') or []}}
+
+    # Reading
+
+    def _api_getAggregates(self, request):
+        return {'aggregates': dict(FAKE_AGGREGATES)}
+
+    def _api_getQualities(self, request):
+        codes = request.get('qualities') or []
+        if not all(isinstance(code, int) for code in codes):
+            raise ValueError('Quality codes are numbers, not %r' % (codes,))
+        return {'qualities': {str(code): FAKE_QUALITIES.get(str(code), 'Unknown') for code in codes}}
+
+    def _api_getTagProperties(self, request):
+        return {'properties': {tagPath: dict(self._properties.get(tagPath, {}))
+                               for tagPath in request.get('tags') or []}}
+
+    def _api_getTagContext(self, request):
+        contexts = []
+        for tagPath in request.get('tags') or []:
+            tag = self._tags.get(tagPath)
+            samples = tag.samples(-2**62, 2**62) if isinstance(tag, StoredTag) else None
+            if isinstance(tag, SyntheticTag):
+                last = tag.count(tag.start, 2**62) - 1
+                bounds = (tag.start, tag.start + last * tag.interval) if last >= 0 else None
+            else:
+                bounds = (samples[0][0], samples[-1][0]) if samples else None
+            context = {'oldestTimeStamp': _isoTimestamp(bounds[0]),
+                       'latestTimeStamp': _isoTimestamp(bounds[1])} if bounds else {}
+            contexts.append({'tagName': tagPath, 'tagContext': context})
+        return {'data': contexts}
+
+    def _api_getTagData(self, request, perTag=False):
+        if request.get('aggregateName'):
+            raise ValueError('FakeCanary does not calculate aggregates')
+        now = time.time_ns()
+        end = _parseTime(request.get('endTime'), now)
+        start = _parseTime(request.get('startTime'), end - 86400 * 10**9)
+        if self.endInclusive:
+            end += 1
+        maxSize = request.get('maxSize')
+        includeQuality = request.get('includeQuality', False)
+
+        # How many values each tag has, within maxSize (per tag for getTagData2, or in all)
+        counts, left = [], maxSize
+        for tagPath in request.get('tags') or []:
+            tag = self._tags.get(tagPath)
+            count = tag.count(start, end) if tag else 0
+            if maxSize is not None:
+                count = min(count, maxSize if perTag else left)
+                left -= 0 if perTag else count
+            counts.append((tagPath, tag, count))
+
+        # The page is the pageSize values from the continuation on, tag by tag
+        offset = int(request.get('continuation') or 0)
+        cursor, room, data = 0, self.pageSize, {}
+        for tagPath, tag, count in counts:
+            if room and cursor + count > offset:
+                lo = max(0, offset - cursor)
+                hi = min(count, lo + room)
+                data[tagPath] = [self._valueObject(sample, includeQuality) for sample in tag.samples(start, end, lo, hi)]
+                room -= hi - lo
+            cursor += count
+        following = offset + self.pageSize
+        return {'data': data, 'continuation': following if following < cursor else None}
+
+    def _api_getTagData2(self, request):
+        return self._api_getTagData(request, perTag=True)
+
+    def _valueObject(self, sample, includeQuality):
+        value = {'t': _isoTimestamp(sample[0], self._timezone), 'v': sample[1]}
+        if includeQuality:
+            value['q'] = sample[2]
+        return value
+
+    def _api_getAnnotations(self, request):
+        start = _parseTime(request.get('startTime'), -2**62)
+        end = _parseTime(request.get('endTime'), 2**62)
+        return {'annotations': [
+            {'tagName': tagPath,
+             'annotations': [annotation for timestamp, annotation in self._annotations.get(tagPath, [])
+                             if start <= timestamp < end]}
+            for tagPath in request.get('tags') or []]}
+
+    # Live data
+
+    def _api_getLiveDataToken(self, request):
+        token = self._newToken('liveDataToken')
+        self._liveDataTokens[token] = {
+            'tags': list(request.get('tags') or []),
+            'mode': request.get('mode', 'AllValues'),
+            'includeQuality': request.get('includeQuality', False),
+            'after': {},  # tag path -> timestamp of the last value handed out
+        }
+        return {'liveDataToken': token}
+
+    def _api_revokeLiveDataToken(self, request):
+        self._liveDataTokens.pop(request.get('liveDataToken'), None)
+
+    def _api_getLiveData(self, request):
+        subscription = self._liveDataTokens.get(request.get('liveDataToken'))
+        if subscription is None:
+            return self._bad('BadLiveDataToken')
+        now = time.time_ns() + 1
+        data = {}
+        for tagPath in subscription['tags']:
+            tag = self._tags.get(tagPath)
+            if tag is None:
+                continue
+            after = subscription['after'].get(tagPath)
+            if after is None:
+                # The first poll gets the current value
+                count = tag.count(-2**62, now)
+                samples = tag.samples(-2**62, now, count - 1) if count else []
+            else:
+                samples = tag.samples(after + 1, now)
+                if subscription['mode'] != 'AllValues':
+                    samples = samples[-1:]
+            if samples:
+                subscription['after'][tagPath] = samples[-1][0]
+                data[tagPath] = [[_isoTimestamp(timestamp, self._timezone), value] + ([quality] if subscription['includeQuality'] else [])
+                                 for timestamp, value, quality in samples]
+            elif after is None:
+                subscription['after'][tagPath] = -2**62
+        return {'data': data}
+
+    # Sending
+
+    def _api_storeData(self, request):
+        for tagPath, values in (request.get('tvqs') or {}).items():
+            tag = self._storedTag(tagPath)
+            for value in values:
+                if isinstance(value, dict):
+                    value = (value.get('t', value.get('timestamp')), value.get('v', value.get('value')),
+                             value.get('q', value.get('quality', GOOD_QUALITY)))
+                quality = value[2] if len(value) > 2 and value[2] is not None else GOOD_QUALITY
+                tag.add(_parseTime(value[0], None), value[1], quality)
+        for tagPath, values in (request.get('properties') or {}).items():
+            self._storedTag(tagPath)
+            for name, timestamp, value, *quality in values:
+                self._properties.setdefault(tagPath, {})[name] = value
+        for tagPath, values in (request.get('annotations') or {}).items():
+            self._storedTag(tagPath)
+            for user, timestamp, value, *createdAt in values:
+                self._annotations.setdefault(tagPath, []).append((_parseTime(timestamp, None), {
+                    'user': user, 'timestamp': timestamp, 'value': value,
+                    'createdAt': createdAt[0] if createdAt else None}))
+
+    def _api_noData(self, request):
+        for tagPath in request.get('tags') or []:
+            self._storedTag(tagPath)
+
+    def _api_createNewFile(self, request):
+        pass
+
+    def _api_fileRollOver(self, request):
+        pass
+
+    def _api_configureTags(self, request):
+        pass
+
+    def _api_version(self, request):
+        return {'version': 'FakeCanary'}
+
+    def _api_compatibleVersion(self, request):
+        return {'compatibleVersion': 'v2'}
+
+    def _api_getDatasets(self, request):
+        return {'datasets': sorted({tagPath.split('.', 1)[0] for tagPath in self._tags})}
+
+    def __repr__(self):
+        return '<FakeCanary %d tags at %s:%s%s>' % (len(self._tags), self.host, self.port,
+                                                     '' if self._server else ' (stopped)')
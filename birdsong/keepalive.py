@@ -0,0 +1,56 @@
+"""
+	Background keep-alive for tokens and sessions.
+
+	Canary drops a sender session once it's gone clientTimeout without hearing
+	from the client, and the next call then fails with BadSessionToken and has to
+	start a new session. With autoKeepAlive=True, a background thread checks in
+	well before that: whenever the client has been idle for a third of the timeout,
+	it calls keepAlive. If userTokenLifetime is given, it also gets a new user token
+	once the current one is half that old. That way the calls doing real
+	work don't run into expired tokens.
+
+"""
+import threading
+import weakref
+
+
+class KeepAliveScheduler(object):
+    """Calls the client's _keepTokensAlive every interval seconds, on a daemon thread.
+    Only a weak reference to the client is held, so the scheduler never keeps it alive.
+    """
+
+    __slots__ = ('interval', 'lastError', '_client', '_stop', '_thread')
+
+    def __init__(self, client, interval):
+        self.interval = interval
+        self.lastError = None
+
+        self._client = weakref.ref(client)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self._thread:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='birdsong-KeepAlive', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread:
+            self._stop.set()
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            client = self._client()
+            if client is None:
+                return
+            try:
+                client._keepTokensAlive()
+            except Exception as error:
+                # Keep trying - the next tick may well work, and if not the calls
+                #   themselves will still recover the tokens
+                self.lastError = error
+            del client
@@ -0,0 +1,644 @@
+"""
+	Live data subscriptions.
+
+	getLiveData hands back whatever is new since it was last called, so
+	following live data means writing a polling loop. Subscribing does the
+	polling in the background (on a thread, or as tasks for the asyncio view)
+	and pushes each batch of new values to a callback, a bounded queue, or both.
+
+	Each live data token is polled on its own adaptive schedule. While values
+	keep coming, it's polled every minInterval seconds. Each empty poll stretches
+	the wait by the backoff factor, up to maxInterval. That keeps quiet tags from
+	costing many calls without slowing down busy ones.
+
+	A batch is a dict of tag paths and their new Tvqs. If a queue fills up
+	because nobody's reading it, the oldest batches are dropped (and counted).
+
+	Subscriptions don't each get their own token. A LiveDataMultiplexer spreads
+	the tags everyone is after (with the same configuration) over a few shared
+	tokens, so each tag is polled once however many subscribers want it. Each
+	subscriber only sees its own tags. As subscribers come and go, the tokens
+	are regrouped:
+	 - Tags nobody has covered yet get a new token.
+	 - Tokens nobody needs are revoked.
+	 - Tokens that are mostly tags nobody wants anymore are replaced.
+	 - Small tokens are merged into new ones, keeping to maxTokens.
+	When a tag moves to a new token, values already delivered aren't delivered again.
+
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+import weakref
+
+from .values import Tvq, _asEpochNanoseconds
+
+
+DEFAULT_MIN_POLL_INTERVAL = 0.1  # seconds
+DEFAULT_MAX_POLL_INTERVAL = 5.0  # seconds
+DEFAULT_POLL_BACKOFF = 2.0
+DEFAULT_MAX_QUEUED = 1000  # batches
+
+DEFAULT_MAX_LIVE_TOKENS = 4 # per configuration
+DEFAULT_MAX_WASTE = 0.5     # fraction of a token's tags nobody wants before it's replaced
+
+
+def _configKey(configuration):
+    return json.dumps(configuration, sort_keys=True, default=str)
+
+
+def tvqsFromLiveValues(values, lazy=False):
+    """Tvqs from a tag's live data, whether the values come as v2 value objects or as lists"""
+    return [Tvq.fromRaw(value['t'], value['v'], value.get('q', None), lazy) if isinstance(value, dict) 
+            else Tvq(*value, lazy=lazy)
+            for value in values]
+
+
+class AdaptivePollInterval(object):
+    """How long to wait before the next poll: minInterval after getting data,
+    growing by backoff after each empty poll, up to maxInterval."""
+
+    __slots__ = ('minInterval', 'maxInterval', 'backoff', 'interval')
+
+    def __init__(self, minInterval=DEFAULT_MIN_POLL_INTERVAL, maxInterval=DEFAULT_MAX_POLL_INTERVAL, backoff=DEFAULT_POLL_BACKOFF):
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.interval = minInterval
+
+    def next(self, gotData):
+        if gotData:
+            self.interval = self.minInterval
+        else:
+            self.interval = min(self.maxInterval, self.interval * self.backoff)
+        return self.interval
+
+    def failed(self):
+        """Wait as long as allowed after a poll that errored"""
+        self.interval = self.maxInterval
+        return self.interval
+
+
+class Subscription(object):
+    """New live data for a set of tags. Each batch goes to the callback (if any) and then the queue (if any).
+    Iterating blocks on the queue, yielding batches until the subscription is closed.
+    """
+
+    __slots__ = ('tags', 'configuration', 'callback', 'delivered', 'dropped', 'lastError', '_queue', '_engine', '_closed')
+
+    _closedMarker = None
+
+    def __init__(self, engine, tags, callback=None, maxQueued=None, **configuration):
+        self.tags = frozenset(tags)
+        self.configuration = dict(configuration)
+        self.configuration.setdefault('mode', 'AllValues')
+        self.callback = callback
+        self.delivered = 0
+        self.dropped = 0
+        self.lastError = None # from polling or from the callback
+
+        if maxQueued is None:
+            maxQueued = 0 if callback else DEFAULT_MAX_QUEUED
+        self._queue = self._newQueue(maxQueued) if maxQueued else None
+        self._engine = engine
+        self._closed = False
+
+    @staticmethod
+    def _newQueue(maxQueued):
+        return queue.Queue(maxQueued)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def configKey(self):
+        """Subscriptions can only share tokens with others configured the same way"""
+        return _configKey(self.configuration)
+
+    def _deliver(self, batch):
+        """Pass along the part of the batch this subscription is after"""
+        batch = {tagPath: values for tagPath, values in batch.items() if values and tagPath in self.tags}
+        if not batch or self._closed:
+            return
+        self.delivered += 1
+        if self.callback:
+            try:
+                self.callback(batch)
+            except Exception as error:
+                # The poller has other subscribers to get to, so just note it
+                self.lastError = error
+        if self._queue is not None:
+            self._enqueue(batch)
+
+    def _enqueue(self, batch):
+        while True:
+            try:
+                self._queue.put_nowait(batch)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _close(self):
+        self._closed = True
+        if self._queue is not None:
+            self._enqueue(self._closedMarker)
+
+    def get(self, timeout=None):
+        """The next batch, waiting up to timeout seconds (raises queue.Empty if none came).
+        None means the subscription was closed."""
+        return self._queue.get(timeout=timeout)
+
+    def close(self):
+        """Stop the subscription (and revoke its live data token if no one else needs it)"""
+        if not self._closed:
+            self._engine.unsubscribe(self)
+
+    def __iter__(self):
+        if self._queue is None:
+            raise ValueError('This subscription has no queue to iterate over - give it a maxQueued.')
+        while True:
+            batch = self.get()
+            if batch is self._closedMarker:
+                return
+            yield batch
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<%s %d tags%s>' % (type(self).__name__, len(self.tags), ' (closed)' if self._closed else '')
+
+
+class LiveDataTokenGroup(object):
+    """Tags polled together with one live data token"""
+
+    __slots__ = ('tags', 'configKey', 'configuration', 'interval')
+
+    def __init__(self, tags, configKey, configuration, interval):
+        self.tags = frozenset(tags)
+        self.configKey = configKey
+        self.configuration = configuration
+        self.interval = interval
+
+    @property
+    def key(self):
+        """What the group and its token are kept under - the same tags can be followed in more than one configuration"""
+        return (self.configKey, self.tags)
+
+    def __repr__(self):
+        return '<LiveDataTokenGroup %d tags>' % len(self.tags)
+
+
+class LiveDataMultiplexer(object):
+    """Who's subscribed to what, and which token groups cover it.
+    This only does the bookkeeping - the engines get and revoke the tokens as planned.
+    """
+
+    __slots__ = ('maxTokens', 'maxWaste', '_subscriptions', '_groups', '_lastTimestamps', '_lastValues', '_resumeAfter')
+
+    def __init__(self, maxTokens=DEFAULT_MAX_LIVE_TOKENS, maxWaste=DEFAULT_MAX_WASTE):
+        self.maxTokens = maxTokens
+        self.maxWaste = maxWaste
+
+        self._subscriptions = []
+        self._groups = {}          # (config key, tag set) -> LiveDataTokenGroup
+        self._lastTimestamps = {}  # (config key, tag path) -> epoch ns of the last value handed out
+        self._lastValues = {}      # (config key, tag path) -> the last Tvq handed out
+        self._resumeAfter = {}     # (config key, tag path) -> key of the new token a tag just moved to
+
+    @property
+    def subscriptions(self):
+        return list(self._subscriptions)
+
+    @property
+    def groups(self):
+        return list(self._groups.values())
+
+    def group(self, key):
+        return self._groups.get(key)
+
+    def add(self, subscription):
+        self._subscriptions.append(subscription)
+
+    def remove(self, subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    def plan(self):
+        """The regrouping needed for the current subscriptions:
+          (list of (tags, configuration) to get tokens for, list of groups to retire)
+        """
+        wanted = {}
+        configurations = {}
+        for subscription in self._subscriptions:
+            configKey = subscription.configKey
+            wanted.setdefault(configKey, set()).update(subscription.tags)
+            configurations[configKey] = subscription.configuration
+
+        newGroups, retired = [], []
+        for configKey in set(wanted) | set(group.configKey for group in self._groups.values()):
+            needed = wanted.get(configKey, set())
+            kept = []
+            for group in self._groups.values():
+                if group.configKey != configKey:
+                    continue
+                live = group.tags & needed
+                if not live or len(live) < len(group.tags) * (1 - self.maxWaste):
+                    retired.append(group)
+                else:
+                    kept.append(group)
+
+            covered = set().union(*(group.tags for group in kept))
+            homeless = needed - covered
+            if homeless:
+                # Fold groups no bigger than the new one into it (so small tokens don't pile up),
+                #   and then the smallest until there are no more than maxTokens
+                kept.sort(key=lambda group: len(group.tags))
+                newSize = len(homeless)
+                while kept and (len(kept) >= self.maxTokens or len(kept[0].tags) <= newSize):
+                    group = kept.pop(0)
+                    retired.append(group)
+                    homeless |= group.tags & needed
+            if homeless:
+                newGroups.append((frozenset(homeless), configurations[configKey]))
+
+            # Forget the last values of tags nobody is following
+            for key in [key for key in self._lastTimestamps if key[0] == configKey and key[1] not in needed]:
+                del self._lastTimestamps[key]
+                self._lastValues.pop(key, None)
+            for key in [key for key in self._resumeAfter if key[0] == configKey and key[1] not in needed]:
+                del self._resumeAfter[key]
+        return newGroups, retired
+
+    def adopt(self, tags, configuration, interval):
+        """Add a group once its token is ready"""
+        configKey = _configKey(configuration)
+        group = LiveDataTokenGroup(tags, configKey, configuration, interval)
+        self._groups[group.key] = group
+        for tagPath in group.tags:
+            # Its first poll will hand back the current value, which may already have gone out
+            #   (or go out from the old token's last polls, which can come after this)
+            self._resumeAfter[(configKey, tagPath)] = group.key
+        return group
+
+    def retire(self, group):
+        self._groups.pop(group.key, None)
+
+    def noteError(self, group, error, closing=None):
+        """Let the subscriptions following the group's tags (and the one closing, if any) know a call for it failed"""
+        for subscription in self._subscriptions + ([closing] if closing else []):
+            if subscription.configKey == group.configKey and subscription.tags & group.tags:
+                subscription.lastError = error
+
+    def snapshot(self, subscription):
+        """The last values of the subscription's tags, if they're already being followed"""
+        configKey = subscription.configKey
+        return {tagPath: [self._lastValues[(configKey, tagPath)]]
+                for tagPath in subscription.tags if (configKey, tagPath) in self._lastValues}
+
+    def dispatch(self, group, batch):
+        """Hand a group's poll out to the subscriptions configured like it"""
+        configKey = group.configKey
+        for tagPath in list(batch):
+            key = (configKey, tagPath)
+            values = batch[tagPath]
+            if values and self._resumeAfter.get(key) == group.key:
+                # The new token's first values: skip what was already handed out
+                del self._resumeAfter[key]
+                if key in self._lastTimestamps:
+                    resumeAfter = self._lastTimestamps[key]
+                    values = batch[tagPath] = [value for value in values if _asEpochNanoseconds(value.timestamp) > resumeAfter]
+            if values:
+                self._lastTimestamps[key] = _asEpochNanoseconds(values[-1].timestamp)
+                self._lastValues[key] = values[-1]
+        for subscription in self._subscriptions:
+            if subscription.configKey == configKey:
+                subscription._deliver(batch)
+
+    def __repr__(self):
+        return '<LiveDataMultiplexer %d subscriptions on %d tokens>' % (len(self._subscriptions), len(self._groups))
+
+
+class LiveDataEngine(object):
+    """Polls the live data tokens of a CanaryView on a daemon thread, handing new values to subscriptions.
+    Only a weak reference to the view is held, so the engine never keeps it alive.
+    """
+
+    __slots__ = ('minInterval', 'maxInterval', 'backoff', 'polls', 'emptyPolls',
+                 '_view', '_multiplexer', '_due', '_polling', '_lock', '_polled', '_wake', '_stop', '_thread')
+
+    def __init__(self, view, minInterval=DEFAULT_MIN_POLL_INTERVAL, maxInterval=DEFAULT_MAX_POLL_INTERVAL, backoff=DEFAULT_POLL_BACKOFF,
+                 maxTokens=DEFAULT_MAX_LIVE_TOKENS, maxWaste=DEFAULT_MAX_WASTE):
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.polls = 0
+        self.emptyPolls = 0
+
+        self._view = weakref.ref(view)
+        self._multiplexer = LiveDataMultiplexer(maxTokens, maxWaste)
+        self._due = {} # token group's key -> when it's next polled (time.monotonic)
+        self._polling = set() # keys of the token groups with a getLiveData call in flight
+        self._lock = threading.RLock()
+        self._polled = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def multiplexer(self):
+        return self._multiplexer
+
+    @property
+    def subscriptions(self):
+        return self._multiplexer.subscriptions
+
+    def subscribe(self, tags, callback=None, maxQueued=None, **configuration):
+        """Start getting the tags' live data. Returns the Subscription.
+        Configuration is passed along to getLiveDataToken (like mode and includeQuality).
+        """
+        subscription = Subscription(self, self._view()._coerceToList(tags), callback, maxQueued, **configuration)
+        with self._lock:
+            self._multiplexer.add(subscription)
+            try:
+                self._regroup()
+            except Exception:
+                self._multiplexer.remove(subscription)
+                raise
+            # Tags that were already followed won't show up again until they change
+            subscription._deliver(self._multiplexer.snapshot(subscription))
+        self.start()
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._multiplexer.remove(subscription)
+            subscription._close()
+            if self._view() is not None:
+                self._regroup(subscription)
+
+    def _regroup(self, closing=None):
+        """Get and revoke tokens so the groups cover the subscriptions (called with the lock held).
+        Errors revoking a token go to the lastError of the subscriptions that followed it.
+        """
+        view = self._view()
+        newGroups, retired = self._multiplexer.plan()
+        for tags, configuration in newGroups:
+            key = (_configKey(configuration), tags)
+            view._getLiveDataToken(list(tags), key=key, **configuration)
+            interval = AdaptivePollInterval(self.minInterval, self.maxInterval, self.backoff)
+            self._multiplexer.adopt(tags, configuration, interval)
+            self._due[key] = time.monotonic()
+        for group in retired:
+            # A poll already in flight hands out its values before the last one below
+            while group.key in self._polling:
+                self._polled.wait()
+            if self._multiplexer.group(group.key) is not group:
+                continue # Another regroup got to it while waiting
+            # One last poll first, so nothing that came in before the new token is missed
+            if group.key in view._liveDataTokens:
+                try:
+                    self._multiplexer.dispatch(group, view._pollLiveData(group.key))
+                except Exception as error:
+                    self._multiplexer.noteError(group, error, closing)
+                try:
+                    view._revokeLiveDataToken(key=group.key)
+                except Exception as error:
+                    self._multiplexer.noteError(group, error, closing)
+            self._multiplexer.retire(group)
+            self._due.pop(group.key, None)
+
+    def start(self):
+        with self._lock:
+            if not self._thread:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='birdsong-LiveData', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Close every subscription and stop polling"""
+        for subscription in self.subscriptions:
+            self.unsubscribe(subscription)
+        thread, self._thread = self._thread, None
+        if thread:
+            self._stop.set()
+            self._wake.set()
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                now = time.monotonic()
+                dueKeys = [key for key, dueAt in self._due.items() if dueAt <= now]
+                nextDue = min(self._due.values()) if self._due else None
+            if not dueKeys:
+                self._wake.wait(None if nextDue is None else nextDue - now)
+                self._wake.clear()
+                continue
+
+            view = self._view()
+            if view is None:
+                return
+            view._mapConcurrently(self._poll, dueKeys)
+            del view
+
+    def _poll(self, key):
+        view = self._view()
+        with self._lock:
+            if self._multiplexer.group(key) is None:
+                return # Regrouped since it came due
+            self._polling.add(key)
+        try:
+            batch, error = view._pollLiveData(key), None
+        except Exception as pollError:
+            batch, error = {}, pollError
+
+        with self._lock:
+            # Regrouping waits for this, so the group is still there
+            self._polling.discard(key)
+            self._polled.notify_all()
+            group = self._multiplexer.group(key)
+            self.polls += 1
+            gotData = any(batch.values())
+            if not gotData:
+                self.emptyPolls += 1
+            self._due[key] = time.monotonic() + (group.interval.failed() if error else group.interval.next(gotData))
+            if error:
+                self._multiplexer.noteError(group, error)
+            else:
+                self._multiplexer.dispatch(group, batch)
+
+    def __repr__(self):
+        return '<LiveDataEngine %d subscriptions on %d tokens>' % (len(self.subscriptions), len(self._multiplexer.groups))
+
+
+class AsyncSubscription(Subscription):
+    """A Subscription for the asyncio view: get() is awaited, and it's iterated with async for."""
+
+    __slots__ = ()
+
+    @staticmethod
+    def _newQueue(maxQueued):
+        return asyncio.Queue(maxQueued)
+
+    def _enqueue(self, batch):
+        while True:
+            try:
+                self._queue.put_nowait(batch)
+                return
+            except asyncio.QueueFull:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    async def close(self):
+        if not self._closed:
+            await self._engine.unsubscribe(self)
+
+    def __iter__(self):
+        raise TypeError('Use async for with an AsyncSubscription')
+
+    async def __aiter__(self):
+        if self._queue is None:
+            raise ValueError('This subscription has no queue to iterate over - give it a maxQueued.')
+        while True:
+            batch = await self._queue.get()
+            if batch is self._closedMarker:
+                return
+            yield batch
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncLiveDataEngine(object):
+    """Polls the live data tokens of an AsyncCanaryView, one task per token. (See LiveDataEngine)"""
+
+    __slots__ = ('minInterval', 'maxInterval', 'backoff', 'polls', 'emptyPolls',
+                 '_view', '_multiplexer', '_tasks', '_polling', '_lock')
+
+    def __init__(self, view, minInterval=DEFAULT_MIN_POLL_INTERVAL, maxInterval=DEFAULT_MAX_POLL_INTERVAL, backoff=DEFAULT_POLL_BACKOFF,
+                 maxTokens=DEFAULT_MAX_LIVE_TOKENS, maxWaste=DEFAULT_MAX_WASTE):
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.polls = 0
+        self.emptyPolls = 0
+
+        self._view = weakref.ref(view)
+        self._multiplexer = LiveDataMultiplexer(maxTokens, maxWaste)
+        self._tasks = {} # token group's key -> its polling task
+        self._polling = set() # keys of the token groups with a getLiveData call in flight
+        self._lock = asyncio.Lock()
+
+    @property
+    def multiplexer(self):
+        return self._multiplexer
+
+    @property
+    def subscriptions(self):
+        return self._multiplexer.subscriptions
+
+    async def subscribe(self, tags, callback=None, maxQueued=None, **configuration):
+        subscription = AsyncSubscription(self, self._view()._coerceToList(tags), callback, maxQueued, **configuration)
+        async with self._lock:
+            self._multiplexer.add(subscription)
+            try:
+                await self._regroup()
+            except Exception:
+                self._multiplexer.remove(subscription)
+                raise
+            subscription._deliver(self._multiplexer.snapshot(subscription))
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        async with self._lock:
+            self._multiplexer.remove(subscription)
+            subscription._close()
+            if self._view() is not None:
+                await self._regroup(subscription)
+
+    async def _regroup(self, closing=None):
+        view = self._view()
+        newGroups, retired = self._multiplexer.plan()
+        for tags, configuration in newGroups:
+            await view._getLiveDataToken(list(tags), key=(_configKey(configuration), tags), **configuration)
+            interval = AdaptivePollInterval(self.minInterval, self.maxInterval, self.backoff)
+            group = self._multiplexer.adopt(tags, configuration, interval)
+            self._tasks[group.key] = asyncio.ensure_future(self._pollLoop(group))
+        for group in retired:
+            task = self._tasks.pop(group.key, None)
+            if task:
+                # Cancelling a poll in flight would lose what it got, so let that one finish
+                if group.key not in self._polling:
+                    task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            if group.key in view._liveDataTokens:
+                try:
+                    self._multiplexer.dispatch(group, await view._pollLiveData(group.key))
+                except Exception as error:
+                    self._multiplexer.noteError(group, error, closing)
+                try:
+                    await view._revokeLiveDataToken(key=group.key)
+                except Exception as error:
+                    self._multiplexer.noteError(group, error, closing)
+            self._multiplexer.retire(group)
+
+    async def stop(self):
+        for subscription in self.subscriptions:
+            await self.unsubscribe(subscription)
+
+    async def _pollLoop(self, group):
+        task = asyncio.current_task()
+        while True:
+            view = self._view()
+            if view is None:
+                return
+            self._polling.add(group.key)
+            try:
+                batch, error = await view._pollLiveData(group.key), None
+            except asyncio.CancelledError:
+                raise
+            except Exception as pollError:
+                batch, error = {}, pollError
+            finally:
+                self._polling.discard(group.key)
+            del view
+
+            self.polls += 1
+            gotData = any(batch.values())
+            if not gotData:
+                self.emptyPolls += 1
+            if error:
+                self._multiplexer.noteError(group, error)
+            else:
+                self._multiplexer.dispatch(group, batch)
+            if self._tasks.get(group.key) is not task:
+                return # Retired while polling
+            await asyncio.sleep(group.interval.failed() if error else group.interval.next(gotData))
+
+    def __repr__(self):
+        return '<AsyncLiveDataEngine %d subscriptions on %d tokens>' % (len(self.subscriptions), len(self._tasks))
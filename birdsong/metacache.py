@@ -0,0 +1,155 @@
+"""
+	Memoized metadata calls.
+
+	Aggregates, quality code meanings and tag properties hardly ever change,
+	but code that decodes data tends to ask for them batch after batch. With a
+	MetadataCache, getAggregates, getQualities and getTagProperties keep what
+	they get back for a while (each endpoint has its own time to live).
+
+	Qualities and properties are kept per code and per tag, so a call only asks
+	Canary for the codes or tags it doesn't already have. Tags that come back
+	without properties are remembered too, as empty dicts.
+
+	Given a path, entries are also saved to a JSON file, so they survive restarts.
+	Expiry goes by the wall clock for the same reason. Rewriting the whole file
+	for every batch would cost more than the calls saved, so new entries are
+	written out at most every flushInterval seconds, and by flush() (which views
+	call on exit).
+
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+DEFAULT_METADATA_TTLS = {  # seconds
+    'getAggregates': 24 * 3600.0,
+    'getQualities': 24 * 3600.0,
+    'getTagProperties': 300.0,
+}
+
+DEFAULT_METADATA_FLUSH_INTERVAL = 30.0  # seconds between writes to the file
+
+
+class MetadataCache(object):
+    """Metadata by endpoint and item (quality code or tag path), each for as long as its endpoint's TTL.
+    Can be shared by several views (entries are kept apart by host and user).
+    """
+
+    __slots__ = ('ttls', 'path', 'flushInterval', 'hits', 'misses', '_entries', '_dirty', '_writtenAt', '_lock')
+
+    def __init__(self, ttls=None, path=None, flushInterval=DEFAULT_METADATA_FLUSH_INTERVAL):
+        self.ttls = dict(DEFAULT_METADATA_TTLS, **(ttls or {}))
+        self.path = path
+        self.flushInterval = flushInterval
+
+        # Per endpoint, counted by item
+        self.hits = {endpoint: 0 for endpoint in self.ttls}
+        self.misses = {endpoint: 0 for endpoint in self.ttls}
+
+        self._lock = threading.Lock()
+        self._entries = self._read()
+        self._dirty = False
+        self._writtenAt = time.monotonic()
+
+    @property
+    def stats(self):
+        return {endpoint: {'hits': self.hits.get(endpoint, 0), 'misses': self.misses.get(endpoint, 0)}
+                for endpoint in self.ttls}
+
+    @staticmethod
+    def _key(endpoint, owner, item):
+        return json.dumps([endpoint, owner, item])
+
+    def lookup(self, endpoint, owner, items):
+        """What's cached (and not expired) for the items, and the list of those that aren't.
+        The owner is whatever tells users apart (like host, port and username).
+        """
+        now = time.time()
+        found, missing = {}, []
+        with self._lock:
+            for item in items:
+                entry = self._entries.get(self._key(endpoint, owner, item))
+                if entry is not None and entry[0] > now:
+                    found[item] = entry[1]
+                else:
+                    missing.append(item)
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + len(found)
+            self.misses[endpoint] = self.misses.get(endpoint, 0) + len(missing)
+        return found, missing
+
+    def store(self, endpoint, owner, values):
+        """Cache the {item: value} fetched from the endpoint"""
+        expires = time.time() + self.ttls.get(endpoint, 0)
+        with self._lock:
+            for item, value in values.items():
+                self._entries[self._key(endpoint, owner, item)] = (expires, value)
+            self._dirty = True
+            if self.path and time.monotonic() - self._writtenAt >= self.flushInterval:
+                self._write()
+
+    def flush(self):
+        """Write out anything stored since the file was last written"""
+        with self._lock:
+            if self.path and self._dirty:
+                self._write()
+
+    def clear(self, endpoint=None):
+        """Drop everything cached (for one endpoint, if given)"""
+        with self._lock:
+            if endpoint is None:
+                self._entries.clear()
+            else:
+                prefix = json.dumps([endpoint])[:-1] + ', '
+                for key in [key for key in self._entries if key.startswith(prefix)]:
+                    del self._entries[key]
+            if self.path:
+                self._write()
+
+    def _read(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, 'r') as cacheFile:
+                entries = json.load(cacheFile)
+        except (OSError, ValueError):
+            # Missing or mangled - either way, start over
+            return {}
+        now = time.time()
+        return {key: tuple(entry) for key, entry in entries.items() if entry[0] > now}
+
+    def _write(self):
+        """Write the entries that haven't expired out, swapping the file in whole"""
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        handle, tempPath = tempfile.mkstemp(dir=folder, prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+        try:
+            with open(handle, 'w') as cacheFile:
+                json.dump(self._entries, cacheFile)
+            os.replace(tempPath, self.path)
+        except BaseException:
+            os.unlink(tempPath)
+            raise
+        self._dirty = False
+        self._writtenAt = time.monotonic()
+
+    def __repr__(self):
+        return '<MetadataCache %d entries%s>' % (len(self._entries), ' at %s' % self.path if self.path else '')
+
+
+def getMetadataCache(metadataCache):
+    """Turn the metadataCache argument into a MetadataCache (or None).
+    True makes one in memory only, a string is taken as the file to keep it in.
+    """
+    if not metadataCache:
+        return None
+    if metadataCache is True:
+        return MetadataCache()
+    if isinstance(metadataCache, str):
+        return MetadataCache(path=metadataCache)
+    return metadataCache
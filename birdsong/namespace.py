@@ -0,0 +1,177 @@
+"""
+	Local index of the tag namespace.
+
+	browseTags(deep=True) walks the whole namespace on the server, which for a
+	big historian is hundreds of thousands of tags and many seconds. A
+	TagNamespace keeps every view's tag paths locally, both as a sorted list
+	(for prefix listings by binary search) and as a tree of nodes (for the
+	tags and nodes directly under a path). Lookups, listings and searches are
+	then answered without asking Canary.
+
+	Canary bumps a view's browseStatus sequence number whenever it changes. Each
+	refresh checks the sequences (no more than once every checkInterval
+	seconds) and only browses the views whose numbers moved again.
+
+"""
+import threading
+import time
+from bisect import bisect_left
+
+
+DEFAULT_CHECK_INTERVAL = 30.0  # seconds
+
+
+class _Node(object):
+    """A node in the namespace tree: its children by name, and whether it's a tag itself"""
+
+    __slots__ = ('children', 'isTag')
+
+    def __init__(self):
+        self.children = {}
+        self.isTag = False
+
+
+class _ViewIndex(object):
+    """One view's tags, sorted and as a tree"""
+
+    __slots__ = ('sequence', 'tags', 'lowered', 'root')
+
+    def __init__(self, sequence, tagPaths):
+        self.sequence = sequence
+        self.tags = sorted(set(tagPaths))
+        self.lowered = [tagPath.lower() for tagPath in self.tags]
+        self.root = _Node()
+        for tagPath in self.tags:
+            node = self.root
+            for name in tagPath.split('.')[1:]:
+                child = node.children.get(name)
+                if child is None:
+                    child = node.children[name] = _Node()
+                node = child
+            node.isTag = True
+
+    def find(self, path):
+        """The node at the (dotted) path, or None"""
+        node = self.root
+        for name in path.split('.')[1:]:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def under(self, path):
+        """Indexes of the tags somewhere under path (sorted order keeps them together)"""
+        prefix = path + '.'
+        return range(bisect_left(self.tags, prefix), bisect_left(self.tags, prefix + '\uffff'))
+
+
+class TagNamespace(object):
+    """Every view's tag paths, indexed for lookups, listings and substring searches.
+    Searches are case insensitive, as they are in Axiom.
+    """
+
+    __slots__ = ('checkInterval', 'refreshes', '_views', '_checkedAt', '_lock')
+
+    def __init__(self, checkInterval=DEFAULT_CHECK_INTERVAL):
+        self.checkInterval = checkInterval
+        self.refreshes = 0 # views browsed again because their sequence changed
+
+        self._views = {}
+        self._checkedAt = None
+        self._lock = threading.RLock()
+
+    @property
+    def lock(self):
+        """Held while refreshing, so only one caller browses at a time"""
+        return self._lock
+
+    @property
+    def due(self):
+        """True if it's been checkInterval seconds since the sequences were last checked"""
+        return self._checkedAt is None or time.monotonic() - self._checkedAt >= self.checkInterval
+
+    def stale(self, sequences):
+        """The views (from a {view: sequence} dict) that are new or have changed since they were loaded"""
+        self._checkedAt = time.monotonic()
+        return [viewName for viewName, sequence in sequences.items()
+                if viewName not in self._views or self._views[viewName].sequence != sequence]
+
+    def load(self, viewName, sequence, tagPaths):
+        """Swap in the tags browsed for the view"""
+        viewIndex = _ViewIndex(sequence, tagPaths)
+        with self._lock:
+            self._views[viewName] = viewIndex
+            self.refreshes += 1
+
+    def keepOnly(self, viewNames):
+        """Forget views that aren't around anymore"""
+        with self._lock:
+            for viewName in set(self._views) - set(viewNames):
+                del self._views[viewName]
+
+    def invalidate(self):
+        """Check the sequences on the next refresh, however recently they were checked"""
+        self._checkedAt = None
+
+    # Lookups
+
+    def views(self):
+        return sorted(self._views)
+
+    def nodes(self, path=''):
+        """Names of the nodes directly under the path (like browseNodes)"""
+        if not path:
+            return self.views()
+        viewIndex = self._views.get(path.split('.', 1)[0])
+        node = viewIndex.find(path) if viewIndex else None
+        if node is None:
+            return []
+        return sorted(name for name, child in node.children.items() if child.children)
+
+    def tags(self, path='', search='', deep=False):
+        """Tag paths under the path whose path contains search (like browseTags)"""
+        search = search.lower()
+        if not path:
+            if not deep:
+                return []
+            viewIndexes = [self._views[viewName] for viewName in self.views()]
+            return [tagPath for viewIndex in viewIndexes
+                    for tagPath, lowered in zip(viewIndex.tags, viewIndex.lowered)
+                    if search in lowered]
+
+        viewIndex = self._views.get(path.split('.', 1)[0])
+        if viewIndex is None:
+            return []
+        if deep:
+            return [viewIndex.tags[ix] for ix in viewIndex.under(path) if search in viewIndex.lowered[ix]]
+
+        node = viewIndex.find(path)
+        if node is None:
+            return []
+        return [tagPath for tagPath in ('%s.%s' % (path, name) for name, child in sorted(node.children.items()) if child.isTag)
+                if search in tagPath.lower()]
+
+    def search(self, search):
+        """Every tag path containing search"""
+        return self.tags('', search, deep=True)
+
+    def __contains__(self, tagPath):
+        viewIndex = self._views.get(tagPath.split('.', 1)[0])
+        node = viewIndex.find(tagPath) if viewIndex else None
+        return bool(node and node.isTag)
+
+    def __len__(self):
+        return sum(len(viewIndex.tags) for viewIndex in self._views.values())
+
+    def __repr__(self):
+        return '<TagNamespace %d tags in %d views>' % (len(self), len(self._views))
+
+
+def getTagNamespace(tagNamespace):
+    """Turn the tagNamespace argument into a TagNamespace (or None). True makes one with the defaults."""
+    # (An empty TagNamespace is falsy, so don't go by truthiness)
+    if tagNamespace is None or tagNamespace is False:
+        return None
+    if tagNamespace is True:
+        return TagNamespace()
+    return tagNamespace
@@ -0,0 +1,236 @@
+"""
+	Query planning for big getTagData reads.
+
+	A raw read over months or years of data comes back as hundreds of
+	continuation pages, and each page has to wait for the one before it. A
+	QueryPlanner splits the window into up to maxWindows sub-windows (none
+	shorter than minWindowSpan seconds), asks for them all at once and stitches
+	each tag's samples back together in time order. The result is the same as
+	the one long call, but the pages come in side by side instead of one after
+	another.
+
+	Before splitting, getTagContext tells the planner when each tag's data
+	starts and ends. Sub-windows only ask for the tags that have data in them,
+	and tags with nothing in the window at all aren't asked for.
+
+	Like the tagDataCache, only raw reads with absolute start and end times are
+	planned. Aggregates, maxSize and includeBounds are passed straight thru.
+
+	Long tag lists have the opposite problem: thousands of tags in one call make
+	for a huge request body and one long string of interleaved continuation
+	pages. A TagSharder cuts the list into shards that are fetched side by side.
+	The shard size follows the values each call actually brings back, aiming for
+	about targetValues per call: dense tags make for small shards, sparse tags
+	for big ones.
+
+"""
+import math
+import threading
+
+from .values import TvqSeries
+from .tagcache import _windowNanoseconds
+
+
+DEFAULT_MAX_WINDOWS = 8
+DEFAULT_MIN_WINDOW_SPAN = 6 * 3600.0  # seconds
+
+# Constraints that change what Canary hands back in ways that can't be split up and stitched together
+UNPLANNABLE_CONSTRAINTS = ('aggregateName', 'maxSize', 'includeBounds')
+
+DEFAULT_SHARD_SIZE = 1000  # tags per call, to start with
+DEFAULT_SHARD_TARGET_VALUES = 200000  # values per call aimed for
+DEFAULT_MIN_SHARD_SIZE = 20
+DEFAULT_MAX_SHARD_SIZE = 5000
+
+# Timestamps from getTagContext can have more digits than a datetime holds,
+#   so the latest one is padded by a microsecond to be sure it's kept
+CONTEXT_PADDING = 1000  # nanoseconds
+
+
+class QueryPlanner(object):
+    """Splits raw getTagData windows into sub-windows that can be fetched concurrently.
+    Can be shared by several views.
+    """
+
+    __slots__ = ('maxWindows', 'minWindowSpan', 'useContext', 'planned', 'windows', 'skipped')
+
+    def __init__(self, maxWindows=DEFAULT_MAX_WINDOWS, minWindowSpan=DEFAULT_MIN_WINDOW_SPAN, useContext=True):
+        self.maxWindows = maxWindows
+        self.minWindowSpan = minWindowSpan
+        self.useContext = useContext
+
+        # Reads that were split, sub-window calls made, and tags skipped for having no data in the window
+        self.planned = 0
+        self.windows = 0
+        self.skipped = 0
+
+    @property
+    def stats(self):
+        return {'planned': self.planned, 'windows': self.windows, 'skipped': self.skipped}
+
+    def window(self, constraints):
+        """The [start, end) nanoseconds of a getTagData call, or None if it's not worth (or not safe) splitting"""
+        if any(key in constraints for key in UNPLANNABLE_CONSTRAINTS):
+            return None
+        timezone = constraints.get('timezone')
+        start = _windowNanoseconds(constraints.get('startTime'), timezone)
+        end = _windowNanoseconds(constraints.get('endTime'), timezone)
+        if start is None or end is None or self.windowCount(start, end) < 2:
+            return None
+        return start, end
+
+    def windowCount(self, start, end):
+        """How many pieces [start, end) would be split into"""
+        minSpan = max(int(self.minWindowSpan * 1e9), 1)
+        return max(0, min(self.maxWindows, math.ceil((end - start) / minSpan)))
+
+    def bounds(self, start, end, tagPaths, contexts=None):
+        """Each tag's part of [start, end), cut down to the oldest and latest timestamps in its context.
+        Tags without any data in the window are left out. Tags without a context are given as None.
+        """
+        contexts = contexts or {}
+        tagBounds = {}
+        for tagPath in tagPaths:
+            context = contexts.get(tagPath) or {}
+            oldest = _windowNanoseconds(context.get('oldestTimeStamp'), 'UTC')
+            latest = _windowNanoseconds(context.get('latestTimeStamp'), 'UTC')
+            if oldest is None and latest is None:
+                tagBounds[tagPath] = None
+                continue
+            tagStart = start if oldest is None else max(start, oldest)
+            tagEnd = end if latest is None else min(end, latest + CONTEXT_PADDING)
+            if tagStart < tagEnd:
+                tagBounds[tagPath] = (tagStart, tagEnd)
+            else:
+                self.skipped += 1
+        return tagBounds
+
+    def plan(self, start, end, tagBounds):
+        """(windowStart, windowEnd, tagPaths) for each sub-window call, in time order.
+        Only the span where there's data is split, and each call only has the tags with data in it.
+          (Tags with bounds of None go in every call.)
+        """
+        if not tagBounds:
+            return []
+        known = [bounds for bounds in tagBounds.values() if bounds is not None] or [(start, end)]
+        spanStart = min(tagStart for tagStart, tagEnd in known)
+        spanEnd = max(tagEnd for tagStart, tagEnd in known)
+        count = max(1, self.windowCount(spanStart, spanEnd))
+        # (The first and last still run out to the ends of the window, for tags without a context
+        #   and anything that came in since the context was read)
+        #   Inner edges are kept to whole microseconds, since that's all a timestamp sent to Canary can hold,
+        #   so each fetch and the cut made in stitch fall on the same instant
+        edges = ([start]
+                 + [(spanStart + (spanEnd - spanStart) * ix // count) // 1000 * 1000 for ix in range(1, count)]
+                 + [end])
+
+        argSets = []
+        for windowStart, windowEnd in zip(edges, edges[1:]):
+            if windowStart >= windowEnd:
+                continue
+            tagGroup = [tagPath for tagPath, bounds in tagBounds.items()
+                        if bounds is None or (bounds[0] < windowEnd and bounds[1] > windowStart)]
+            if tagGroup:
+                argSets.append((windowStart, windowEnd, tagGroup))
+
+        self.planned += 1
+        self.windows += len(argSets)
+        return argSets
+
+    def stitch(self, end, tagPaths, argSets, fetches):
+        """Each tag's samples from the sub-window fetches (the {tagPath: TvqSeries} for each of argSets, in order).
+        Samples on a sub-window's end belong to the next one. The outer ends aren't cut
+          (so whatever the one long call would have given there is kept).
+        """
+        pieces = {tagPath: [] for tagPath in tagPaths}
+        for ix, ((windowStart, windowEnd, tagGroup), fetched) in enumerate(zip(argSets, fetches)):
+            lower = windowStart if ix else None
+            upper = None if windowEnd >= end else windowEnd
+            for tagPath in tagGroup:
+                pieces[tagPath].append(fetched[tagPath].between(lower, upper))
+        return {tagPath: TvqSeries.concat(tagPieces) for tagPath, tagPieces in pieces.items()}
+
+    def __repr__(self):
+        return '<QueryPlanner up to %d windows of at least %ss>' % (self.maxWindows, self.minWindowSpan)
+
+
+def getQueryPlanner(queryPlanner):
+    """Turn the queryPlanner argument into a QueryPlanner (or None). True makes one with the defaults."""
+    if not queryPlanner:
+        return None
+    if queryPlanner is True:
+        return QueryPlanner()
+    return queryPlanner
+
+
+class TagSharder(object):
+    """Cuts long tag lists into shards, sized from how many values the tags have been bringing back.
+    Can be shared by several views.
+    """
+
+    __slots__ = ('size', 'targetValues', 'minSize', 'maxSize', 'sharded', 'shards', '_valuesPerTag', '_lock')
+
+    def __init__(self, size=DEFAULT_SHARD_SIZE, targetValues=DEFAULT_SHARD_TARGET_VALUES,
+                 minSize=DEFAULT_MIN_SHARD_SIZE, maxSize=DEFAULT_MAX_SHARD_SIZE):
+        self.size = size
+        self.targetValues = targetValues
+        self.minSize = minSize
+        self.maxSize = maxSize
+
+        # Tag lists that were sharded, and the shards they were cut into
+        self.sharded = 0
+        self.shards = 0
+
+        self._valuesPerTag = None
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {'sharded': self.sharded, 'shards': self.shards, 'size': self.size,
+                'valuesPerTag': self._valuesPerTag}
+
+    def applies(self, apiName, tags, constraints):
+        """True if the tag list is long enough to shard.
+        (getTagData's maxSize is for all the tags together, so those calls are left whole.)
+        """
+        if isinstance(tags, str) or len(tags) <= self.size:
+            return False
+        return not (apiName == 'getTagData' and 'maxSize' in constraints)
+
+    def split(self, tagPaths):
+        """The tag paths cut into shards of the current size"""
+        size = self.size
+        tagShards = [tagPaths[ix:ix + size] for ix in range(0, len(tagPaths), size)]
+        if len(tagShards) > 1:
+            self.sharded += 1
+            self.shards += len(tagShards)
+        return tagShards
+
+    def observe(self, tagCount, valueCount):
+        """Resize the shards for what a call for tagCount tags brought back"""
+        if not tagCount:
+            return
+        with self._lock:
+            valuesPerTag = valueCount / tagCount
+            if self._valuesPerTag is not None:
+                # Smooth it out, so one odd call doesn't swing the size too far
+                valuesPerTag = (self._valuesPerTag + valuesPerTag) / 2
+            self._valuesPerTag = valuesPerTag
+            size = self.targetValues / valuesPerTag if valuesPerTag else self.maxSize
+            self.size = int(min(self.maxSize, max(self.minSize, size)))
+
+    def __repr__(self):
+        return '<TagSharder %d tags per shard>' % self.size
+
+
+def getTagSharder(tagSharder):
+    """Turn the tagSharder argument into a TagSharder (or None).
+    True makes one with the defaults, and a number is taken as the starting shard size.
+    """
+    if not tagSharder:
+        return None
+    if tagSharder is True:
+        return TagSharder()
+    if isinstance(tagSharder, int):
+        return TagSharder(size=tagSharder)
+    return tagSharder
@@ -1,30 +1,108 @@
-import requests, json
+import requests
 import urllib3
+import threading
+import time
+import gzip, zlib
+from concurrent.futures import ThreadPoolExecutor
 
-# For JSON payload packaging, import these for easier/auto serializing
-from datetime import datetime, date
-import arrow
+from .codec import getCodec
+from .transport import (newSession, sharedSession, 
+                        DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, 
+                        DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+from .retry import RetryPolicy, circuitBreakerFor
 
 
 VALIDATE_SSL_CERTS = False
 
+DEFAULT_MAX_WORKERS = 4
+
+# Request bodies smaller than this aren't worth compressing
+DEFAULT_COMPRESS_THRESHOLD = 16384
+
+COMPRESSORS = {
+    'gzip':    lambda payload, level: gzip.compress(payload, compresslevel=level),
+    'deflate': lambda payload, level: zlib.compress(payload, level),
+}
+
+# Responses are compressed if Canary is willing
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Calls that change something on the historian. One that timed out or got a server error
+#   may well have gone thru, so these are only retried when the connection was never made.
+NON_IDEMPOTENT_APIS = frozenset(['storeData', 'noData', 'createNewFile', 'fileRollOver',
+                                 'revokeUserToken', 'revokeSessionToken', 'revokeLiveDataToken'])
+
+
+def chunks(l, n):
+    """Yield successive n-sized chunks from l.
+    From https://stackoverflow.com/a/312464/11902188
+    """
+    for i in range(0, len(l), n):
+        yield l[i:i + n]
+
+
 class RestInterface(object):
     """Interface methods for talking to Canary."""
     apiVersion = 'api/v2'  # Chagned to v2 for supported endpoint, 
     #                        deprecating v1 (though mostly still compatible, us `api-v1` branch, release 1.3.0)
 
-    __slots__ = ('host', 'https', 'ports', '_session', 'lastResults')
+    __slots__ = ('host', 'https', 'ports', 'codec', 
+                 'compression', 'compressThreshold', 'compressLevel',
+                 'poolConnections', 'poolMaxSize', 'connectTimeout', 'readTimeout', 'tcpKeepAlive', 'sharePool',
+                 'retryPolicy', '_circuitBreaker',
+                 '_session', '_threadLocal', '_transferTotals', '_retryCounts', '_countersLock', '_lastCallTime')
     
     def __init__(self, host='localhost', https=False, 
                  httpPort=80, httpsPort=443, verifySSL=VALIDATE_SSL_CERTS,
+                 jsonCodec=None,
+                 compression=None,
+                 compressThreshold=DEFAULT_COMPRESS_THRESHOLD,
+                 compressLevel=6,
+                 poolConnections=DEFAULT_POOL_CONNECTIONS,
+                 poolMaxSize=DEFAULT_POOL_MAXSIZE,
+                 connectTimeout=DEFAULT_CONNECT_TIMEOUT,
+                 readTimeout=DEFAULT_READ_TIMEOUT,
+                 tcpKeepAlive=True,
+                 sharePool=False,
+                 retryPolicy=None,
+                 circuitBreaker=None,
                  **configuration):        
         self.https = https
         self.host  = host
         self.ports = (httpPort, httpsPort)
+
+        # orjson/ujson/json - see codec.py
+        self.codec = getCodec(jsonCodec)
+
+        # Request bodies over compressThreshold bytes get gzip'd or deflated (if set)
+        if compression and compression not in COMPRESSORS:
+            raise ValueError("Compression must be one of %s, not '%s'" % (', '.join(COMPRESSORS), compression))
+        self.compression = compression
+        self.compressThreshold = compressThreshold
+        self.compressLevel = compressLevel
+
+        # Connection pooling - see transport.py
+        self.poolConnections = poolConnections
+        self.poolMaxSize = poolMaxSize
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.tcpKeepAlive = tcpKeepAlive
+        self.sharePool = sharePool
+
+        # Retries and circuit breaking - see retry.py
+        #   By default the circuit breaker is shared with everything else talking to the host
+        self.retryPolicy = retryPolicy or RetryPolicy()
+        self._circuitBreaker = circuitBreaker
+
+        self._transferTotals = {'calls': 0, 'requestBytes': 0, 'requestWireBytes': 0, 'responseBytes': 0, 'responseWireBytes': 0}
+        self._retryCounts = {}
+        self._countersLock = threading.Lock()
+        self._lastCallTime = 0 # time.monotonic() of the last call that got an answer
         
         self._session = None
 
-        self.lastResults = None
+        # Each thread gets its own lastResults, so concurrent calls don't clobber each other
+        self._threadLocal = threading.local()
 
         self.verifySSL = verifySSL
         if not self.verifySSL:
@@ -36,22 +114,110 @@ class RestInterface(object):
     @property
     def session(self):
         if not self._session:
-            self._session = requests.Session()
+            if self.sharePool:
+                self._session = sharedSession(self._poolKey, self.poolConnections, self.poolMaxSize, self.tcpKeepAlive)
+            else:
+                self._session = newSession(self.poolConnections, self.poolMaxSize, self.tcpKeepAlive)
         return self._session
+
+    @property
+    def _poolKey(self):
+        """Interfaces with the same key (scheme, host and port) can share connections"""
+        return ('https' if self.https else 'http', self.host, self.ports[self.https])
+
+    @property
+    def circuitBreaker(self):
+        if not self._circuitBreaker:
+            self._circuitBreaker = circuitBreakerFor(self._poolKey)
+        return self._circuitBreaker
+
+    @property
+    def _timeout(self):
+        return (self.connectTimeout, self.readTimeout)
+
+    @property
+    def lastResults(self):
+        """The results of this thread's last call. 
+        (The request path itself passes each call's results along instead)"""
+        return getattr(self._threadLocal, 'lastResults', None)
+
+    @lastResults.setter
+    def lastResults(self, results):
+        self._threadLocal.lastResults = results
+
+    @property
+    def lastTransfer(self):
+        """Bytes sent and received by this thread's last call, before (requestBytes, responseBytes)
+        and after (requestWireBytes, responseWireBytes) compression."""
+        return getattr(self._threadLocal, 'lastTransfer', None)
+
+    @property
+    def transferTotals(self):
+        """Running totals of lastTransfer across all calls"""
+        with self._countersLock:
+            return dict(self._transferTotals)
+
+    def _countTransfer(self, apiUrl, requestBytes, requestWireBytes, responseBytes, responseWireBytes):
+        transfer = {
+            'apiUrl': apiUrl,
+            'requestBytes': requestBytes,
+            'requestWireBytes': requestWireBytes,
+            'responseBytes': responseBytes,
+            'responseWireBytes': responseWireBytes,
+        }
+        self._threadLocal.lastTransfer = transfer
+        self._lastCallTime = time.monotonic()
+        with self._countersLock:
+            self._transferTotals['calls'] += 1
+            for counter in ('requestBytes', 'requestWireBytes', 'responseBytes', 'responseWireBytes'):
+                self._transferTotals[counter] += transfer[counter]
     
-    @classmethod
-    def _coerceThingForJSON(cls, thing):
-        """JSON serializes directly or not at all. 
-        Dates are easy though.
+    @property
+    def retryCounts(self):
+        """Retries so far, by reason ('transport' or the bad token's status code),
+        plus how many calls were given up on ('exhausted') or failed fast ('shortCircuited')."""
+        with self._countersLock:
+            return dict(self._retryCounts)
+
+    def _countRetry(self, reason):
+        with self._countersLock:
+            self._retryCounts[reason] = self._retryCounts.get(reason, 0) + 1
+
+    def _backoff(self, reason, retry):
+        """Wait before the given retry, if the policy allows another.
+        Returns False once the retries are used up.
+        """
+        if retry > self.retryPolicy.maxRetries:
+            self._countRetry('exhausted')
+            return False
+        self._countRetry(reason)
+        time.sleep(self.retryPolicy.delay(retry))
+        return True
+
+    def _allowCall(self):
+        try:
+            self.circuitBreaker.allow()
+        except Exception:
+            self._countRetry('shortCircuited')
+            raise
+
+    def _packagePayload(self, jsonData):
+        return self.codec.dumps(jsonData)
+
+    def _compressPayload(self, payload):
+        """Compress the request body if it's big enough to be worth it.
+        Returns the body and the headers to send with it.
         """
-        if isinstance(thing, (datetime, date, arrow.Arrow)):
-            return thing.isoformat()
-        # Simply return it and hope the error gets to someone who can coerce it better
-        return thing
+        headers = {'Accept-Encoding': ACCEPT_ENCODING}
+        if self.compression and len(payload) >= self.compressThreshold:
+            compressed = COMPRESSORS[self.compression](payload, self.compressLevel)
+            if len(compressed) < len(payload):
+                payload = compressed
+                headers['Content-Encoding'] = self.compression
+        return payload, headers
 
-    @classmethod
-    def _packagePayload(cls, jsonData):
-        return json.dumps(jsonData, default=cls._coerceThingForJSON)
+    def _unpackageResults(self, content):
+        return self.codec.loads(content)
 
     @staticmethod
     def _coerceToList(obj):
@@ -65,52 +231,101 @@ class RestInterface(object):
                 obj = [obj]
         return obj
     
+    def _mapConcurrently(self, function, argSets, maxWorkers=DEFAULT_MAX_WORKERS):
+        """Call the function on each of the argSets, with up to maxWorkers calls in flight at once.
+        Results are returned in the same order as the argSets.
+        """
+        argSets = list(argSets)
+        if maxWorkers <= 1 or len(argSets) <= 1:
+            return [function(args) for args in argSets]
+        with ThreadPoolExecutor(max_workers=min(maxWorkers, len(argSets))) as executor:
+            return list(executor.map(function, argSets))
+
     # REST API methods
     
+    def _url(self, apiUrl):
+        return 'http%s://%s:%s/%s/%s' % ('s' if self.https else '', 
+                                         self.host, 
+                                         self.ports[self.https],
+                                         self.apiVersion,
+                                         apiUrl)
+
     def _post(self, apiUrl, jsonData):
         payload = self._packagePayload(jsonData)
-        url = 'http%s://%s:%s/%s/%s' % ('s' if self.https else '', 
-                                            self.host, 
-                                            self.ports[self.https],
-                                            self.apiVersion,
-                                            apiUrl)
-        response = self.session.post(url,data=payload, verify=(self.https and self.verifySSL))
-        responseJson = response.json()
+        body, headers = self._compressPayload(payload)
+        url = self._url(apiUrl)
+
+        # Dropped connections, timeouts and server errors are retried as the policy allows
+        retry = 0
+        while True:
+            self._allowCall()
+            try:
+                response = self.session.post(url,data=body, headers=headers, verify=(self.https and self.verifySSL), timeout=self._timeout)
+                if response.status_code >= 500:
+                    response.raise_for_status()
+                content = response.content
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as error:
+                self.circuitBreaker.recordFailure()
+                retry += 1
+                if not self._mayRetry(apiUrl, error) or not self._backoff('transport', retry):
+                    raise
+                continue
+            except Exception:
+                # Anything else is a failure too, or a test call would leave the circuit half open for good
+                self.circuitBreaker.recordFailure()
+                raise
+            self.circuitBreaker.recordSuccess()
+            break
+
+        # What came over the wire, before requests decompressed it
+        self._countTransfer(apiUrl, len(payload), len(body), len(content), response.raw.tell() or len(content))
+        responseJson = self._unpackageResults(content)
         self.lastResults = responseJson
-       
+        return responseJson
+
+    def _mayRetry(self, apiUrl, error):
+        """True if the failed call can be sent again without risk of doing it twice"""
+        return apiUrl not in NON_IDEMPOTENT_APIS or self._neverSent(error)
+
+    @staticmethod
+    def _neverSent(error):
+        """True if the transport error came before the request got to Canary (the connection couldn't be made)"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
 
-    def _raiseUnhandledPostError(self, apiUrl, jsonData):
-        """Separated out to allow subclasses to manage certain error states on their own"""
-        if self.lastResults['errors']:
+    def _raiseUnhandledPostError(self, apiUrl, jsonData, results=None):
+        """Separated out to allow subclasses to manage certain error states on their own.
+        Pass the call's results - falling back to lastResults is only safe with one thread.
+        """
+        if results is None:
+            results = self.lastResults
+        if results['errors']:
             if jsonData and 'password' in jsonData:
                 jsonData['password'] = '********'
             raise RuntimeError('Canary API call to "%s" had errors: %r.\nData passed: %r' % (
-                apiUrl, self.lastResults['errors'], jsonData))
+                apiUrl, results['errors'], jsonData))
 
 
     def _iterPost(self, apiUrl, jsonData, resultKey):
-        self._post(apiUrl, jsonData)
-        self._raiseUnhandledPostError(apiUrl, jsonData)
-        while self.lastResults.get('continuation', False):
-            results = self.lastResults[resultKey]
-            if isinstance(results, (list,tuple)):
-                for item in self.lastResults[resultKey]:
-                    yield item
-            else:
-                yield results
-            jsonData['continuation'] = self.lastResults['continuation']
-            self._post(apiUrl, jsonData)
-            self._raiseUnhandledPostError(apiUrl, jsonData)
-        else:
-            results = self.lastResults[resultKey]
-            if isinstance(results, (list,tuple)):
-                for item in self.lastResults[resultKey]:
+        while True:
+            results = self._post(apiUrl, jsonData)
+            self._raiseUnhandledPostError(apiUrl, jsonData, results)
+
+            entries = results[resultKey]
+            if isinstance(entries, (list,tuple)):
+                for item in entries:
                     yield item
             else:
-                yield results
+                yield entries
+
+            if not results.get('continuation', False):
+                break
+            jsonData['continuation'] = results['continuation']
     
     def _singlePost(self, apiUrl, jsonData, resultKey):
-        self._post(apiUrl, jsonData)
-        self._raiseUnhandledPostError(apiUrl, jsonData)
+        results = self._post(apiUrl, jsonData)
+        self._raiseUnhandledPostError(apiUrl, jsonData, results)
 
-        return self.lastResults[resultKey]
+        return results[resultKey]
@@ -0,0 +1,123 @@
+"""
+	Retry policy and circuit breaking for calls to Canary.
+
+	Failed calls (dropped connections, timeouts, 5xx responses and expired
+	tokens) are retried a bounded number of times. Between tries the client waits
+	a capped, exponentially growing delay with full jitter, so a herd of clients
+	doesn't hammer a historian that's restarting.
+
+	Each host and port also gets a circuit breaker. Once enough transport failures in a row
+	have piled up, calls fail fast with CircuitOpenError instead of waiting on a
+	host that's down. After resetTimeout seconds, one call is let through to test the
+	waters: if it works the circuit closes again, and if not it stays open a while longer.
+
+"""
+import random
+import threading
+import time
+
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 0.1  # seconds
+DEFAULT_MAX_DELAY = 10.0  # seconds
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0  # seconds
+
+
+class CircuitOpenError(RuntimeError):
+    """The historian has been failing, so the call wasn't even tried."""
+    pass
+
+
+class RetryPolicy(object):
+    """How many times to retry, and how long to wait before each try.
+
+    The wait before retry n is a random amount between zero and
+      baseDelay * 2**(n-1), but never more than maxDelay.
+    """
+
+    __slots__ = ('maxRetries', 'baseDelay', 'maxDelay')
+
+    def __init__(self, maxRetries=DEFAULT_MAX_RETRIES, baseDelay=DEFAULT_BASE_DELAY, maxDelay=DEFAULT_MAX_DELAY):
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+
+    def delay(self, retry):
+        """Seconds to wait before the given retry (counting from 1)"""
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** (retry - 1)))
+
+    def __repr__(self):
+        return '<RetryPolicy maxRetries=%r baseDelay=%r maxDelay=%r>' % (self.maxRetries, self.baseDelay, self.maxDelay)
+
+
+class CircuitBreaker(object):
+    """Stops calls to a host after failureThreshold transport failures in a row.
+    The state is one of 'closed' (all good), 'open' (failing fast)
+      or 'halfOpen' (one test call is out).
+    """
+
+    __slots__ = ('failureThreshold', 'resetTimeout', 'opened',
+                 '_failures', '_openedAt', '_testing', '_lock')
+
+    def __init__(self, failureThreshold=DEFAULT_FAILURE_THRESHOLD, resetTimeout=DEFAULT_RESET_TIMEOUT):
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.opened = 0 # times the circuit has opened, for monitoring
+
+        self._failures = 0
+        self._openedAt = None
+        self._testing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._openedAt is None:
+            return 'closed'
+        return 'halfOpen' if self._testing else 'open'
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go ahead."""
+        with self._lock:
+            if self._openedAt is None:
+                return
+            if not self._testing and time.monotonic() - self._openedAt >= self.resetTimeout:
+                self._testing = True
+                return
+        raise CircuitOpenError("Calls to this Canary host are failing, so they're on hold for up to %0.1f seconds." % self.resetTimeout)
+
+    def recordSuccess(self):
+        with self._lock:
+            self._failures = 0
+            self._openedAt = None
+            self._testing = False
+
+    def recordAbandoned(self):
+        """A call was given up on (cancelled) before it said anything about the host, so let another test call thru"""
+        with self._lock:
+            self._testing = False
+
+    def recordFailure(self):
+        with self._lock:
+            self._failures += 1
+            if self._testing or (self._openedAt is None and self._failures >= self.failureThreshold):
+                if self._openedAt is None:
+                    self.opened += 1
+                self._openedAt = time.monotonic()
+            self._testing = False
+
+    def __repr__(self):
+        return '<CircuitBreaker %s (%d failures)>' % (self.state, self._failures)
+
+
+_circuitBreakers = {}
+_circuitBreakersLock = threading.Lock()
+
+
+def circuitBreakerFor(key):
+    """The circuit breaker shared by every interface talking to the same host and port (by key)"""
+    with _circuitBreakersLock:
+        if key not in _circuitBreakers:
+            _circuitBreakers[key] = CircuitBreaker()
+        return _circuitBreakers[key]
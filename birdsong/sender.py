@@ -1,27 +1,259 @@
+from .rest import chunks, DEFAULT_MAX_WORKERS
+from .codec import getCodec
 from .tokens import UserTokenManagement, SessionTokenManagement
-from .values import Tvq, Property, Annotation
-from collections import defaultdict
+from .values import Tvq, Property, Annotation, TvqSeries
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import threading, queue, time
 
 
 DEFAULT_SENDER_PORT_ANONYMOUS_HTTP = '55253'
 DEFAULT_SENDER_PORT_USERNAME_HTTPS = '55254'      
 
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from l.
-    From https://stackoverflow.com/a/312464/11902188
+ALLOWED_VALUE_TYPES = (Tvq, Property, Annotation)
+
+def _coerceList(someList):
+    """Make sure that we send a proper list of lists.
+    Helper objects are converted to their ISO8601 value tuples.
+    (This ensures it serializes correctly)
+    """
+    if isinstance(someList, TvqSeries):
+        return list(someList.rows(iso8601=True))
+
+    # If the list isn't empty, check if it's a singleton entry
+    if someList and not isinstance(someList[0], (tuple, list) + ALLOWED_VALUE_TYPES):
+        return [someList.values(iso8601=True) 
+                    if isinstance(someList, ALLOWED_VALUE_TYPES) 
+                    else someList
+                ]
+    else:
+        return [value.values(iso8601=True) 
+                    if isinstance(value, ALLOWED_VALUE_TYPES) 
+                    else value
+                for value in someList
+                ]
+
+
+def _packageData(tvqs, properties, annotations):
+    """Convert from helpers objects, if needed, into the dict of dicts storeData sends."""
+    return {
+        'tvqs':        dict((tag, _coerceList(values)) for tag,values in tvqs.items()),
+        'properties':  dict((tag, _coerceList(values)) for tag,values in properties.items()),
+        'annotations': dict((tag, _coerceList(values)) for tag,values in annotations.items()),
+    }
+
+
+# Room left in each page for the tokens and braces around the data
+PAGE_OVERHEAD_BYTES = 256
+
+
+def _pageData(dataToSend, maxPageSize, maxPageBytes=None, encode=None):
+    """Yield storeData payloads holding at most maxPageSize values each.
+    Each tag's values stay in order, so earlier entries are always sent first.
+
+    With maxPageBytes, pages are also cut before their JSON would grow past that.
+      Values are encoded one at a time to size them up, so the whole payload 
+      never has to be serialized just to find out how big it is.
+    """
+    if maxPageBytes:
+        yield from _pageDataBySize(dataToSend, maxPageSize, maxPageBytes, encode or getCodec().dumps)
+        return
+
+    pageLen = 0
+    pageDict = {}
+
+    for entryType in ('tvqs', 'properties', 'annotations'):
+        for tag,values in dataToSend[entryType].items():
+            ix = 0
+            while ix < len(values):
+                chunk = values[ix:ix + maxPageSize - pageLen]
+                pageDict.setdefault(entryType, {})[tag] = chunk
+                pageLen += len(chunk)
+                ix += len(chunk)
+
+                if pageLen >= maxPageSize:
+                    yield pageDict
+                    # reset the page counters
+                    pageDict = {}
+                    pageLen = 0
+    if pageLen:
+        yield pageDict
+
+
+def _pageDataBySize(dataToSend, maxPageSize, maxPageBytes, encode):
+    """_pageData, but keeping a running tally of each page's encoded size as well.
+    A single value bigger than maxPageBytes still gets sent, on a page of its own.
     """
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+    pageLen = 0
+    pageBytes = PAGE_OVERHEAD_BYTES
+    pageDict = {}
+
+    for entryType in ('tvqs', 'properties', 'annotations'):
+        entryTypeBytes = len(entryType) + 8 # "tvqs": {}, 
+        for tag,values in dataToSend[entryType].items():
+            tagBytes = len(encode(tag)) + 6 # "tag": [], 
+            start = 0 # where this tag's chunk on the current page begins
+            for ix,value in enumerate(values):
+                encodedBytes = len(encode(value)) + 2 # value, 
+                valueBytes = encodedBytes
+                if ix == start:
+                    valueBytes += tagBytes + (0 if entryType in pageDict else entryTypeBytes)
+
+                if pageLen and (pageLen >= maxPageSize or pageBytes + valueBytes > maxPageBytes):
+                    if ix > start:
+                        pageDict[entryType][tag] = values[start:ix]
+                    yield pageDict
+                    # reset the page counters, and start the tag's chunk over on the new page
+                    pageDict = {}
+                    pageLen = 0
+                    pageBytes = PAGE_OVERHEAD_BYTES
+                    valueBytes = encodedBytes + tagBytes + entryTypeBytes
+                    start = ix
+
+                pageDict.setdefault(entryType, {})
+                pageLen += 1
+                pageBytes += valueBytes
+            if start < len(values):
+                pageDict[entryType][tag] = values[start:]
+    if pageLen:
+        yield pageDict
+
+
+def _pageTags(pageDict):
+    """The set of tags a storeData page touches"""
+    return {tag for tagDict in pageDict.values() for tag in tagDict}
+
+
+def _estimateBytes(value):
+    """Rough size of a (coerced) value once it's serialized to JSON. Cheap rather than exact."""
+    if isinstance(value, str):
+        return len(value) + 3
+    if isinstance(value, (list, tuple)):
+        return sum(_estimateBytes(entry) for entry in value) + 2
+    if value is None:
+        return 5
+    return 12 # numbers and such
+
+
+class StoreBuffer(object):
+    """Gathers up storeData calls from any thread and sends them from a background thread.
+
+    Queued values are merged per tag and sent once flushValues values or about flushBytes
+      bytes are waiting, or once the oldest has waited flushLatency seconds - whichever
+      comes first. The queue holds at most maxQueued storeData calls; past that, storeData
+      blocks until the background thread catches up.
+
+    Errors from sending are raised on the next put, flush or close.
+    """
+
+    _STOP = 'stop'
+    _FLUSH = 'flush'
+
+    def __init__(self, sender, flushValues=25000, flushBytes=1024000, flushLatency=1.0, maxQueued=1000):
+        self._sender = sender
+        self.flushValues = flushValues
+        self.flushBytes = flushBytes
+        self.flushLatency = flushLatency
+
+        self._queue = queue.Queue(maxsize=maxQueued)
+        self._thread = None
+        self._threadLock = threading.Lock()
+        self._error = None
+
+    def put(self, dataToSend):
+        """Queue up a packaged storeData payload (see _packageData)"""
+        self._raiseError()
+        self._start()
+        self._queue.put(dataToSend)
+
+    def flush(self):
+        """Send everything queued so far, waiting until it's done."""
+        if self._thread:
+            done = threading.Event()
+            self._queue.put((self._FLUSH, done))
+            done.wait()
+        self._raiseError()
+
+    def close(self):
+        """Flush and stop the background thread. Another put will start it up again."""
+        with self._threadLock:
+            thread, self._thread = self._thread, None
+        if thread:
+            done = threading.Event()
+            self._queue.put((self._STOP, done))
+            thread.join()
+        self._raiseError()
+
+    def _start(self):
+        with self._threadLock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='birdsong-StoreBuffer', daemon=True)
+                self._thread.start()
+
+    def _raiseError(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise RuntimeError('Buffered storeData failed in the background: %r' % error) from error
+
+    def _run(self):
+        pending = {'tvqs': {}, 'properties': {}, 'annotations': {}}
+        pendingValues = 0
+        pendingBytes = 0
+        deadline = None
+
+        while True:
+            try:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None # the latency timer ran out
+
+            if isinstance(item, dict):
+                for entryType,tagDict in item.items():
+                    for tag,values in tagDict.items():
+                        pending[entryType].setdefault(tag, []).extend(values)
+                        pendingValues += len(values)
+                        pendingBytes += len(tag) + _estimateBytes(values)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flushLatency
+                if pendingValues < self.flushValues and pendingBytes < self.flushBytes:
+                    continue
+
+            if pendingValues:
+                # Only size up the values one by one when the rough tally says they might not fit
+                #   (with room to spare, since it can be off by as much as half)
+                packetSize = self._sender._settings['packetSize']
+                maxPageBytes = packetSize if pendingBytes + PAGE_OVERHEAD_BYTES > packetSize // 2 else None
+                try:
+                    self._sender._storePages(_pageData(pending, self.flushValues, maxPageBytes,
+                                                       self._sender._packagePayload))
+                except Exception as error:
+                    self._error = error
+                pending = {'tvqs': {}, 'properties': {}, 'annotations': {}}
+                pendingValues = 0
+                pendingBytes = 0
+            deadline = None
+
+            if isinstance(item, tuple):
+                command, done = item
+                done.set()
+                if command == self._STOP:
+                    return
 
 
 class CanarySender(SessionTokenManagement, UserTokenManagement):
     
-    __slots__ = ('_lastStoredTags')
+    __slots__ = ('_lastStoredTags', '_storeBuffer')
 
     def __init__(self, 
                  httpPort =DEFAULT_SENDER_PORT_ANONYMOUS_HTTP, 
                  httpsPort=DEFAULT_SENDER_PORT_USERNAME_HTTPS, 
+                 buffered=False,
+                 flushValues=25000,
+                 flushBytes=None,
+                 flushLatency=1.0,
+                 maxQueued=1000,
                  **configuration):
         """Canary Sender interface for pushing data to the historian service(s).
 
@@ -31,12 +263,47 @@ class CanarySender(SessionTokenManagement, UserTokenManagement):
             with CanarySender() as send:
                 send.storeData(tvqs)
 
+        With buffered=True, storeData just queues the values (from any thread) and
+          returns. A background thread merges them per tag and sends them when enough
+          have piled up or the oldest has waited long enough. Call flush() to push
+          out everything queued so far; leaving the context manager does that too.
+
         Args:
             httpPort: (str) Port configured for anonymous HTTP access
             httpsPort: (str) Port configured for user/pass HTTPS access
+            buffered: (bool) Queue storeData calls and send them in the background
+            flushValues: (int) Send once this many values are buffered
+            flushBytes: (int) Send once about this many bytes are buffered (default: the packetSize setting)
+            flushLatency: (float) Seconds the oldest buffered value may wait before sending
+            maxQueued: (int) storeData calls that may wait in the queue before storeData blocks
         """
+        self._storeBuffer = None
         super().__init__(httpPort =httpPort, httpsPort=httpsPort, **configuration)
 
+        if buffered:
+            self._storeBuffer = StoreBuffer(self, 
+                                            flushValues=flushValues, 
+                                            flushBytes=flushBytes or self._settings['packetSize'], 
+                                            flushLatency=flushLatency, 
+                                            maxQueued=maxQueued)
+
+
+    # Context management
+
+    def __exit__(self, *args):
+        # Get anything buffered out before the session goes away
+        try:
+            if self._storeBuffer:
+                self._storeBuffer.close()
+        finally:
+            super().__exit__(*args)
+
+
+    def flush(self):
+        """Send any buffered storeData values, waiting until they're sent."""
+        if self._storeBuffer:
+            self._storeBuffer.flush()
+
 
     # Storage - File options
 
@@ -98,88 +365,82 @@ class CanarySender(SessionTokenManagement, UserTokenManagement):
 
     # Storage - Data
     
-    def storeData(self, tvqs={}, properties={}, annotations={}, maxPageSize=25000):
+    def storeData(self, tvqs={}, properties={}, annotations={}, maxPageSize=25000, maxPageBytes=None, maxWorkers=DEFAULT_MAX_WORKERS):
         """Store data in the historian.
         Three types of data may be inserted, values, tag properties, and annotations.
         Each entry is a dictionary of tag path keys and arrays of arrays values.
         The value tuples/lists for each is:
-            tvqs: (timestamp, value, quality (opt))
+            tvqs: (timestamp, value, quality (opt)) - or a TvqSeries
             properties: (prop name, timestamp, value, quality (opt)) 
             annotations: (user, timestamp, value, createdAt (opt))
 
         The maxPageSize limits the size of very large payloads to Canary. If the
           number of values for each tag in each dict totals more than this, then
           the update will be broken up into smaller chunks of maxPageSize each.
+          Pass maxPageBytes to also keep pages under that many bytes of JSON (like the 
+          session's packetSize setting, for long strings). That sizes up each value
+          as it goes, so it's off by default.
+          Up to maxWorkers pages are uploaded at once, but a tag's pages are still
+          sent in order: a page waits until the earlier pages with any of the same
+          tags are acknowledged.
+
+        If the sender is buffered, the data is queued for the background thread 
+          instead (and the buffer's flushValues sets the page size).
 
         Args:
             tvqs: (dict of lists) Values for tags
             properties: (dict of lists) Properties for tags
             annotations: (dict of lists) Annotations for tags
-            maxPageSize: (int) Number of values to send in a single update payload        """
+            maxPageSize: (int) Number of values to send in a single update payload
+            maxPageBytes: (int) Most bytes of JSON to send in a single update payload
+            maxWorkers: (int) Number of pages to upload at once        """
         
-        # Make sure that we send a proper list of lists.
-        def coerceList(someList):
-            allowedTypes = (Tvq, Property, Annotation)
-            # If the list isn't empty, check if it's a singleton entry
-            if someList and not isinstance(someList[0], (tuple, list) + allowedTypes):
-                return [someList.values(iso8601=True) 
-                            if isinstance(someList, allowedTypes) 
-                            else someList
-                        ]
-            else:
-                return [value.values(iso8601=True) 
-                            if isinstance(value, allowedTypes) 
-                            else value
-                        for value in values
-                        ]
-
-        # Convert from helpers objects, if needed. (This ensures it serializes correctly)
-        for tag,values in tvqs.items():
-            tvqs[tag] = coerceList(values)
-
-        for tag,values in properties.items():
-            properties[tag] = coerceList(values)
-
-        for tag,values in annotations.items():
-            annotations[tag] = coerceList(values)
-
-        dataToSend = {
-            'tvqs': tvqs,
-            'properties': properties,
-            'annotations': annotations
-        }
+        dataToSend = _packageData(tvqs, properties, annotations)
 
-        if sum(sum(len(values) for values in tagDict.values())
-               for tagDict in dataToSend.values()
-               ) < maxPageSize:
-            self._storeData(**dataToSend)
+        if self._storeBuffer:
+            self._storeBuffer.put(dataToSend)
         else:
-            # Page out the data. Sort to make ensure earliest entries are added first
-            pageLen = 0
-            pageDict = {}
-
-            for entryType in ('tvqs', 'properties', 'annotations'):
-                pageDict[entryType] = tagDict = {}
-
-                for tag,values in dataToSend[entryType].items():
-                    tagDict[tag] = []
+            # Page out the data, if needed.
+            self._storePages(_pageData(dataToSend, maxPageSize, maxPageBytes, self._packagePayload), maxWorkers)
 
-                    for value in values:
-                        tagDict[tag].append(value)
-                        pageLen += 1
-
-                        if pageLen >= maxPageSize:
-                            self._storeData(**pageDict)
+        self._lastStoredTags = set(tvqs.keys()) | set(properties.keys()) | set(annotations.keys())
 
-                            # reset the page counters
-                            pageDict[entryType] = tagDict = {}
-                            tagDict[tag] = []
-                            pageLen = 0
-            else:
-                if pageLen:
-                    self._storeData(**pageDict)
 
-        self._lastStoredTags = set(tvqs.keys()) | set(properties.keys()) | set(annotations.keys())
+    def _storePages(self, pages, maxWorkers=DEFAULT_MAX_WORKERS):
+        """Send the storeData pages, with up to maxWorkers in flight at once.
+        Each page waits for the earlier pages that share any of its tags, so
+          every tag's values still land in order.
+        """
+        if maxWorkers <= 1:
+            for pageDict in pages:
+                self._storeData(**pageDict)
+            return
+
+        # Get the tokens up front so the workers don't race for them
+        self.sessionToken
+
+        lastSentFor = {}
+        inFlight = deque()
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            for pageDict in pages:
+                tags = _pageTags(pageDict)
+                waitFor = {lastSentFor[tag] for tag in tags if tag in lastSentFor}
+                sent = executor.submit(self._storePageAfter, waitFor, pageDict)
+                for tag in tags:
+                    lastSentFor[tag] = sent
+                inFlight.append(sent)
+                # Don't slice out pages much faster than they're sent
+                if len(inFlight) > 2 * maxWorkers:
+                    inFlight.popleft().result()
+            for sent in inFlight:
+                sent.result()
+
+    def _storePageAfter(self, waitFor, pageDict):
+        # Earlier pages are submitted first, so they're already running or done.
+        # If one failed, this raises rather than sending the tag's values out of order.
+        for earlier in waitFor:
+            earlier.result()
+        self._storeData(**pageDict)
 
 
     def _storeData(self, tvqs={}, properties={}, annotations={}):
@@ -209,6 +470,9 @@ class CanarySender(SessionTokenManagement, UserTokenManagement):
             assert self._lastStoredTags, "Can't set 'No Data' without context. No tags given and _lastStoredTags is empty."
             tags = self._lastStoredTags
 
+        # The No Data has to land after anything still buffered
+        self.flush()
+
         dataEntry = {
             "userToken":self.userToken,
             "sessionToken":self.sessionToken,
@@ -0,0 +1,431 @@
+"""
+	Read-through cache for getTagData.
+
+	Dashboards and analysis jobs tend to ask for the same tags over and over, with
+	windows that overlap the last ones they asked for. The cache keeps each tag's
+	samples (as a TvqSeries) along with an index of the time ranges it has already
+	fetched. A new request then only goes to Canary for the parts of its window
+	that aren't covered yet, and the rest is served locally.
+
+	Entries are kept per tag and per set of constraints (aggregate, interval,
+	quality and so on), so raw and aggregated data never mix. Aggregates are only
+	reused for windows with the same start (so the buckets line up), and are
+	fetched again whole if any of the window is missing.
+
+	Nothing newer than settleTime seconds ago is marked as covered, since late
+	and backfilled values may still be on their way. The recent end of a window
+	is fetched fresh every time.
+
+	Entries are dropped least recently used first once memoryBudget bytes are
+	in use. Given a path, entries are also written to a SQLite file, so they
+	outlive eviction (and the process) and can be loaded back on a miss.
+
+	Raw windows are read (and cached) a microsecond past their end, so a sample
+	right on the end is always known. Whether Canary counts it as part of the
+	window is learned once per host and user (from a sample that came back on a
+	fetch's end, or else by asking for the microsecond up to one), and results
+	are cut at the end just as the uncached call would cut them.
+
+	Only windows with absolute start and end times can be cached. A window with
+	relative times (like 'Now-1Day'), naive times in a timezone other than UTC,
+	maxSize or includeBounds is passed straight thru to Canary.
+
+"""
+import json
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+import arrow
+import ciso8601
+
+from .values import TvqSeries, _asEpochNanoseconds, _epochDatetime
+
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes
+DEFAULT_SETTLE_TIME = 60.0  # seconds
+
+# Constraints that don't change which samples a window has - these are handled by the interval index
+RANGE_CONSTRAINTS = ('startTime', 'endTime', 'userToken')
+
+# Constraints that change what Canary hands back in ways the cache can't stitch together
+UNCACHEABLE_CONSTRAINTS = ('maxSize', 'includeBounds')
+
+# Rough cost of an entry beyond its samples, and of a sample that isn't a number
+ENTRY_OVERHEAD_BYTES = 512
+OBJECT_VALUE_BYTES = 56
+
+# How far past its end a raw window is read, so samples right on the end are known either way
+READ_PAST_END = 1000    # nanoseconds (a timestamp sent to Canary can't hold any less)
+
+# Bumped whenever the way samples are saved changes (older cache files are then started over)
+SQLITE_SCHEMA_VERSION = 3
+
+
+def _windowNanoseconds(timestamp, timezone):
+    """Nanoseconds since the Unix epoch for a window's start or end, or None if
+    it can't be pinned down without asking Canary (relative times, naive times in a local timezone).
+    """
+    if isinstance(timestamp, str):
+        try:
+            timestamp = ciso8601.parse_datetime(timestamp)
+        except ValueError:
+            return None
+    elif isinstance(timestamp, arrow.Arrow):
+        timestamp = timestamp.datetime
+    if not isinstance(timestamp, datetime):
+        return None
+    if timestamp.tzinfo is None and timezone != 'UTC':
+        return None
+    return _asEpochNanoseconds(timestamp)
+
+
+def _isoTimestamp(nanoseconds):
+    return _epochDatetime(nanoseconds).isoformat()
+
+
+def _missingRanges(intervals, start, end):
+    """The parts of [start, end) not covered by the sorted, disjoint intervals"""
+    missing = []
+    for coveredStart, coveredEnd in intervals:
+        if coveredEnd <= start:
+            continue
+        if coveredStart >= end:
+            break
+        if coveredStart > start:
+            missing.append((start, coveredStart))
+        start = max(start, coveredEnd)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def _addInterval(intervals, start, end):
+    """Mark [start, end) as covered, merging it with any intervals it touches"""
+    merged = []
+    for coveredStart, coveredEnd in intervals:
+        if coveredEnd < start or coveredStart > end:
+            merged.append((coveredStart, coveredEnd))
+        else:
+            start, end = min(start, coveredStart), max(end, coveredEnd)
+    merged.append((start, end))
+    merged.sort()
+    return merged
+
+
+class TagDataCacheEntry(object):
+    """One tag's cached samples for one set of constraints, and the ranges they cover."""
+
+    __slots__ = ('series', 'intervals')
+
+    def __init__(self, series=None, intervals=None):
+        self.series = TvqSeries() if series is None else series
+        self.intervals = intervals or []
+
+    @property
+    def nbytes(self):
+        series = self.series
+        valueBytes = (OBJECT_VALUE_BYTES if series._values.__class__ is list else 8) * len(series)
+        kindBytes = len(series._kinds) if series._kinds is not None else 0
+        offsetBytes = 4 * len(series._offsets) if series._offsets is not None else 0
+        return (ENTRY_OVERHEAD_BYTES + 12 * len(series) + valueBytes + kindBytes + offsetBytes 
+                + 16 * len(self.intervals))
+
+    def missing(self, start, end):
+        return _missingRanges(self.intervals, start, end)
+
+    def splice(self, start, end, series):
+        """Replace whatever is held for [start, end) with the samples in series (which are clipped to it)"""
+        self.series = TvqSeries.concat([self.series.between(None, start),
+                                        series.between(start, end),
+                                        self.series.between(end, None)])
+        self.intervals = _addInterval(self.intervals, start, end)
+
+
+class SqliteTier(object):
+    """Cache entries kept in a SQLite file, one row per tag and set of constraints."""
+
+    __slots__ = ('path', '_lock', '_connection')
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            if self._connection.execute('PRAGMA user_version').fetchone()[0] != SQLITE_SCHEMA_VERSION:
+                self._connection.execute('DROP TABLE IF EXISTS tagData')
+                self._connection.execute('PRAGMA user_version = %d' % SQLITE_SCHEMA_VERSION)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS tagData ('
+                '  cacheKey TEXT, tagPath TEXT, intervals TEXT,'
+                '  timestamps BLOB, valuesKind TEXT, "values" BLOB, qualities BLOB, kinds BLOB, offsets BLOB,'
+                '  PRIMARY KEY (cacheKey, tagPath))')
+
+    def load(self, cacheKey, tagPath):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT intervals, timestamps, valuesKind, "values", qualities, kinds, offsets FROM tagData '
+                'WHERE cacheKey = ? AND tagPath = ?', (cacheKey, tagPath)).fetchone()
+        if row is None:
+            return None
+        intervals, timestamps, valuesKind, values, qualities, kinds, offsets = row
+
+        series = TvqSeries()
+        series._timestamps.frombytes(timestamps)
+        series._qualities.frombytes(qualities)
+        if offsets is not None:
+            series._offsets = array('i')
+            series._offsets.frombytes(offsets)
+        if valuesKind == 'json':
+            series._values = json.loads(values)
+        else:
+            series._values.frombytes(values)
+            series._kinds = None if kinds is None else bytearray(kinds)
+        return TagDataCacheEntry(series, [tuple(interval) for interval in json.loads(intervals)])
+
+    def save(self, cacheKey, tagPath, entry):
+        series = entry.series
+        if series._values.__class__ is list:
+            valuesKind, values = 'json', json.dumps(series._values, default=str)
+        else:
+            valuesKind, values = 'double', series._values.tobytes()
+        kinds = None if series._kinds is None else bytes(series._kinds)
+        offsets = None if series._offsets is None else series._offsets.tobytes()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO tagData VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (cacheKey, tagPath, json.dumps(entry.intervals), series._timestamps.tobytes(),
+                 valuesKind, values, series._qualities.tobytes(), kinds, offsets))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM tagData')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class TagDataCache(object):
+    """Tag data by tag and constraints, with an index of the time ranges already fetched.
+    Can be shared by several views (entries are kept apart by host and user).
+    """
+
+    __slots__ = ('memoryBudget', 'settleTime', 'hits', 'misses', 'bypassed',
+                 '_entries', '_nbytes', '_disk', '_lock', '_endInclusive')
+
+    def __init__(self, memoryBudget=DEFAULT_MEMORY_BUDGET, path=None, settleTime=DEFAULT_SETTLE_TIME):
+        self.memoryBudget = memoryBudget
+        self.settleTime = settleTime
+
+        # Per tag: served without asking Canary, needed at least one call, or couldn't be cached at all
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._disk = SqliteTier(path) if path else None
+        self._lock = threading.RLock()
+
+        # Per owner: whether Canary includes a sample right on a window's end (once it's known)
+        self._endInclusive = {}
+
+    @property
+    def nbytes(self):
+        """Estimated memory held by the cached entries"""
+        return self._nbytes
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed,
+                'entries': len(self._entries), 'nbytes': self._nbytes}
+
+    def window(self, owner, constraints):
+        """The cache key and [start, end) nanoseconds for a getTagData call, or None if it can't be cached.
+        The owner is whatever tells users apart (like host, port and username).
+        """
+        if any(key in constraints for key in UNCACHEABLE_CONSTRAINTS):
+            return None
+        timezone = constraints.get('timezone')
+        start = _windowNanoseconds(constraints.get('startTime'), timezone)
+        end = _windowNanoseconds(constraints.get('endTime'), timezone)
+        if start is None or end is None or start >= end:
+            return None
+
+        keyed = {key: value for key, value in constraints.items() if key not in RANGE_CONSTRAINTS}
+        if 'aggregateName' in keyed:
+            # Buckets only line up with windows starting at the same time
+            keyed['startTime'] = start
+        return json.dumps([owner, keyed], sort_keys=True, default=str), start, end
+
+    @property
+    def settled(self):
+        """Nanoseconds since the epoch before which data is taken as final"""
+        return int((time.time() - self.settleTime) * 1e9)
+
+    def missing(self, cacheKey, tagPath, start, end):
+        """The ranges of [start, end) that have to be fetched for the tag"""
+        with self._lock:
+            entry = self._entry(cacheKey, tagPath)
+            missing = entry.missing(start, end) if entry else [(start, end)]
+        if missing and '"aggregateName"' in cacheKey:
+            # Partial aggregates can't be stitched together, so get the lot
+            return [(start, end)]
+        return missing
+
+    def get(self, cacheKey, tagPath, start, end):
+        """The cached samples for [start, end)"""
+        with self._lock:
+            entry = self._entry(cacheKey, tagPath)
+            return entry.series.between(start, end) if entry else TvqSeries()
+
+    def put(self, cacheKey, tagPath, start, end, series):
+        """Cache the samples fetched for [start, end). Anything not yet settled is left out."""
+        end = min(end, self.settled)
+        if start >= end:
+            return
+        with self._lock:
+            entry = self._entry(cacheKey, tagPath)
+            if entry is None:
+                entry = TagDataCacheEntry()
+                self._entries[(cacheKey, tagPath)] = entry
+            else:
+                self._nbytes -= entry.nbytes
+            entry.splice(start, end, series)
+            self._nbytes += entry.nbytes
+            if self._disk:
+                self._disk.save(cacheKey, tagPath, entry)
+            self._evict()
+
+    def putAll(self, cacheKey, start, end, seriesByTag):
+        for tagPath, series in seriesByTag.items():
+            self.put(cacheKey, tagPath, start, end, series)
+
+    def plan(self, cacheKey, start, end, tagPaths):
+        """Work out what a read of [start, end) needs from Canary.
+        Returns what's cached for each tag, and the tags grouped by the ranges they're missing
+          (so tags missing the same ranges can be fetched together).
+        """
+        cached = {}
+        tagsByMissing = defaultdict(list)
+        for tagPath in tagPaths:
+            missing = tuple(self.missing(cacheKey, tagPath, start, end))
+            cached[tagPath] = self.get(cacheKey, tagPath, start, end)
+            tagsByMissing[missing].append(tagPath)
+            if missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cached, dict(tagsByMissing)
+
+    def stitch(self, start, cached, tagsByMissing, fetches):
+        """Each tag's samples, with the fetched ranges put in between what was already cached.
+        The fetches are the {tagPath: TvqSeries} for each of fetchArgSets(tagsByMissing), in order.
+        """
+        fetches = iter(fetches)
+        results = {}
+        for missing, tagGroup in tagsByMissing.items():
+            fetchedRanges = [next(fetches) for _ in missing]
+            for tagPath in tagGroup:
+                pieces, cursor = [], start
+                for (rangeStart, rangeEnd), fetched in zip(missing, fetchedRanges):
+                    pieces.append(cached[tagPath].between(cursor, rangeStart))
+                    pieces.append(fetched[tagPath].between(rangeStart, rangeEnd))
+                    cursor = rangeEnd
+                pieces.append(cached[tagPath].between(cursor, None))
+                results[tagPath] = TvqSeries.concat(pieces)
+        return results
+
+    def readEnd(self, cacheKey, end):
+        """How far to read (and cache) a window ending at end: a raw window goes a bit past it
+        (see cutAtEnd), while aggregate buckets are left just as Canary makes them.
+        """
+        return end if '"aggregateName"' in cacheKey else end + READ_PAST_END
+
+    def endProbe(self, owner, cacheKey, end, argSets, fetches, results):
+        """The tag to ask Canary about the window's end with (see learnEnd), or None if it's not needed.
+        That's only when some tag has a sample right on the end, and it's not yet known whether
+          Canary would include it - which a fetch that got a sample back on its own end shows.
+        """
+        if '"aggregateName"' in cacheKey or owner in self._endInclusive:
+            return None
+        for (rangeStart, rangeEnd, tagGroup), fetched in zip(argSets, fetches):
+            if any(series and series._timestamps[-1] == rangeEnd for series in fetched.values()):
+                self._endInclusive[owner] = True
+                return None
+        for tagPath, series in results.items():
+            if series.between(end, end + 1):
+                return tagPath
+        return None
+
+    def learnEnd(self, owner, end, probed):
+        """Note whether Canary included the sample on the end of the probe up to end"""
+        self._endInclusive[owner] = bool(probed) and probed._timestamps[-1] == end
+
+    def cutAtEnd(self, owner, cacheKey, end, results):
+        """Cut the results of a read up to readEnd back to the window's end, as Canary would have"""
+        if '"aggregateName"' in cacheKey:
+            return results
+        cut = end + 1 if self._endInclusive.get(owner) else end
+        return {tagPath: series.between(None, cut) for tagPath, series in results.items()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            if self._disk:
+                self._disk.clear()
+
+    def close(self):
+        if self._disk:
+            self._disk.close()
+
+    def _entry(self, cacheKey, tagPath):
+        """The entry in memory (now the most recently used), or from disk, or None"""
+        entry = self._entries.get((cacheKey, tagPath))
+        if entry is not None:
+            self._entries.move_to_end((cacheKey, tagPath))
+        elif self._disk:
+            entry = self._disk.load(cacheKey, tagPath)
+            if entry is not None:
+                self._entries[(cacheKey, tagPath)] = entry
+                self._nbytes += entry.nbytes
+                self._evict(keep=(cacheKey, tagPath))
+        return entry
+
+    def _evict(self, keep=None):
+        while self._nbytes > self.memoryBudget and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                self._entries.move_to_end(key)
+                key = next(iter(self._entries))
+            self._nbytes -= self._entries.pop(key).nbytes
+
+    def __repr__(self):
+        return '<TagDataCache %d entries, %d of %d bytes%s>' % (
+            len(self._entries), self._nbytes, self.memoryBudget,
+            ', on disk at %s' % self._disk.path if self._disk else '')
+
+
+def fetchArgSets(tagsByMissing):
+    """(rangeStart, rangeEnd, tagPaths) for each call a plan needs"""
+    return [(rangeStart, rangeEnd, tagGroup)
+            for missing, tagGroup in tagsByMissing.items()
+            for rangeStart, rangeEnd in missing]
+
+
+def getTagDataCache(tagDataCache):
+    """Turn the tagDataCache argument into a TagDataCache (or None).
+    True makes one with the defaults (memory only), a string is taken as the SQLite file's path.
+    """
+    if not tagDataCache:
+        return None
+    if tagDataCache is True:
+        return TagDataCache()
+    if isinstance(tagDataCache, str):
+        return TagDataCache(path=tagDataCache)
+    return tagDataCache
@@ -0,0 +1,109 @@
+"""
+	On-disk cache of user and session tokens.
+
+	Short-lived scripts spend a good part of their run getting a user token (and,
+	for senders, a session token) before they can do anything. With a token cache, the
+	tokens are left open on exit and saved to a file, so the next run can pick
+	them up and skip that handshake.
+
+	Cached tokens aren't checked up front. If Canary rejects one (BadUserToken or
+	BadSessionToken), it's dropped from the cache, and a new token is requested and saved.
+
+	The file only holds tokens (never passwords) and is readable by its owner only.
+
+"""
+import json
+import os
+import tempfile
+import threading
+
+
+DEFAULT_TOKEN_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'birdsong', 'tokens.json')
+
+
+def tokenCacheKey(*parts):
+    """A cache key for the token that goes with these parts (host, user, historians...)"""
+    return json.dumps(parts, sort_keys=True)
+
+
+class TokenCache(object):
+    """Tokens by key, kept in a JSON file."""
+
+    __slots__ = ('path', '_lock')
+
+    def __init__(self, path=DEFAULT_TOKEN_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def put(self, key, token):
+        with self._lock:
+            entries = self._read()
+            entries[key] = token
+            self._write(entries)
+
+    def discard(self, key, token=None):
+        """Drop the key's token. If a token is given, only drop it if it's still the one cached."""
+        with self._lock:
+            entries = self._read()
+            if key in entries and (token is None or entries[key] == token):
+                del entries[key]
+                self._write(entries)
+
+    def clear(self):
+        with self._lock:
+            self._write({})
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as cacheFile:
+                return json.load(cacheFile)
+        except (OSError, ValueError):
+            # Missing or mangled - either way, start over
+            return {}
+
+    def _write(self, entries):
+        """Write the entries out, swapping the file in whole so readers never see half of it"""
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        # (mkstemp's file is only readable by its owner, and its name is never shared with another writer)
+        handle, tempPath = tempfile.mkstemp(dir=folder, prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+        try:
+            with open(handle, 'w') as cacheFile:
+                json.dump(entries, cacheFile)
+            os.replace(tempPath, self.path)
+        except BaseException:
+            os.unlink(tempPath)
+            raise
+
+    def __repr__(self):
+        return '<TokenCache at %s>' % self.path
+
+
+_tokenCaches = {}
+_tokenCachesLock = threading.Lock()
+
+
+def tokenCacheFor(path=DEFAULT_TOKEN_CACHE_PATH):
+    """The TokenCache shared by every interface using the file at path (so they share its lock too)"""
+    path = os.path.abspath(path)
+    with _tokenCachesLock:
+        if path not in _tokenCaches:
+            _tokenCaches[path] = TokenCache(path)
+        return _tokenCaches[path]
+
+
+def getTokenCache(tokenCache):
+    """Turn the tokenCache argument into a TokenCache (or None).
+    True uses the default file, a string is taken as the file's path.
+    """
+    if not tokenCache:
+        return None
+    if tokenCache is True:
+        return tokenCacheFor()
+    if isinstance(tokenCache, str):
+        return tokenCacheFor(tokenCache)
+    return tokenCache
@@ -1,4 +1,8 @@
 from .rest import RestInterface
+from .tokencache import getTokenCache, tokenCacheKey
+from .keepalive import KeepAliveScheduler
+import threading
+import time
 
 try:
     import keyring
@@ -26,11 +30,29 @@ except ImportError:
 
 class UserTokenManagement(RestInterface):
 
-    __slots__ = ('_userToken', '_username', '__clear_on_exit')
+    __slots__ = ('_userToken', '_userTokenLock', '_userTokenTime', '_tokenCache', 
+                 'autoKeepAlive', 'userTokenLifetime', '_keepAliveScheduler',
+                 '_username', '__clear_on_exit')
     
-    def __init__(self, username='', password='', **configuration):
-        
+    def __init__(self, username='', password='', tokenCache=None, 
+                 autoKeepAlive=False, userTokenLifetime=None, 
+                 **configuration):
+        """With a tokenCache (True for the default file, or a file path), tokens are
+        saved to disk and left open on exit, so the next process can reuse them.
+        See tokencache.py for details.
+
+        With autoKeepAlive, a background thread keeps the tokens fresh while in
+        the context manager, getting a new user token once it's half of 
+        userTokenLifetime (seconds) old. See keepalive.py for details.
+        """
         self._userToken = None
+        self._userTokenLock = threading.RLock()
+        self._userTokenTime = 0
+        self._tokenCache = getTokenCache(tokenCache)
+
+        self.autoKeepAlive = autoKeepAlive
+        self.userTokenLifetime = userTokenLifetime
+        self._keepAliveScheduler = None
         self._username = username
         keyring.set_password('birdsong', self.__self_id, password)
         self.__clear_on_exit = False
@@ -53,34 +75,87 @@ class UserTokenManagement(RestInterface):
     @property
     def userToken(self):
         if not self._userToken:
-            self._getUserToken()
+            # Only one thread logs in - the others wait for its token
+            with self._userTokenLock:
+                if not self._userToken:
+                    self._getUserToken()
         return self._userToken
      
 
+    @property
+    def _userTokenCacheKey(self):
+        return tokenCacheKey('userToken', self._poolKey, self._username)
+
+
     # User token API calls
     
     def _getUserToken(self):
+        if self._tokenCache:
+            cachedToken = self._tokenCache.get(self._userTokenCacheKey)
+            if cachedToken:
+                self._userToken = cachedToken
+                self._userTokenTime = time.monotonic()
+                return
         jsonData = {
             "username":self._username,
             "password":self.__password,
             "application":"getData"
         }
         self._userToken = self._singlePost('getUserToken', jsonData, 'userToken')
+        self._userTokenTime = time.monotonic()
+        if self._tokenCache:
+            self._tokenCache.put(self._userTokenCacheKey, self._userToken)
 
 
     def _revokeUserToken(self):
         if self._userToken:
-            self._post('revokeUserToken', {"userToken":self._userToken})
+            # Cached tokens are left open for the next process
+            if not self._tokenCache:
+                self._post('revokeUserToken', {"userToken":self._userToken})
             self._userToken = None  
     
 
+    # Keep alive
+
+    @property
+    def _keepAliveInterval(self):
+        """Seconds between keep alive checks (None if there's nothing to keep alive)"""
+        if self.userTokenLifetime:
+            return self.userTokenLifetime / 4.0
+        return None
+
+    def _startKeepAlive(self):
+        interval = self._keepAliveInterval
+        if self.autoKeepAlive and interval and not self._keepAliveScheduler:
+            self._keepAliveScheduler = KeepAliveScheduler(self, interval)
+            self._keepAliveScheduler.start()
+
+    def _stopKeepAlive(self):
+        if self._keepAliveScheduler:
+            self._keepAliveScheduler.stop()
+            self._keepAliveScheduler = None
+
+    def _keepTokensAlive(self):
+        """Get a new user token if the current one is getting old. 
+        The old one is left to expire, since other calls may still be using it.
+        """
+        if (    self.userTokenLifetime and self._userToken 
+            and time.monotonic() - self._userTokenTime > self.userTokenLifetime / 2.0):
+            with self._userTokenLock:
+                if self._tokenCache:
+                    self._tokenCache.discard(self._userTokenCacheKey, self._userToken)
+                self._getUserToken()
+
+
     # Context management
     
     def __enter__(self):
         self._getUserToken()
+        self._startKeepAlive()
         return self
     
     def __exit__(self, *args):
+        self._stopKeepAlive()
         self._revokeUserToken()
         if self._username:
             self._username = ''
@@ -92,21 +167,29 @@ class UserTokenManagement(RestInterface):
 
     def _post(self, apiUrl, jsonData):
         """Error Handling context for user tokens"""
-        super()._post(apiUrl, jsonData)
-
-        # Check if it failed. If so, reload.
-        if self.lastResults['statusCode'] == 'BadUserToken':
+        retry = 0
+        while True:
+            results = super()._post(apiUrl, jsonData)
+
+            # Check if it failed. If so, reload and try again (if the retry policy allows)
+            if results['statusCode'] != 'BadUserToken':
+                return results
+            retry += 1
+            if not self._backoff('BadUserToken', retry):
+                return results
             assert 'userToken' in jsonData, "API '%s' called with bad user token without including one." % apiUrl
-            self._userToken = None
-            self._getUserToken()
+            with self._userTokenLock:
+                # Another thread may have already replaced the token
+                if self._userToken == jsonData['userToken']:
+                    self._userToken = None
+                if self._tokenCache:
+                    self._tokenCache.discard(self._userTokenCacheKey, jsonData['userToken'])
             jsonData['userToken'] = self.userToken
-            # Try again
-            self._post(apiUrl, jsonData)
 
 
 class LiveDataTokenManagement(UserTokenManagement, RestInterface):
     
-    __slots__ = ('_liveDataTokens', '_liveDataConfigurations')
+    __slots__ = ('_liveDataTokens', '_liveDataConfigurations', '_rotatedLiveDataTokens', '_liveDataLock')
 
     def __init__(self, 
             liveTags=None,
@@ -117,6 +200,8 @@ class LiveDataTokenManagement(UserTokenManagement, RestInterface):
         
         self._liveDataTokens = {}
         self._liveDataConfigurations = {}
+        self._rotatedLiveDataTokens = {} # old token -> its replacement
+        self._liveDataLock = threading.RLock()
 
         if liveTags:
             self._getLiveDataToken(liveTags, mode=liveMode, includeQuality=liveIncludeQuality)
@@ -131,38 +216,46 @@ class LiveDataTokenManagement(UserTokenManagement, RestInterface):
 
     # Live data methods
     
-    def _getLiveDataToken(self, tags, **configuration):
-        if isinstance(tags, frozenset) and tags in self._liveDataTokens:
+    def _getLiveDataToken(self, tags, key=None, **configuration):
+        """Get a live data token for the tags, kept under key (the tag set, unless given).
+          (The live data engine keys its tokens by configuration too, since the same tags
+           can be followed in more than one mode at once.)
+        """
+        tags = self._coerceToList(list(tags) if isinstance(tags, frozenset) else tags)
+        if key is None:
+            key = frozenset(tags)
+        if key in self._liveDataTokens:
             return
         jsonData = {
             "userToken":self._userToken,
-            "tags": self._coerceToList(tags)
+            "tags": tags
         }
         # Set default mode if not specified
         if 'mode' not in configuration:
             configuration['mode'] = 'AllValues'
         jsonData.update(configuration)
-        tagSet = frozenset(jsonData['tags'])
-        if not tagSet in self._liveDataTokens:
-            self._liveDataTokens[tagSet] = self._singlePost('getLiveDataToken', jsonData, 'liveDataToken')
-            self._liveDataConfigurations[tagSet] = configuration.copy()
+        with self._liveDataLock:
+            if not key in self._liveDataTokens:
+                self._liveDataTokens[key] = self._singlePost('getLiveDataToken', jsonData, 'liveDataToken')
+                self._liveDataConfigurations[key] = (tags, configuration.copy())
 
 
-    def _revokeLiveDataToken(self, tags=None):
+    def _revokeLiveDataToken(self, tags=None, key=None):
         if self._liveDataTokens:
             # If not specific, purge all tokens
-            if not tags:
-                for tagSet in frozenset(self._liveDataTokens):
-                    self._revokeLiveDataToken(tagSet)
+            if not tags and key is None:
+                for key in list(self._liveDataTokens):
+                    self._revokeLiveDataToken(key=key)
             else:
-                tagSet = frozenset(tags)
+                if key is None:
+                    key = frozenset(tags)
                 jsonData = {
                     "userToken":self._userToken,
-                    "liveDataToken":self._liveDataTokens[tagSet],
+                    "liveDataToken":self._liveDataTokens[key],
                 }
                 self._post('revokeLiveDataToken', jsonData)
-                del self._liveDataTokens[tagSet]
-                del self._liveDataConfigurations[tagSet]
+                del self._liveDataTokens[key]
+                del self._liveDataConfigurations[key]
 
     
 
@@ -173,32 +266,40 @@ class LiveDataTokenManagement(UserTokenManagement, RestInterface):
 
     def _rotateLiveDataToken(self, liveDataToken):
         """Rotate the live data token, maintaining the current configuration."""
-        for tagSet,activeLiveDataToken in self._liveDataTokens.items():
-            if liveDataToken == activeLiveDataToken:
-                tagSetKey = tagSet 
-                break
-        else:
-            raise KeyError("The liveDataToken could not be rotated because it was not cached.")
+        with self._liveDataLock:
+            for key,activeLiveDataToken in self._liveDataTokens.items():
+                if liveDataToken == activeLiveDataToken:
+                    break
+            else:
+                # Another thread may have already rotated it
+                if liveDataToken in self._rotatedLiveDataTokens:
+                    return self._rotatedLiveDataTokens[liveDataToken]
+                raise KeyError("The liveDataToken could not be rotated because it was not cached.")
 
-        configuration = self._liveDataConfigurations[tagSet]
+            tags, configuration = self._liveDataConfigurations[key]
 
-        del self._liveDataTokens[tagSetKey]
-        self._getLiveDataToken(tagSetKey, **configuration)
+            del self._liveDataTokens[key]
+            self._getLiveDataToken(tags, key=key, **configuration)
 
-        return self._liveDataTokens[tagSetKey]
+            self._rotatedLiveDataTokens[liveDataToken] = self._liveDataTokens[key]
+            return self._liveDataTokens[key]
 
 
     def _post(self, apiUrl, jsonData):
         """Error Handling context for live data tokens"""
-        super()._post(apiUrl, jsonData)
-
-        # Check if it failed. If so, reload.
-        if self.lastResults['statusCode'] == 'BadLiveDataToken':
+        retry = 0
+        while True:
+            results = super()._post(apiUrl, jsonData)
+
+            # Check if it failed. If so, reload and try again (if the retry policy allows)
+            if results['statusCode'] != 'BadLiveDataToken':
+                return results
+            retry += 1
+            if not self._backoff('BadLiveDataToken', retry):
+                return results
             assert 'liveDataToken' in jsonData, "API '%s' called with bad user token without including one." % apiUrl
 
             jsonData['liveDataToken'] = self._rotateLiveDataToken(jsonData['liveDataToken'])
-            # Try again
-            self._post(apiUrl, jsonData)
 
 
 class SessionTokenManagement(UserTokenManagement, RestInterface):
@@ -220,6 +321,7 @@ class SessionTokenManagement(UserTokenManagement, RestInterface):
                  **configuration):
 
         self._sessionToken = None
+        self._sessionTokenLock = threading.RLock()
 
         if not historians:
             self.historians = ['localhost']
@@ -249,6 +351,10 @@ class SessionTokenManagement(UserTokenManagement, RestInterface):
             'suppressTimestampErrors': suppressTimestampErrors,            
         }
         
+        # If the session zips its packets, zip what we send it too (unless told otherwise)
+        if packetZip:
+            configuration.setdefault('compression', 'gzip')
+
         super().__init__(**configuration)
 
  
@@ -261,20 +367,50 @@ class SessionTokenManagement(UserTokenManagement, RestInterface):
 
 
     def __exit__(self, *args):
+        self._stopKeepAlive()
         self._revokeSessionToken()
         super().__exit__(*args)
 
 
+    # Keep alive
+
+    @property
+    def _keepAliveInterval(self):
+        # Check six times per clientTimeout (which is in milliseconds), so a
+        #   keepAlive after a third of it idle always lands before half of it
+        interval = self._settings['clientTimeout'] / 6000.0
+        userTokenInterval = super()._keepAliveInterval
+        return min(interval, userTokenInterval) if userTokenInterval else interval
+
+    def _keepTokensAlive(self):
+        super()._keepTokensAlive()
+        # Only bother Canary if nothing else has in a while
+        if self._sessionToken and time.monotonic() - self._lastCallTime >= self._settings['clientTimeout'] / 3000.0:
+            self.keepAlive()
+
+
     # Session token API calls
 
+    @property
+    def _sessionTokenCacheKey(self):
+        return tokenCacheKey('sessionToken', self._poolKey, self._username, self.historians, self.clientID, self._settings)
+
     @property
     def sessionToken(self):
         if not self._sessionToken:
-            self._getSessionToken()
+            # Only one thread opens a session - the others wait for its token
+            with self._sessionTokenLock:
+                if not self._sessionToken:
+                    self._getSessionToken()
         return self._sessionToken
     
     
     def _getSessionToken(self):
+        if self._tokenCache:
+            cachedToken = self._tokenCache.get(self._sessionTokenCacheKey)
+            if cachedToken:
+                self._sessionToken = cachedToken
+                return
         jsonData = {
             "userToken":self.userToken,
             "historians":self.historians,
@@ -282,16 +418,20 @@ class SessionTokenManagement(UserTokenManagement, RestInterface):
             "settings": self._settings,
         }
         self._sessionToken = self._singlePost('getSessionToken', jsonData, 'sessionToken')
+        if self._tokenCache:
+            self._tokenCache.put(self._sessionTokenCacheKey, self._sessionToken)
 
 
     def _revokeSessionToken(self):
         if self._sessionToken:
             assert self._userToken, "Session token without user token!"
-            jsonData = {
-                "userToken":self._userToken,
-                "sessionToken":self._sessionToken
-            }
-            self._post('revokeSessionToken', jsonData)
+            # Cached tokens are left open for the next process
+            if not self._tokenCache:
+                jsonData = {
+                    "userToken":self._userToken,
+                    "sessionToken":self._sessionToken
+                }
+                self._post('revokeSessionToken', jsonData)
             self._sessionToken = None
 
 
@@ -326,26 +466,33 @@ class SessionTokenManagement(UserTokenManagement, RestInterface):
             "sessionToken": self.sessionToken,
             "settings": settings
         }
-        self._post("updateSettings", jsonData)
-        if self.lastResults['statusCode'] == "Good":
-            self._settings = settings
+        results = self._post("updateSettings", jsonData)
+        if results['statusCode'] == "Good":
+            self._settings.update(settings)
 
 
     # Error Handling
 
     def _post(self, apiUrl, jsonData):
-
-        super()._post(apiUrl, jsonData)
-
-        # Check if it failed. If so, reload.
-        if (   self.lastResults['statusCode'] == 'BadSessionToken' 
-            or (    self.lastResults['statusCode'] == 'Error' 
-                and 'Session token is invalid or has expired' in self.lastResults['errors'])):
+        retry = 0
+        while True:
+            results = super()._post(apiUrl, jsonData)
+
+            # Check if it failed. If so, reload and try again (if the retry policy allows)
+            if not (   results['statusCode'] == 'BadSessionToken' 
+                    or (    results['statusCode'] == 'Error' 
+                        and 'Session token is invalid or has expired' in results['errors'])):
+                return results
+            retry += 1
+            if not self._backoff('BadSessionToken', retry):
+                return results
             assert 'sessionToken' in jsonData, "API '%s' called with bad session token without including one." % apiUrl
-            self._sessionToken = None
-            self._getSessionToken()
+            with self._sessionTokenLock:
+                # Another thread may have already replaced the token
+                if self._sessionToken == jsonData['sessionToken']:
+                    self._sessionToken = None
+                if self._tokenCache:
+                    self._tokenCache.discard(self._sessionTokenCacheKey, jsonData['sessionToken'])
             jsonData['sessionToken'] = self.sessionToken
-            # Try again
-            self._post(apiUrl, jsonData)
 
 
@@ -0,0 +1,87 @@
+"""
+	HTTP transport setup: connection pools, TCP keep-alive and shared sessions.
+
+	Each RestInterface gets a requests.Session with a pool sized for concurrent
+	calls. With sharePool=True, interfaces that talk to the same host and port
+	share one session (and so one pool). That lets several views (or several
+	senders) reuse each other's open connections and TLS sessions rather than
+	opening and negotiating their own. A view and a sender are on different
+	ports (by default), so they don't share a pool.
+
+"""
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 16
+
+DEFAULT_CONNECT_TIMEOUT = 10.0  # seconds
+DEFAULT_READ_TIMEOUT = 300.0    # seconds - big getTagData calls can take a while
+
+# Seconds idle before the first probe, seconds between probes, and probes before giving up
+TCP_KEEPALIVE_IDLE = 60
+TCP_KEEPALIVE_INTERVAL = 15
+TCP_KEEPALIVE_COUNT = 4
+
+
+def keepAliveSocketOptions():
+    """Socket options turning on TCP keep-alive, so idle pooled connections
+    aren't quietly dropped by firewalls and NAT in between."""
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # Not every platform lets us tune the timing
+    for name, value in (('TCP_KEEPIDLE', TCP_KEEPALIVE_IDLE),
+                        ('TCP_KEEPINTVL', TCP_KEEPALIVE_INTERVAL),
+                        ('TCP_KEEPCNT', TCP_KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+class PoolAdapter(HTTPAdapter):
+    """HTTPAdapter that can turn on TCP keep-alive for its pooled connections"""
+
+    def __init__(self, tcpKeepAlive=True, **kwargs):
+        self.tcpKeepAlive = tcpKeepAlive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcpKeepAlive:
+            kwargs['socket_options'] = keepAliveSocketOptions()
+        super().init_poolmanager(*args, **kwargs)
+
+
+def newSession(poolConnections=DEFAULT_POOL_CONNECTIONS, poolMaxSize=DEFAULT_POOL_MAXSIZE, tcpKeepAlive=True):
+    """A requests.Session with its pools sized and tuned as given"""
+    session = requests.Session()
+    adapter = PoolAdapter(tcpKeepAlive=tcpKeepAlive, pool_connections=poolConnections, pool_maxsize=poolMaxSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_sharedSessions = {}
+_sharedSessionsLock = threading.Lock()
+
+
+def sharedSession(key, poolConnections=DEFAULT_POOL_CONNECTIONS, poolMaxSize=DEFAULT_POOL_MAXSIZE, tcpKeepAlive=True):
+    """The session shared by every interface using the same key (like the scheme, host and port).
+    The first one to ask sets up the pool. Later ones get it as is.
+    """
+    with _sharedSessionsLock:
+        if key not in _sharedSessions:
+            _sharedSessions[key] = newSession(poolConnections, poolMaxSize, tcpKeepAlive)
+        return _sharedSessions[key]
+
+
+def closeSharedSessions():
+    """Close every shared session (new ones will be made as needed)"""
+    with _sharedSessionsLock:
+        for session in _sharedSessions.values():
+            session.close()
+        _sharedSessions.clear()
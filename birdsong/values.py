@@ -1,22 +1,33 @@
 import ciso8601, arrow
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
+from operator import attrgetter
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 UNIX_EPOCH = arrow.get('1970-01-01T00:00:00Z')
 
 
 class BaseValue(object):
+    """Lightweight, tuple-like record of a value from Canary.
+    Each field is kept in its own slot (named for the field with a leading underscore),
+      so instances carry no __dict__.
+    """
 
-    __slots__ = ('_tuple')
-
-    _fields = ('value')
-    _optional = (True)
-
-    _timeFormat = None
+    __slots__ = ()
 
+    _fields = ()
+    _optional = ()
+    _timestampFields = ()   # Indexes of the fields holding timestamps
 
-    def __init__(self, value=None):
-        self._tuple = (value,)
+    # The constructors (and fromRaw) take lazy=True to leave ISO8601 timestamp strings
+    #   unparsed until they're first looked at. Saves the parsing for when only the
+    #   values get used. And timeFormat, for timestamp strings that aren't ISO8601.
     
     @classmethod
     def keys(cls):
@@ -25,28 +36,33 @@ class BaseValue(object):
     def values(self, iso8601=False):
         return self._astuple(iso8601)
 
+    @property
+    def _tuple(self):
+        return self._getTuple(self)
+
     def _astuple(self, iso8601=False):
         if iso8601:
             return tuple(value.isoformat() 
                             if isinstance(value, (datetime,arrow.Arrow)) 
                             else value
                          for value,optional 
-                         in zip(self._tuple, self._optional) 
+                         in zip(self._resolveTimestamps(), self._optional) 
                          if not optional or not (value is None))
         else:
             return tuple(value 
                          for value,optional 
-                         in zip(self._tuple, self._optional) 
+                         in zip(self._resolveTimestamps(), self._optional) 
                          if not optional or not (value is None))
 
     def _asdict(self,iso8601=False):
         return dict(zip(self._fields, self._astuple(iso8601)))
 
     def __getitem__(self, key):
+        values = self._resolveTimestamps()
         try:
-            return self._tuple[key]
+            return values[key]
         except(TypeError, IndexError):
-            return self._tuple[self._ixLookup[key]]
+            return values[self._ixLookup[key]]
 
     def __iter__(self):
         return iter(self._astuple())
@@ -58,9 +74,30 @@ class BaseValue(object):
     # Don't try to need this: just use ISO8601 for your date format like Canary does:
     #  YYYY-MM-DD HH:mm:ss.SSSSSSZ
     def setTimeFormat(self, formatString):
-        self._timeFormat = formatString
-
-    def _coerceTimestamp(self, timestamp):
+        """Parse any timestamps still left as strings (see lazy) with the format.
+        (Pass timeFormat to the constructor to parse them that way right off)
+        """
+        for slot in self._timestampSlots:
+            timestamp = getattr(self, slot)
+            if isinstance(timestamp, str):
+                setattr(self, slot, self._coerceTimestamp(timestamp, formatString))
+        return self
+
+    def _deferTimestamp(self, timestamp, lazy=False, timeFormat=None):
+        """Coerce the timestamp now, unless it's an ISO8601 string and lazy is on."""
+        if lazy and not timeFormat and isinstance(timestamp, str):
+            return timestamp
+        return self._coerceTimestamp(timestamp, timeFormat)
+
+    def _resolveTimestamps(self):
+        """Parse any timestamps still left as strings (and keep the results)."""
+        for slot in self._timestampSlots:
+            timestamp = getattr(self, slot)
+            if isinstance(timestamp, str):
+                setattr(self, slot, self._coerceTimestamp(timestamp))
+        return self._getTuple(self)
+
+    def _coerceTimestamp(self, timestamp, timeFormat=None):
         if isinstance(timestamp, str):
             # A timestamp on Christ's Epoch should be understood as an error.
             # It's not a real time, so return None. It's essentially a soft error.
@@ -68,8 +105,8 @@ class BaseValue(object):
             if timestamp.startswith('0001-01-01'):
                 return None
 
-            if self._timeFormat:
-                return arrow.get(timestamp, self._arrowTimeFormat)
+            if timeFormat:
+                return arrow.get(timestamp, timeFormat)
 
             try: # the iso8601 format first
                 dt = ciso8601.parse_datetime(timestamp)
@@ -92,51 +129,128 @@ class BaseValue(object):
                 raise ValueError('%r attempted to parse "%s" without a time format' % (self, timestamp))
 
 
+def _parseTimestamp(timestamp):
+    """Fast path for the ISO8601 timestamp strings Canary itself sends."""
+    if timestamp.startswith('0001-01-01'):
+        return None
+    return arrow.Arrow.fromdatetime(ciso8601.parse_datetime(timestamp))
+
+
+def _timestampGetter(slot):
+    """Getter for a timestamp field, parsing it first if it was left lazy."""
+    readSlot = attrgetter(slot)
+    def getter(self):
+        timestamp = readSlot(self)
+        if isinstance(timestamp, str):
+            timestamp = self._coerceTimestamp(timestamp)
+            setattr(self, slot, timestamp)
+        return timestamp
+    return getter
+
+
 def _finalize(BVClass, aliases=None):
+    slots = tuple('_%s' % field for field in BVClass._fields)
+    assert BVClass.__slots__ == slots, "%s needs the slots %r" % (BVClass.__name__, slots)
+
     setattr(BVClass, '_ixLookup', dict((field,ix) 
                                        for ix,field 
                                        in enumerate(BVClass._fields) ) )
-    for ix,key in enumerate(BVClass._fields):
-        setattr(BVClass, key, property(lambda self, ix=ix: self._tuple[ix]))
-        setattr(BVClass, 'get%s' % key.capitalize(), lambda self, ix=ix: self._tuple[ix])
+    setattr(BVClass, '_getTuple', attrgetter(*slots))
+    setattr(BVClass, '_timestampSlots', tuple(slots[ix] for ix in BVClass._timestampFields))
+
+    getters = []
+    for ix,(key,slot) in enumerate(zip(BVClass._fields, slots)):
+        # Timestamps may still need parsing (see lazy)
+        if ix in BVClass._timestampFields:
+            getter = _timestampGetter(slot)
+        else:
+            getter = attrgetter(slot)
+        getters.append(getter)
+        setattr(BVClass, key, property(getter))
+        setattr(BVClass, 'get%s' % key.capitalize(), lambda self, getter=getter: getter(self))
     if aliases:
-        for ix,key in enumerate(aliases):
-            setattr(BVClass, key, property(lambda self, ix=ix: self._tuple[ix]))
+        for key,getter in zip(aliases, getters):
+            setattr(BVClass, key, property(getter))
+
+
+_new = object.__new__
 
 
 class Tvq(BaseValue):
+    __slots__ = ('_timestamp', '_value', '_quality')
     _fields = ('timestamp', 'value', 'quality')
     _optional = (False, False, True)
+    _timestampFields = (0,)
 
-    def __init__(self, timestamp, value, quality=None):
-        timestamp = self._coerceTimestamp(timestamp)
+    def __init__(self, timestamp, value, quality=None, lazy=False, timeFormat=None):
+        self._timestamp = self._deferTimestamp(timestamp, lazy, timeFormat)
+        self._value = value
+        self._quality = quality
 
-        self._tuple = (timestamp, value, quality)
+    @classmethod
+    def fromRaw(cls, timestamp, value, quality=None, lazy=False):
+        """Fast constructor for data straight from Canary, skipping the checks __init__ does.
+        The timestamp must be an ISO8601 string. (lazy=True leaves it unparsed until it's used)
+        """
+        tvq = _new(cls)
+        tvq._timestamp = timestamp if lazy else _parseTimestamp(timestamp)
+        tvq._value = value
+        tvq._quality = quality
+        return tvq
     
 _finalize(Tvq, 't v q'.split())
 
 
 class Property(BaseValue):
+    __slots__ = ('_name', '_timestamp', '_value', '_quality')
     _fields = ('name', 'timestamp', 'value', 'quality')
     _optional = (False, False, False, True)
+    _timestampFields = (1,)
 
-    def __init__(self, name, timestamp, value, quality=None):
-        timestamp = self._coerceTimestamp(timestamp)
+    def __init__(self, name, timestamp, value, quality=None, lazy=False, timeFormat=None):
+        self._name = name
+        self._timestamp = self._deferTimestamp(timestamp, lazy, timeFormat)
+        self._value = value
+        self._quality = quality
 
-        self._tuple = (name, timestamp, value, quality)
+    @classmethod
+    def fromRaw(cls, name, timestamp, value, quality=None, lazy=False):
+        """Fast constructor for data straight from Canary (see Tvq.fromRaw)"""
+        prop = _new(cls)
+        prop._name = name
+        prop._timestamp = timestamp if lazy else _parseTimestamp(timestamp)
+        prop._value = value
+        prop._quality = quality
+        return prop
 
 _finalize(Property, 'n t v q'.split())
 
 
 class Annotation(BaseValue):
+    __slots__ = ('_user', '_timestamp', '_value', '_createdAt')
     _fields = ('user', 'timestamp', 'value', 'createdAt')
     _optional = (False, False, False, True)
+    _timestampFields = (1, 3)
+
+    def __init__(self, user, timestamp, value, createdAt=None, lazy=False, timeFormat=None):
+        self._user = user
+        self._timestamp = self._deferTimestamp(timestamp, lazy, timeFormat)
+        self._value = value
+        self._createdAt = self._deferTimestamp(createdAt, lazy, timeFormat) if createdAt else createdAt
 
-    def __init__(self, user, timestamp, value, createdAt=None):
-        timestamp = self._coerceTimestamp(timestamp)
-        if createdAt:
-            createdAt = self._coerceTimestamp(createdAt)
-        self._tuple = (user, timestamp, value, createdAt)
+    @classmethod
+    def fromRaw(cls, user, timestamp, value, createdAt=None, lazy=False):
+        """Fast constructor for data straight from Canary (see Tvq.fromRaw)"""
+        annotation = _new(cls)
+        annotation._user = user
+        if lazy:
+            annotation._timestamp = timestamp
+            annotation._createdAt = createdAt
+        else:
+            annotation._timestamp = _parseTimestamp(timestamp)
+            annotation._createdAt = _parseTimestamp(createdAt) if createdAt else createdAt
+        annotation._value = value
+        return annotation
 
 _finalize(Annotation, 'u t v c'.split())
     
@@ -145,3 +259,366 @@ VALUE_TYPE_MAP = {'tvq': Tvq, 'property': Property, 'annotation': Annotation}
    
 def createValue(valueType='tvq', *values):
     return VALUE_TYPE_MAP[valueType.lower()](*values)
+
+
+# Columnar decoding
+# For bulk reads, skip the value objects entirely and pour the raw {'t','v','q'}
+#   dicts from Canary straight into columns. 
+
+NO_TIMESTAMP = -2**63   # Same as numpy's NaT, so the timestamps can be viewed as datetime64[ns]
+NO_QUALITY = -1         # Quality wasn't included
+
+_UNIX_EPOCH_DATETIME = UNIX_EPOCH.datetime
+
+def epochNanoseconds(timestamp):
+    """Convert an ISO8601 timestamp string into integer nanoseconds since the Unix epoch.
+    Timestamps without an offset are taken as UTC.
+    """
+    # Christ's Epoch is Canary's way of saying "not a real time"
+    if timestamp.startswith('0001-01-01'):
+        return NO_TIMESTAMP
+    dt = ciso8601.parse_datetime(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _UNIX_EPOCH_DATETIME
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+
+def newColumns():
+    """Empty timestamp, value and quality columns to fill with appendColumns."""
+    return ([], [], [])
+
+def appendColumns(columns, items):
+    """Decode a page of v2 value objects (dicts with t, v and maybe q) onto the end of the columns.
+    Anything that isn't a value object is skipped.
+    """
+    timestamps, values, qualities = columns
+    for item in items:
+        if isinstance(item, dict) and 't' in item and 'v' in item:
+            timestamps.append(epochNanoseconds(item['t']))
+            values.append(item['v'])
+            quality = item.get('q', None)
+            qualities.append(NO_QUALITY if quality is None else quality)
+    return columns
+
+def columnArrays(columns):
+    """Turn the gathered columns into numpy arrays, keyed by Tvq's field names:
+        timestamp: (int64) nanoseconds since the Unix epoch, NO_TIMESTAMP if none
+        value: (float64) if every value is a number (None becomes NaN),
+               (bool) if every value is a bool, otherwise (object)
+        quality: (int32) quality codes, NO_QUALITY if not included
+    """
+    if numpy is None:
+        raise ImportError("Columnar results need numpy (pip install birdsong[numpy])")
+    timestamps, values, qualities = columns
+    return {
+        'timestamp': numpy.array(timestamps, dtype=numpy.int64),
+        'value': _objectValueArray(values),
+        'quality': numpy.array(qualities, dtype=numpy.int32),
+    }
+
+
+def _objectValueArray(values):
+    """The value column for a list of values: float64 for numbers, bool for bools, otherwise object.
+    (bool is a kind of int, so it has to be checked for first, or flags would come out as 0.0 and 1.0)
+    """
+    if values and all(value.__class__ is bool for value in values):
+        return numpy.array(values, dtype=numpy.bool_)
+    if all(value is None or (isinstance(value, (int, float)) and value.__class__ is not bool) for value in values):
+        return numpy.array(values, dtype=numpy.float64)
+    return numpy.fromiter(values, dtype=object, count=len(values))
+
+def _asEpochNanoseconds(timestamp):
+    """Nanoseconds since the Unix epoch for the usual ways a timestamp gets handed over."""
+    if isinstance(timestamp, int):
+        return timestamp
+    if timestamp is None:
+        return NO_TIMESTAMP
+    if isinstance(timestamp, str):
+        return epochNanoseconds(timestamp)
+    if isinstance(timestamp, arrow.Arrow):
+        timestamp = timestamp.datetime
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        delta = timestamp - _UNIX_EPOCH_DATETIME
+        return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+    raise ValueError('Can not use "%r" as a timestamp' % (timestamp,))
+
+def _asEpochNanosecondsAndOffset(timestamp):
+    """_asEpochNanoseconds, along with the UTC offset (in seconds) the timestamp was given in."""
+    if isinstance(timestamp, str):
+        # Christ's Epoch is Canary's way of saying "not a real time"
+        if timestamp.startswith('0001-01-01'):
+            return NO_TIMESTAMP, 0
+        timestamp = ciso8601.parse_datetime(timestamp)
+    elif isinstance(timestamp, arrow.Arrow):
+        timestamp = timestamp.datetime
+    if isinstance(timestamp, datetime):
+        offset = timestamp.utcoffset()
+        if offset is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+            offset = 0
+        else:
+            offset = offset.days * 86400 + offset.seconds
+        delta = timestamp - _UNIX_EPOCH_DATETIME
+        return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000, offset
+    return _asEpochNanoseconds(timestamp), 0
+
+def _epochDatetime(nanoseconds):
+    return _UNIX_EPOCH_DATETIME + timedelta(microseconds=nanoseconds // 1000)
+
+_offsetTimezones = {}
+
+def _offsetTimezone(offset):
+    """The fixed timezone for a UTC offset in seconds (made once per offset)"""
+    tz = _offsetTimezones.get(offset)
+    if tz is None:
+        tz = _offsetTimezones[offset] = timezone(timedelta(seconds=offset))
+    return tz
+
+
+# What a TvqSeries' doubles hold, per sample (once anything but a plain float shows up)
+_FLOAT = 0
+_MISSING = 1    # None ("No Data"), held as NaN - but kept apart from a real NaN
+_INT = 2        # A whole number, handed back as an int
+
+# Past this, a double can't hold every int exactly
+_MAX_EXACT_INT = 2**53
+
+
+class TvqSeries(object):
+    """A tag's samples, held column by column in contiguous buffers instead of as a list of Tvqs.
+    That's about 20 bytes a sample, so millions of them can be kept around for windowed analysis.
+
+    Timestamps are kept as int64 nanoseconds since the Unix epoch, values as doubles 
+      (switching to a plain list once something other than a number shows up) and
+      qualities as int32 (NO_QUALITY when not given). Once it's needed, a byte per sample
+      also marks which doubles are whole numbers (so ints come back as ints) and which 
+      are None ("No Data", held as NaN but handed back as None - while a real NaN stays NaN).
+      Likewise the timestamps' UTC offsets are kept (as int32 seconds) once one isn't UTC.
+
+    Samples must be added in time order, as Canary returns them, and need a real timestamp.
+      Indexing and iterating give Tvqs (with the UTC offsets they came in), slicing gives
+      another TvqSeries, and between() cuts out a time range by binary search. With numpy
+      installed, arrays() gives zero-copy views.
+    """
+
+    __slots__ = ('_timestamps', '_values', '_qualities', '_kinds', '_offsets')
+
+    def __init__(self, tvqs=()):
+        self._timestamps = array('q')
+        self._values = array('d')
+        self._qualities = array('i')
+        self._kinds = None      # Only needed once a value isn't a float
+        self._offsets = None    # Only needed once a timestamp isn't in UTC
+        for tvq in tvqs:
+            self.append(*tvq)
+
+    def append(self, timestamp, value, quality=None):
+        timestamp, offset = _asEpochNanosecondsAndOffset(timestamp)
+        self._append(timestamp, offset, value, quality)
+
+    def _append(self, timestamp, offset, value, quality):
+        if timestamp == NO_TIMESTAMP:
+            raise ValueError('TvqSeries samples need a timestamp')
+        if self._timestamps and timestamp < self._timestamps[-1]:
+            raise ValueError('TvqSeries samples must be added in time order')
+
+        values = self._values
+        kind = _FLOAT
+        if values.__class__ is list:
+            values.append(value)
+            kind = None
+        elif value is None:
+            values.append(float('nan'))
+            kind = _MISSING
+        elif isinstance(value, float):
+            values.append(value)
+        elif isinstance(value, int) and not isinstance(value, bool) and -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT:
+            values.append(value)
+            kind = _INT
+        else:
+            # Not something a double holds, so fall back to holding anything
+            self._values = self._valueList()
+            self._values.append(value)
+            self._kinds = None
+            kind = None
+
+        if kind is not None and (kind != _FLOAT or self._kinds is not None):
+            if self._kinds is None:
+                self._kinds = bytearray(len(self._timestamps))
+            self._kinds.append(kind)
+        if offset or self._offsets is not None:
+            if self._offsets is None:
+                self._offsets = array('i', [0]) * len(self._timestamps)
+            self._offsets.append(offset)
+        self._timestamps.append(timestamp)
+        self._qualities.append(NO_QUALITY if quality is None else quality)
+
+    def extend(self, tvqs):
+        for tvq in tvqs:
+            self.append(*tvq)
+        return self
+
+    def extendItems(self, items):
+        """Add a page of v2 value objects (dicts with t, v and maybe q) straight from Canary.
+        Anything that isn't a value object is skipped.
+        """
+        append = self._append
+        for item in items:
+            if isinstance(item, dict) and 't' in item and 'v' in item:
+                timestamp, offset = _asEpochNanosecondsAndOffset(item['t'])
+                # Not a real time, so there's no place for it in the series
+                if timestamp != NO_TIMESTAMP:
+                    append(timestamp, offset, item['v'], item.get('q', None))
+        return self
+
+    def _valueList(self):
+        """The values as a plain list, with the ints as ints and the missing ones as None"""
+        if self._kinds is None:
+            return list(self._values)
+        return [value if kind == _FLOAT else int(value) if kind == _INT else None
+                for value, kind in zip(self._values, self._kinds)]
+
+    def _valueAt(self, ix):
+        if self._kinds is not None:
+            kind = self._kinds[ix]
+            if kind == _INT:
+                return int(self._values[ix])
+            if kind == _MISSING:
+                return None
+        return self._values[ix]
+
+    def _datetimeAt(self, ix):
+        timestamp = _epochDatetime(self._timestamps[ix])
+        if self._offsets is not None and self._offsets[ix]:
+            return timestamp.astimezone(_offsetTimezone(self._offsets[ix]))
+        return timestamp
+
+    # Columns
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+    @property
+    def values(self):
+        """The values as doubles (with NaN where missing), or a list once they aren't all numbers
+        Index or iterate the series for each value as it came in (int, None and all).
+        """
+        return self._values
+
+    @property
+    def qualities(self):
+        return self._qualities
+
+    def arrays(self):
+        """The columns as numpy arrays, keyed like columnArrays (so missing values are NaN there too).
+        These share memory with the series (where they can), so drop them before appending more.
+        """
+        if numpy is None:
+            raise ImportError("TvqSeries.arrays() needs numpy (pip install birdsong[numpy])")
+        if self._values.__class__ is list:
+            valueArray = _objectValueArray(self._values)
+        else:
+            valueArray = numpy.frombuffer(self._values, dtype=numpy.float64)
+        return {
+            'timestamp': numpy.frombuffer(self._timestamps, dtype=numpy.int64),
+            'value': valueArray,
+            'quality': numpy.frombuffer(self._qualities, dtype=numpy.int32),
+        }
+
+    @classmethod
+    def concat(cls, seriesList):
+        """One series of all the samples in seriesList, which must follow on from each other in time."""
+        series = _new(cls)
+        series._timestamps = array('q')
+        series._qualities = array('i')
+        series._kinds = None
+        series._offsets = None
+        if any(part._values.__class__ is list for part in seriesList):
+            series._values = []
+            for part in seriesList:
+                series._values.extend(part._valueList())
+        else:
+            series._values = array('d')
+            for part in seriesList:
+                series._values.extend(part._values)
+            if any(part._kinds is not None for part in seriesList):
+                series._kinds = bytearray()
+                for part in seriesList:
+                    series._kinds.extend(part._kinds if part._kinds is not None else bytes(len(part)))
+        if any(part._offsets is not None for part in seriesList):
+            series._offsets = array('i')
+            for part in seriesList:
+                series._offsets.extend(part._offsets if part._offsets is not None else array('i', [0]) * len(part))
+        for part in seriesList:
+            if series._timestamps and part._timestamps and part._timestamps[0] < series._timestamps[-1]:
+                raise ValueError('TvqSeries samples must be added in time order')
+            series._timestamps.extend(part._timestamps)
+            series._qualities.extend(part._qualities)
+        return series
+
+    # Time ranges
+
+    def between(self, start=None, end=None):
+        """Samples from start (inclusive) up to end (exclusive), found by binary search.
+        Either may be left as None for an open end. Takes the same timestamps append does.
+        """
+        lo = 0 if start is None else bisect_left(self._timestamps, _asEpochNanoseconds(start))
+        hi = len(self) if end is None else bisect_left(self._timestamps, _asEpochNanoseconds(end))
+        return self[lo:hi]
+
+    def rows(self, iso8601=False):
+        """Yield each sample as a tuple like Tvq.values() gives (quality left out if missing)."""
+        for ix, quality in enumerate(self._qualities):
+            timestamp = self._datetimeAt(ix)
+            if iso8601:
+                timestamp = timestamp.isoformat()
+            else:
+                timestamp = arrow.Arrow.fromdatetime(timestamp)
+            value = self._valueAt(ix)
+            if quality == NO_QUALITY:
+                yield (timestamp, value)
+            else:
+                yield (timestamp, value, quality)
+
+    # Sequence bits
+
+    def _tvqAt(self, ix):
+        quality = self._qualities[ix]
+
+        tvq = _new(Tvq)
+        tvq._timestamp = arrow.Arrow.fromdatetime(self._datetimeAt(ix))
+        tvq._value = self._valueAt(ix)
+        tvq._quality = None if quality == NO_QUALITY else quality
+        return tvq
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            series = _new(TvqSeries)
+            series._timestamps = self._timestamps[key]
+            series._values = self._values[key]
+            series._qualities = self._qualities[key]
+            series._kinds = None if self._kinds is None else self._kinds[key]
+            series._offsets = None if self._offsets is None else self._offsets[key]
+            return series
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('TvqSeries index out of range')
+        return self._tvqAt(key)
+
+    def __iter__(self):
+        for ix in range(len(self)):
+            yield self._tvqAt(ix)
+
+    def __repr__(self):
+        if not self:
+            return '<TvqSeries (empty)>'
+        return '<TvqSeries of %d samples from %s to %s>' % (
+            len(self), self[0].timestamp, self[-1].timestamp)
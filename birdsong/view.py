@@ -1,20 +1,146 @@
+from .rest import chunks, DEFAULT_MAX_WORKERS
 from .tokens import UserTokenManagement, LiveDataTokenManagement
-from .values import Tvq
+from .values import Tvq, TvqSeries, newColumns, appendColumns, columnArrays, numpy
+from .tagcache import getTagDataCache, fetchArgSets, _isoTimestamp, READ_PAST_END
+from .namespace import getTagNamespace
+from .metacache import getMetadataCache
+from .planner import getQueryPlanner, getTagSharder
+from .live import (LiveDataEngine, tvqsFromLiveValues,
+                   DEFAULT_MIN_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL, DEFAULT_MAX_LIVE_TOKENS)
 
 
 DEFAULT_VIEW_PORT_ANONYMOUS_HTTP = '55235'
 DEFAULT_VIEW_PORT_USERNAME_HTTPS = '55236'
 
+# Tags per request when a method has to split up a big tag list
+DEFAULT_TAG_CHUNK_SIZE = 100
+
+
+# User friendly conversion
+USER_FRIENDLY_CONSTRAINTS = [
+    ('startDate', 'startTime'),
+    ('start', 'startTime'),
+    ('endDate', 'endTime'),
+    ('end', 'endTime'),
+]
+
+
+def _prepConstraints(constraints, anonymous, timeExtension=False):
+    """Fill in the defaults the v2 API expects and translate the user friendly keys.
+    The constraints dict is modified in place (and returned for convenience).
+
+    Args:
+        constraints: (dict) constraints for the data call
+        anonymous: (bool) no username set, so the timezone can't come from the userToken
+        timeExtension: (bool) apply the useTimeExtension defaults for tag data calls
+    """
+    # Add timezone handling if not already set via userToken
+    if 'timezone' not in constraints and anonymous:
+        constraints['timezone'] = 'UTC'  # Default to UTC if not specified
+
+    if timeExtension:
+        # Handle new parameters
+        if 'useTimeExtension' not in constraints:
+            constraints['useTimeExtension'] = True  # Defaults to true in v2
+
+        # If quality is specified and not 'any', force useTimeExtension to false
+        if 'quality' in constraints and constraints['quality'] != 'any':
+            constraints['useTimeExtension'] = False
+
+    for fromKey, toKey in USER_FRIENDLY_CONSTRAINTS:
+        if fromKey in constraints:
+            constraints[toKey] = constraints[fromKey]
+            del constraints[fromKey]
+
+    return constraints
+
+
+def _tvqsFromItems(items, lazy=False):
+    """Unpack the v2 value objects (dicts with t, v and maybe q) into Tvqs.
+    Anything that isn't a value object is skipped.
+    """
+    return [Tvq.fromRaw(item['t'], item['v'], item.get('q', None), lazy)
+            for item in items
+            if isinstance(item, dict) and 't' in item and 'v' in item]
+
+def _extendTvqs(values, items):
+    values.extend(_tvqsFromItems(items))
+    return values
+
+def _extendLazyTvqs(values, items):
+    values.extend(_tvqsFromItems(items, lazy=True))
+    return values
+
+
+# Ways raw values can be handed back:
+#   (start a collection, add a page of raw value objects to it, finish it up)
+VALUE_DECODERS = {
+    'tvq':   (list, _extendTvqs, lambda values: values),
+    'numpy': (newColumns, appendColumns, columnArrays),
+    'series': (TvqSeries, TvqSeries.extendItems, lambda series: series),
+}
+
+def _seriesAs(series, output):
+    """Hand a TvqSeries back the way the output asks for (as a decoder's finish would)"""
+    if output == 'tvq':
+        return list(series)
+    if output == 'numpy':
+        return series.arrays()
+    return series
+
+def _valueDecoder(output, lazyTimestamps=False):
+    if output not in VALUE_DECODERS:
+        raise ValueError('Unknown output "%s" - use one of %r' % (output, sorted(VALUE_DECODERS)))
+    if output == 'numpy' and numpy is None:
+        raise ImportError("output='numpy' needs numpy (pip install birdsong[numpy])")
+    if output == 'tvq' and lazyTimestamps:
+        return (list, _extendLazyTvqs, lambda values: values)
+    return VALUE_DECODERS[output]
+
 
 class CanaryView(LiveDataTokenManagement, UserTokenManagement):
     
     apiVersion = 'api/v2'
+
+    # (Until __init__ gets that far - a view that fails to start is still cleaned up)
+    liveDataEngine = None
+    metadataCache = None
     
     def __init__(self,
                  httpPort =DEFAULT_VIEW_PORT_ANONYMOUS_HTTP,
                  httpsPort=DEFAULT_VIEW_PORT_USERNAME_HTTPS,
+                 tagDataCache=None,
+                 tagNamespace=None,
+                 metadataCache=None,
+                 queryPlanner=None,
+                 tagSharder=None,
+                 liveMinPollInterval=DEFAULT_MIN_POLL_INTERVAL,
+                 liveMaxPollInterval=DEFAULT_MAX_POLL_INTERVAL,
+                 liveMaxTokens=DEFAULT_MAX_LIVE_TOKENS,
+                 lazyTimestamps=False,
                  **configuration):
         super().__init__(httpPort =httpPort, httpsPort=httpsPort, **configuration)
+        # Leave the timestamps of the Tvqs this view hands back unparsed until they're used
+        self.lazyTimestamps = lazyTimestamps
+        self.tagDataCache = getTagDataCache(tagDataCache)
+        self.tagNamespace = getTagNamespace(tagNamespace)
+        self.metadataCache = getMetadataCache(metadataCache)
+        self.queryPlanner = getQueryPlanner(queryPlanner)
+        self.tagSharder = getTagSharder(tagSharder)
+        self.liveDataEngine = LiveDataEngine(self, liveMinPollInterval, liveMaxPollInterval,
+                                             maxTokens=liveMaxTokens)
+
+    def __exit__(self, *args):
+        if self.liveDataEngine is not None:
+            self.liveDataEngine.stop()
+        if self.metadataCache is not None:
+            self.metadataCache.flush()
+        super().__exit__(*args)
+
+    @property
+    def _cacheOwner(self):
+        """Keeps cached results apart for different hosts and users"""
+        return (self._poolKey, self._username)
 
                  
     # Browse Methods
@@ -42,9 +168,18 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
             search: (str) String pattern that tag paths must contain
             deep: (bool) Recursively search into all paths
 
+        If the view has a tagNamespace, the tags are looked up there instead
+          (after refreshing it, if it's due).
+
         Returns:
             Generator of tag paths
         """
+        if self.tagNamespace is not None:
+            self.refreshTagNamespace()
+            return iter(self.tagNamespace.tags(path, search, deep))
+        return self._browseTags(path, search, deep)
+
+    def _browseTags(self, path='', search='', deep=False):
         jsonData = {
             "userToken":self.userToken,
             "path":path,
@@ -52,6 +187,30 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
             "search": search
         }
         return self._iterPost("browseTags", jsonData, "tags")
+
+    def refreshTagNamespace(self, force=False):
+        """Bring the tagNamespace up to date. The views' browseStatus sequences are checked
+          (if checkInterval has passed, or force is set), and those that changed are browsed again.
+
+        Returns:
+            List of the views that were browsed
+        """
+        namespace = self.tagNamespace
+        if namespace is None:
+            raise ValueError('This view has no tagNamespace to refresh - pass tagNamespace=True when making it.')
+        with namespace.lock:
+            if not (force or namespace.due):
+                return []
+            viewNames = list(self.browseNodes())
+            sequences = dict(self.browseStatus(viewNames))
+            staleViews = namespace.stale(sequences)
+            if force:
+                staleViews = viewNames
+            browsed = self._mapConcurrently(lambda viewName: list(self._browseTags(viewName, deep=True)), staleViews)
+            for viewName, tagPaths in zip(staleViews, browsed):
+                namespace.load(viewName, sequences.get(viewName), tagPaths)
+            namespace.keepOnly(viewNames)
+            return staleViews
     
     def browseStatus(self, views):
         """Look up the status sequence of the given view(s)
@@ -82,10 +241,17 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
         Returns:
             Dict of aggregates function names and their explanations.
         """
+        if self.metadataCache is not None:
+            found, missing = self.metadataCache.lookup('getAggregates', self._cacheOwner, [''])
+            if not missing:
+                return found['']
         jsonData = {
             'userToken': self.userToken
         }
-        return self._singlePost('getAggregates', jsonData, 'aggregates')
+        aggregates = self._singlePost('getAggregates', jsonData, 'aggregates')
+        if self.metadataCache is not None:
+            self.metadataCache.store('getAggregates', self._cacheOwner, {'': aggregates})
+        return aggregates
     
     def getQualities(self, qualities):
         """Converts the given integer quality(s) to human readable strings.
@@ -96,11 +262,25 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
         Returns:
             Dict of quality codes and their meaning
         """                
+        qualities = self._coerceToList(qualities)
+        if self.metadataCache is not None:
+            # Only ask for the codes that aren't cached
+            found, missing = self.metadataCache.lookup('getQualities', self._cacheOwner, [str(quality) for quality in qualities])
+            if not missing:
+                return found
+            # (Cached by the codes as strings, like Canary's answer, but asked for as given)
+            missing = set(missing)
+            qualities = [quality for quality in qualities if str(quality) in missing]
         jsonData = {
             'userToken': self.userToken,
-            'qualities': self._coerceToList(qualities)
+            'qualities': qualities
         }    
-        return self._singlePost('getQualities', jsonData, 'qualities')
+        qualityDict = self._singlePost('getQualities', jsonData, 'qualities')
+        if self.metadataCache is not None and isinstance(qualityDict, dict):
+            self.metadataCache.store('getQualities', self._cacheOwner, qualityDict)
+            found.update(qualityDict)
+            return found
+        return qualityDict
     
     def getTagProperties(self, tags):
         """Returns the properties for the given tag(s), if any.
@@ -111,11 +291,22 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
         Returns:
             - Generator yielding properties for a tag or tag paths and their property dicts
         """
-        jsonData = {
-            'userToken': self.userToken,
-            'tags': self._coerceToList(tags)
-        }    
-        tagPropDict = self._singlePost('getTagProperties', jsonData, 'properties')
+        tagPaths = self._coerceToList(tags)
+        if self.metadataCache is not None:
+            # Only ask for the tags that aren't cached
+            tagPropDict, tagPaths = self.metadataCache.lookup('getTagProperties', self._cacheOwner, tagPaths)
+        if tagPaths or self.metadataCache is None:
+            jsonData = {
+                'userToken': self.userToken,
+                'tags': tagPaths
+            }    
+            fetched = self._singlePost('getTagProperties', jsonData, 'properties')
+            if self.metadataCache is None:
+                tagPropDict = fetched
+            else:
+                fetched = {tagPath: fetched.get(tagPath, {}) for tagPath in tagPaths}
+                self.metadataCache.store('getTagProperties', self._cacheOwner, fetched)
+                tagPropDict.update(fetched)
     
         # Return the dict directly if just a single tag was asked for
         if isinstance(tags, str):
@@ -134,13 +325,41 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
         return self._iterPost('getTagData', jsonData, 'data')
 
 
-    def getTagData(self, tags, **constraints):
+    def getTagData(self, tags, stream=False, output='tvq', **constraints):
         """Returns the data for the given tags.
         If just a tag path is given, results are the values only.
         If a list is given, an iterable of tagpaths and their values is returned.
             (For example, you can use this in a for loop like
             for tagpath,values in view.getTagData(taglist) )
 
+        Normally all the pages of results are gathered before returning. With
+          stream=True the results are instead yielded as each page arrives, so only
+          one page is held in memory at a time. A tag path alone then yields its values
+          one by one, and a list yields (tagPath, values) for each tag in each page -
+          so the same tag path may come up more than once.
+
+        For bulk reads, output='numpy' skips making a Tvq for every value and hands
+          back each tag's values as a dict of numpy arrays instead:
+            timestamp: (int64) nanoseconds since the Unix epoch
+            value: (float64) if all the values are numbers, (bool) if all bools, otherwise (object)
+            quality: (int32) quality code, or -1 if not included
+          Or output='series' gives each tag's values as a TvqSeries.
+          (When streaming a single tag path, each page's arrays/series are yielded.)
+
+        If the view has a tagDataCache, windows with absolute start and end times 
+          are read thru it, so only the parts not already cached are asked for.
+          (See birdsong.tagcache.)
+
+        If the view has a queryPlanner, long raw windows are split into sub-windows
+          that are fetched concurrently and stitched back together. (See birdsong.planner.)
+
+        If the view has a tagSharder, long tag lists are cut into shards that are fetched
+          concurrently. Results come back the same way, in the order the tags were given.
+
+        A failed call prints its error and returns empty results - except when streaming,
+          or reading thru a tagDataCache, queryPlanner or tagSharder, where the error is
+          raised (so partial results are never mistaken for the whole window).
+
         Constraints defines the range and type of data returned:
             startTime: (str) Earliest time; tradtional or relative date/times
             endTime: (str) Latest time; traditional or relative date/times
@@ -154,79 +373,13 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
 
         Args:
             tags: (str,list) Tag path or list of tag paths to pull data for
+            stream: (bool) Yield results page by page instead of all at once
+            output: (str) 'tvq' for Tvq objects, 'numpy' for arrays of each column, or 'series' for TvqSeries
 
         Returns:
             - Iterator yielding values for a tag path or dict of tags and their qualified values
         """
-       # Add timezone handling if not already set via userToken
-        if 'timezone' not in constraints and not self._username:
-            constraints['timezone'] = 'UTC'  # Default to UTC if not specified
-
-        # Handle new parameters
-        if 'useTimeExtension' not in constraints:
-            constraints['useTimeExtension'] = True  # Defaults to true in v2
-
-        # If quality is specified and not 'any', force useTimeExtension to false
-        if 'quality' in constraints and constraints['quality'] != 'any':
-            constraints['useTimeExtension'] = False
-
-        # User friendly conversion
-        userFriendlyAutoConversions = [
-            ('startDate', 'startTime'),
-            ('start', 'startTime'),
-            ('endDate', 'endTime'),
-            ('end', 'endTime'),
-        ]
-        for fromKey, toKey in userFriendlyAutoConversions:
-            if fromKey in constraints:
-                constraints[toKey] = constraints[fromKey]
-                del constraints[fromKey]
-
-        # If only a single tag path was provided, simply return values
-        if isinstance(tags, str):
-            tagPath = tags
-            try:
-                values = []
-                for valueChunk in self._getTagData([tagPath], **constraints):
-                    # Add debug output
-                    print(f"Debug - valueChunk: {valueChunk}")
-
-                    # Handle the new response format where each value is an object with t and v properties
-                    if tagPath in valueChunk:
-                        for item in valueChunk[tagPath]:
-                            if isinstance(item, dict) and 't' in item and 'v' in item:
-                                # Extract time and value from the object
-                                t = item['t']
-                                v = item['v']
-                                # Quality might be included or might be None/missing
-                                q = item.get('q', None)
-                                values.append(Tvq(t, v, q))
-                return values
-            except Exception as e:
-                print(f"Error in getTagData: {str(e)}")
-                return []
-        else:
-            tagData = {tagPath: [] for tagPath in tags}
-            try:
-                for tagChunk in self._getTagData(tags, **constraints):
-                    # Add debug output
-                    print(f"Debug - tagChunk: {tagChunk}")
-
-                    for tagPath in tags:
-                        if tagPath in tagChunk:
-                            for item in tagChunk[tagPath]:
-                                if isinstance(item, dict) and 't' in item and 'v' in item:
-                                    # Extract time and value from the object
-                                    t = item['t']
-                                    v = item['v']
-                                    # Quality might be included or might be None/missing
-                                    q = item.get('q', None)
-                                    tagData[tagPath].append(Tvq(t, v, q))
-
-                return ((tagPath, tagData.get(tagPath, [])) for tagPath in tags)
-            except Exception as e:
-                print(f"Error in getTagData: {str(e)}")
-                return ((tagPath, []) for tagPath in tags)
+        return self._readTagData('getTagData', tags, constraints, stream, output)
         
     def _getTagData2(self, tags, **constraints):
         jsonData = {
@@ -236,7 +389,7 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
         jsonData.update(constraints)
         return self._iterPost('getTagData2', jsonData, 'data')
         
-    def getTagData2(self, tags, **constraints):
+    def getTagData2(self, tags, stream=False, output='tvq', **constraints):
         """Similar method to getTagData, but interprets maxSize paramater differently.
         In getTagData2, maxSize is per tag rather than the total across all tags
 
@@ -250,76 +403,179 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
             useTimeExtension: (bool: true) Retrieve time extended timestamp for last value calls
             quality: (str) Quality of data to return for last value calls ('any', 'good', 'non-bad')
             maxSize: (int:10000) Maximum number of values to return per tag
+
+        Set stream=True to get results page by page, and output='numpy' for 
+          column arrays instead of Tvqs (see getTagData).
         """
-        # Add timezone handling if not already set via userToken
-        if 'timezone' not in constraints and not self._username:
-            constraints['timezone'] = 'UTC'  # Default to UTC if not specified
+        return self._readTagData('getTagData2', tags, constraints, stream, output)
 
-        # Handle new parameters
-        if 'useTimeExtension' not in constraints:
-            constraints['useTimeExtension'] = True  # Defaults to true in v2
 
-        # If quality is specified and not 'any', force useTimeExtension to false
-        if 'quality' in constraints and constraints['quality'] != 'any':
-            constraints['useTimeExtension'] = False
+    def _readTagData(self, apiName, tags, constraints, stream=False, output='tvq'):
+        """The guts of getTagData and getTagData2, which only differ by endpoint."""
+        getPages = getattr(self, '_' + apiName)
+        start, addItems, finish = _valueDecoder(output, self.lazyTimestamps)
+
+        _prepConstraints(constraints, anonymous=not self._username, timeExtension=True)
+
+        if stream:
+            return self._streamTagData(getPages, tags, constraints, output)
+
+        if self.tagDataCache is not None:
+            window = self.tagDataCache.window(self._cacheOwner, constraints)
+            if window:
+                return self._readCachedTagData(apiName, tags, constraints, window, output)
+            self.tagDataCache.bypassed += 1 if isinstance(tags, str) else len(tags)
+
+        if self.queryPlanner is not None:
+            window = self.queryPlanner.window(constraints)
+            if window:
+                return self._readPlannedTagData(apiName, tags, constraints, window, output)
 
-        # User friendly conversion
-        userFriendlyAutoConversions = [
-            ('startDate', 'startTime'),
-            ('start', 'startTime'),
-            ('endDate', 'endTime'),
-            ('end', 'endTime'),
-        ]
-        for fromKey, toKey in userFriendlyAutoConversions:
-            if fromKey in constraints:
-                constraints[toKey] = constraints[fromKey]
-                del constraints[fromKey]
+        if self.tagSharder is not None and self.tagSharder.applies(apiName, tags, constraints):
+            return self._readShardedTagData(apiName, tags, constraints, output)
 
         # If only a single tag path was provided, simply return values
         if isinstance(tags, str):
             tagPath = tags
             try:
-                values = []
-                for valueChunk in self._getTagData2([tagPath], **constraints):
-                    # Add debug output
-                    print(f"Debug - valueChunk: {valueChunk}")
-
-                    # Handle the new response format where each value is an object with t and v properties
-                    if tagPath in valueChunk:
-                        for item in valueChunk[tagPath]:
-                            if isinstance(item, dict) and 't' in item and 'v' in item:
-                                # Extract time and value from the object
-                                t = item['t']
-                                v = item['v']
-                                # Quality might be included or might be None/missing
-                                q = item.get('q', None)
-                                values.append(Tvq(t, v, q))
-                return values
+                values = start()
+                for valueChunk in getPages([tagPath], **constraints):
+                    addItems(values, valueChunk.get(tagPath, []))
+                return finish(values)
             except Exception as e:
-                print(f"Error in getTagData2: {str(e)}")
-                return []
+                print(f"Error in {apiName}: {str(e)}")
+                return finish(start())
         else:
-            tagData = {tagPath: [] for tagPath in tags}
+            tagData = {tagPath: start() for tagPath in tags}
             try:
-                for tagChunk in self._getTagData2(tags, **constraints):
-                    # Add debug output
-                    print(f"Debug - tagChunk: {tagChunk}")
-
-                    for tagPath in tags:
-                        if tagPath in tagChunk:
-                            for item in tagChunk[tagPath]:
-                                if isinstance(item, dict) and 't' in item and 'v' in item:
-                                    # Extract time and value from the object
-                                    t = item['t']
-                                    v = item['v']
-                                    # Quality might be included or might be None/missing
-                                    q = item.get('q', None)
-                                    tagData[tagPath].append(Tvq(t, v, q))
-
-                return ((tagPath, tagData.get(tagPath, [])) for tagPath in tags)
+                for tagChunk in getPages(tags, **constraints):
+                    for tagPath,items in tagChunk.items():
+                        if tagPath in tagData:
+                            addItems(tagData[tagPath], items)
+
+                return ((tagPath, finish(tagData[tagPath])) for tagPath in tags)
             except Exception as e:
-                print(f"Error in getTagData2: {str(e)}")
-                return ((tagPath, []) for tagPath in tags)
+                print(f"Error in {apiName}: {str(e)}")
+                return ((tagPath, finish(start())) for tagPath in tags)
+
+    def _readCachedTagData(self, apiName, tags, constraints, window, output='tvq'):
+        """getTagData thru the tagDataCache: only the ranges it doesn't have yet are asked for.
+        Results are cut to the window from startTime to endTime, as the uncached call would be.
+        """
+        getPages = getattr(self, '_' + apiName)
+        cache = self.tagDataCache
+        cacheKey, start, end = window
+        tagList = [tags] if isinstance(tags, str) else list(tags)
+        cached, tagsByMissing = cache.plan(cacheKey, start, cache.readEnd(cacheKey, end), tagList)
+
+        self.userToken # log in once up front, rather than in every worker
+        argSets = fetchArgSets(tagsByMissing)
+        fetches = self._fetchRanges(getPages, constraints, argSets)
+        for (rangeStart, rangeEnd, tagGroup), fetched in zip(argSets, fetches):
+            cache.putAll(cacheKey, rangeStart, rangeEnd, fetched)
+        results = cache.stitch(start, cached, tagsByMissing, fetches)
+
+        probe = cache.endProbe(self._cacheOwner, cacheKey, end, argSets, fetches, results)
+        if probe is not None:
+            probed = self._fetchTagSeries(getPages, constraints, end - READ_PAST_END, end, [probe])
+            cache.learnEnd(self._cacheOwner, end, probed[probe])
+        results = cache.cutAtEnd(self._cacheOwner, cacheKey, end, results)
+
+        if isinstance(tags, str):
+            return _seriesAs(results[tags], output)
+        return ((tagPath, _seriesAs(results[tagPath], output)) for tagPath in tagList)
+
+    def _readPlannedTagData(self, apiName, tags, constraints, window, output='tvq'):
+        """getTagData split up by the queryPlanner: the sub-windows are fetched concurrently and stitched back in order."""
+        getPages = getattr(self, '_' + apiName)
+        planner = self.queryPlanner
+        start, end = window
+        tagList = [tags] if isinstance(tags, str) else list(tags)
+
+        self.userToken # log in once up front, rather than in every worker
+        contexts = self.getTagContext(tagList) if planner.useContext else None
+        argSets = planner.plan(start, end, planner.bounds(start, end, tagList, contexts))
+        fetches = self._fetchRanges(getPages, constraints, argSets)
+        results = planner.stitch(end, tagList, argSets, fetches)
+
+        if isinstance(tags, str):
+            return _seriesAs(results[tags], output)
+        return ((tagPath, _seriesAs(results[tagPath], output)) for tagPath in tagList)
+
+    def _readShardedTagData(self, apiName, tags, constraints, output='tvq'):
+        """getTagData for a long tag list, a shard of the tags at a time with a few shards at once.
+        Each shard is decoded just as the one long call would have been.
+        """
+        getPages = getattr(self, '_' + apiName)
+        start, addItems, finish = _valueDecoder(output, self.lazyTimestamps)
+        tagList = list(tags)
+
+        def fetchShard(shard):
+            shardData = {tagPath: start() for tagPath in shard}
+            valueCount = 0
+            for tagChunk in getPages(shard, **constraints):
+                for tagPath,items in tagChunk.items():
+                    if tagPath in shardData:
+                        addItems(shardData[tagPath], items)
+                        valueCount += len(items)
+            self.tagSharder.observe(len(shard), valueCount)
+            return shardData
+
+        tagData = {}
+        self.userToken # log in once up front, rather than in every worker
+        for shardData in self._mapConcurrently(fetchShard, self.tagSharder.split(tagList)):
+            tagData.update(shardData)
+        return ((tagPath, finish(tagData[tagPath])) for tagPath in tagList)
+
+    def _fetchRanges(self, getPages, constraints, argSets):
+        """_fetchTagSeries for each of the (rangeStart, rangeEnd, tagPaths) argSets, all at once.
+        Long tag lists are sharded first (if there's a tagSharder) and put back together after.
+        """
+        shardsByArgSet = [self.tagSharder.split(tagGroup) if self.tagSharder is not None else [tagGroup]
+                          for rangeStart, rangeEnd, tagGroup in argSets]
+        shardArgSets = [(rangeStart, rangeEnd, shard)
+                        for (rangeStart, rangeEnd, tagGroup), tagShards in zip(argSets, shardsByArgSet)
+                        for shard in tagShards]
+        shardFetches = iter(self._mapConcurrently(lambda argSet: self._fetchTagSeries(getPages, constraints, *argSet),
+                                                  shardArgSets))
+        fetches = []
+        for tagShards in shardsByArgSet:
+            fetched = {}
+            for shard in tagShards:
+                fetched.update(next(shardFetches))
+            fetches.append(fetched)
+        return fetches
+
+    def _fetchTagSeries(self, getPages, constraints, rangeStart, rangeEnd, tagGroup):
+        """Each of the tags' samples from rangeStart to rangeEnd (in nanoseconds), as TvqSeries."""
+        fetched = {tagPath: TvqSeries() for tagPath in tagGroup}
+        rangeConstraints = dict(constraints, startTime=_isoTimestamp(rangeStart), endTime=_isoTimestamp(rangeEnd))
+        for tagChunk in getPages(tagGroup, **rangeConstraints):
+            for tagPath,items in tagChunk.items():
+                if tagPath in fetched:
+                    fetched[tagPath].extendItems(items)
+        if self.tagSharder is not None:
+            self.tagSharder.observe(len(tagGroup), sum(len(series) for series in fetched.values()))
+        return fetched
+
+    def _streamTagData(self, getPages, tags, constraints, output='tvq'):
+        """Yield the tag data as each page comes in, holding no more than the current page."""
+        start, addItems, finish = _valueDecoder(output, self.lazyTimestamps)
+        if isinstance(tags, str):
+            tagPath = tags
+            for valueChunk in getPages([tagPath], **constraints):
+                values = finish(addItems(start(), valueChunk.get(tagPath, [])))
+                if output == 'tvq':
+                    for value in values:
+                        yield value
+                else:
+                    yield values
+        else:
+            wanted = set(tags)
+            for tagChunk in getPages(tags, **constraints):
+                for tagPath,items in tagChunk.items():
+                    if tagPath in wanted:
+                        yield tagPath, finish(addItems(start(), items))
 
 
     def getLiveData(self, tags=None, **configuration):
@@ -366,6 +622,36 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
                 for tagPath,values in page.items():
                     yield tagPath, [Tvq(*value) for value in values]
 
+    def subscribeLiveData(self, tags, callback=None, maxQueued=None, **configuration):
+        """Follow the live data for the given tag(s) in the background.
+        New values are polled for on a background thread, backing off while none come in.
+          Each batch (a dict of tag paths and their new Tvqs) is passed to the callback,
+          and/or put in a queue that can be read with get() or by iterating over the subscription.
+
+        Args:
+            tags: (str, list of str) Tags to follow
+            callback: (callable) Called with each batch, on the polling thread
+            maxQueued: (int) Batches to hold before dropping the oldest (default 1000, or 0 - no queue - with a callback)
+            configuration: passed to getLiveDataToken (like mode and includeQuality)
+
+        Returns:
+            The Subscription. Close it to stop following the tags.
+        """
+        self.userToken # getLiveDataToken takes the user token as is, so make sure there is one
+        return self.liveDataEngine.subscribe(tags, callback, maxQueued, **configuration)
+
+    def _pollLiveData(self, key):
+        """One getLiveData call for the token kept under key, as a dict of tag paths and their new Tvqs"""
+        jsonData = {
+            "userToken":self.userToken,
+            "liveDataToken":self._liveDataTokens[key],
+        }
+        batch = {}
+        for page in self._iterPost('getLiveData', jsonData, 'data'):
+            for tagPath,values in page.items():
+                batch.setdefault(tagPath, []).extend(tvqsFromLiveValues(values, self.lazyTimestamps))
+        return batch
+
     def _getAnnotations(self, tags, startTime, endTime, **constraints):
         """Low-level method to call the getAnnotations API endpoint."""
         jsonData = {
@@ -377,32 +663,19 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
         jsonData.update(constraints)
         return self._iterPost('getAnnotations', jsonData, 'annotations')
 
-    def getAnnotations(self, tags, startTime, endTime, **constraints):
-        """Get annotations from requested tags within the given time interval."""
-        # Add timezone handling if not already set via userToken
-        if 'timezone' not in constraints and not self._username:
-            constraints['timezone'] = 'UTC'  # Default to UTC if not specified
-
-        # User friendly conversion for date/time parameters
-        userFriendlyAutoConversions = [
-            ('startDate', 'startTime'),
-            ('start', 'startTime'),
-            ('endDate', 'endTime'),
-            ('end', 'endTime'),
-        ]
-        for fromKey, toKey in userFriendlyAutoConversions:
-            if fromKey in constraints:
-                constraints[toKey] = constraints[fromKey]
-                del constraints[fromKey]
+    def getAnnotations(self, tags, startTime, endTime, 
+                       chunkSize=DEFAULT_TAG_CHUNK_SIZE, maxWorkers=DEFAULT_MAX_WORKERS, **constraints):
+        """Get annotations from requested tags within the given time interval.
+        A list of tags is requested chunkSize tags at a time, with up to maxWorkers
+          of those requests in flight at once. If any of them fail, the error is raised.
+        """
+        _prepConstraints(constraints, anonymous=not self._username)
 
         # If only a single tag path was provided, simply return annotations
         if isinstance(tags, str):
             tagPath = tags
             try:
                 for annotationChunk in self._getAnnotations([tagPath], startTime, endTime, **constraints):
-                    # Add debug output
-                    print(f"Debug - annotationChunk: {annotationChunk}")
-                    
                     # The response is likely a dict with tagName and annotations properties
                     if isinstance(annotationChunk, dict) and annotationChunk.get('tagName') == tagPath:
                         return annotationChunk.get('annotations', [])
@@ -411,20 +684,18 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
                 print(f"Error in getAnnotations: {str(e)}")
                 return []
         else:
-            # For multiple tags, collect all annotations
+            # For multiple tags, ask for them a chunk at a time, a few chunks at once
             tagAnnotations = {tagPath: [] for tagPath in tags}
-            try:
-                for tagPath in tags:
-                    for annotationChunk in self._getAnnotations([tagPath], startTime, endTime, **constraints):
-                        # Add debug output
-                        print(f"Debug - annotationChunk: {annotationChunk}")
-                        
-                        if isinstance(annotationChunk, dict) and annotationChunk.get('tagName') == tagPath:
-                            tagAnnotations[tagPath] = annotationChunk.get('annotations', [])
-                return tagAnnotations
-            except Exception as e:
-                print(f"Error in getAnnotations: {str(e)}")
-                return tagAnnotations
+
+            def getChunk(tagChunk):
+                return list(self._getAnnotations(tagChunk, startTime, endTime, **constraints))
+
+            self.userToken # log in once up front, rather than in every worker
+            for annotationChunks in self._mapConcurrently(getChunk, chunks(list(tags), chunkSize), maxWorkers):
+                for annotationChunk in annotationChunks:
+                    if isinstance(annotationChunk, dict) and annotationChunk.get('tagName') in tagAnnotations:
+                        tagAnnotations[annotationChunk['tagName']].extend(annotationChunk.get('annotations', []))
+            return tagAnnotations
         
     def _getTagContext(self, tags, **constraints):
         """Low-level method to call the getTagContext API endpoint."""
@@ -435,11 +706,13 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
         jsonData.update(constraints)
         return self._iterPost('getTagContext', jsonData, 'data')
     
-    def getTagContext(self, tags, **constraints):
-        """Get context for requested tags including both the oldest and latest timestamps."""
-        # Add timezone handling if not already set via userToken
-        if 'timezone' not in constraints and not self._username:
-            constraints['timezone'] = 'UTC'  # Default to UTC if not specified
+    def getTagContext(self, tags, 
+                      chunkSize=DEFAULT_TAG_CHUNK_SIZE, maxWorkers=DEFAULT_MAX_WORKERS, **constraints):
+        """Get context for requested tags including both the oldest and latest timestamps.
+        A list of tags is requested chunkSize tags at a time, with up to maxWorkers
+          of those requests in flight at once. If any of them fail, the error is raised.
+        """
+        _prepConstraints(constraints, anonymous=not self._username)
 
         # If only a single tag path was provided, simply return its context
         if isinstance(tags, str):
@@ -454,30 +727,34 @@ class CanaryView(LiveDataTokenManagement, UserTokenManagement):
                 print(f"Error in getTagContext: {str(e)}")
                 return {}
         else:
-            # For multiple tags, collect all context data
+            # For multiple tags, ask for them a chunk at a time, a few chunks at once
             tagContexts = {tagPath: {} for tagPath in tags}
-            try:
-                for tagPath in tags:
-                    for contextChunk in self._getTagContext([tagPath], **constraints):
-                        if isinstance(contextChunk, dict) and contextChunk.get('tagName') == tagPath:
-                            tagContexts[tagPath] = contextChunk.get('tagContext', {})
-                return tagContexts
-            except Exception as e:
-                print(f"Error in getTagContext: {str(e)}")
-                return tagContexts
+
+            def getChunk(tagChunk):
+                return list(self._getTagContext(tagChunk, **constraints))
+
+            self.userToken # log in once up front, rather than in every worker
+            for contextChunks in self._mapConcurrently(getChunk, chunks(list(tags), chunkSize), maxWorkers):
+                for contextChunk in contextChunks:
+                    if isinstance(contextChunk, dict) and contextChunk.get('tagName') in tagContexts:
+                        tagContexts[contextChunk['tagName']] = contextChunk.get('tagContext', {})
+            return tagContexts
 
     # Error Handling
 
     def _post(self, apiUrl, jsonData):
-        super()._post(apiUrl, jsonData)
+        results = super()._post(apiUrl, jsonData)
 
         # Check if it failed. If so, reload.
-        if self.lastResults['statusCode'] == 'BadLicense':
+        if results['statusCode'] == 'BadLicense':
             raise RuntimeError("The target Canary instance is not licensed for third party View usage.")
+        return results
         
-    def _raiseUnhandledPostError(self, apiUrl, jsonData):
-        if self.lastResults['statusCode'] != 'Good':
+    def _raiseUnhandledPostError(self, apiUrl, jsonData, results=None):
+        if results is None:
+            results = self.lastResults
+        if results['statusCode'] != 'Good':
             if jsonData and 'password' in jsonData:
                 jsonData['password'] = '****'
             raise RuntimeError('Canary API call to "%s" had errors: %r.\nData passed: %r' % (
-                apiUrl, self.lastResults.get('errors', []), jsonData))
\ No newline at end of file
+                apiUrl, results.get('errors', []), jsonData))
\ No newline at end of file
@@ -31,5 +31,10 @@ setuptools.setup(
         'urllib3',
         'requests',
         'keyring'
-    ]
+    ],
+    extras_require={
+        'async': ['aiohttp'],
+        'numpy': ['numpy'],
+        'fast': ['orjson'],
+    }
 )
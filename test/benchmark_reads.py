@@ -0,0 +1,58 @@
+"""
+	Read throughput benchmark against FakeCanary.
+
+	Run directly (python test/benchmark_reads.py) to time a long raw read and a
+	wide multi-tag read, each done as one paged call, split by a QueryPlanner
+	and sharded by a TagSharder. Every call to the fake waits LATENCY seconds, as
+	it would over a network. No Canary instance needed.
+
+"""
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import keyring
+from keyring.backends import fail, null
+
+if isinstance(keyring.get_keyring(), fail.Keyring):
+    keyring.set_keyring(null.Keyring())
+
+from birdsong import CanaryView
+from birdsong.fakecanary import FakeCanary
+from birdsong.planner import QueryPlanner
+
+
+LATENCY = 0.02  # seconds per call
+PAGE_SIZE = 5000  # values per page
+
+START = '2024-01-01T00:00:00+00:00'
+END = '2024-02-01T00:00:00+00:00'
+
+
+def timeRead(label, fake, tags, **viewConfiguration):
+    with CanaryView(**dict(fake.connection, **viewConfiguration)) as view:
+        calls = sum(fake.calls.values())
+        began = time.perf_counter()
+        values = sum(len(tagValues) for tagPath, tagValues in view.getTagData(tags, start=START, end=END, output='series'))
+        seconds = time.perf_counter() - began
+        calls = sum(fake.calls.values()) - calls
+    print('%-40s %10d values %6d calls %8.2f s %12.0f values/s' % (label, values, calls, seconds, values / seconds))
+
+
+def run():
+    with FakeCanary(latency=LATENCY, pageSize=PAGE_SIZE) as fake:
+        longTags = fake.addSyntheticTags(['Bench.Long.Tag%d' % ix for ix in range(2)], start=START, interval=10)
+        wideTags = fake.addSyntheticTags(['Bench.Wide.Tag%d' % ix for ix in range(5000)], start=START, interval=86400)
+
+        print('%d ms per call, %d values per page' % (LATENCY * 1000, PAGE_SIZE))
+        timeRead('Long window, paged', fake, longTags)
+        timeRead('Long window, queryPlanner', fake, longTags,
+                 queryPlanner=QueryPlanner(maxWindows=8, minWindowSpan=86400))
+        timeRead('Many tags, one call', fake, wideTags)
+        timeRead('Many tags, sharded', fake, wideTags, tagSharder=500)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,67 @@
+"""
+	Memory and construction benchmark for the value helper classes.
+
+	Run directly (python test/benchmark_values.py) to print the bytes held
+	per object and how many objects per second each way of building them manages.
+	No Canary instance needed.
+
+"""
+import sys
+import os
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from birdsong.values import Tvq, Property, Annotation
+
+
+SAMPLES = 100000
+
+RAW_TVQS = [('2019-10-01T%02d:%02d:%02d.1234567-07:00' % (ix // 3600 % 24, ix // 60 % 60, ix % 60), ix * 0.5, 192)
+            for ix in range(SAMPLES)]
+
+
+def bytesPerObject(build):
+    """Memory held per object, including what it refers to (like its parsed timestamp)."""
+    tracemalloc.start()
+    objects = build()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (held - sys.getsizeof(objects)) / len(objects)
+
+
+def objectsPerSecond(build, repeat=3):
+    seconds = min(timeit.repeat(build, number=1, repeat=repeat))
+    return SAMPLES / seconds
+
+
+def report(label, build):
+    print('%-40s %8.1f bytes/object %12.0f objects/s' % (label, bytesPerObject(build), objectsPerSecond(build)))
+
+
+def run():
+    print('%d values, Python %s' % (SAMPLES, sys.version.split()[0]))
+    print('Tvq instance dict: %s' % ('yes' if hasattr(Tvq('2019-10-01T00:00:00Z', 1), '__dict__') else 'no'))
+
+    report('Tvq(t, v, q)',
+           lambda: [Tvq(t, v, q) for t,v,q in RAW_TVQS])
+
+    if hasattr(Tvq, 'fromRaw'):
+        report('Tvq.fromRaw(t, v, q)',
+               lambda: [Tvq.fromRaw(t, v, q) for t,v,q in RAW_TVQS])
+
+    report('Tvq(t, v, q, lazy=True)',
+           lambda: [Tvq(t, v, q, lazy=True) for t,v,q in RAW_TVQS])
+    if hasattr(Tvq, 'fromRaw'):
+        report('Tvq.fromRaw(t, v, q, lazy=True)',
+               lambda: [Tvq.fromRaw(t, v, q, lazy=True) for t,v,q in RAW_TVQS])
+
+    report('Property(n, t, v, q)',
+           lambda: [Property('Prop', t, v, q) for t,v,q in RAW_TVQS])
+    report('Annotation(u, t, v)',
+           lambda: [Annotation('User', t, v) for t,v,q in RAW_TVQS])
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,427 @@
+"""
+	Offline tests against FakeCanary - no Canary instance needed.
+
+"""
+import sys
+import os
+import json
+import time
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import keyring
+import requests
+from keyring.backends import fail, null
+
+# Headless machines (like CI) often have no keyring, and these views log in anonymously anyway
+if isinstance(keyring.get_keyring(), fail.Keyring):
+    keyring.set_keyring(null.Keyring())
+
+from birdsong import CanaryView, CanarySender, AsyncCanaryView, Tvq, TvqSeries
+from birdsong.fakecanary import FakeCanary, CORRUPT_RESPONSE
+from birdsong.aio import aiohttp
+from birdsong.planner import QueryPlanner, TagSharder
+from birdsong.retry import RetryPolicy
+from birdsong.tagcache import TagDataCache, TagDataCacheEntry, SqliteTier
+
+
+START = '2024-01-01T00:00:00+00:00'
+END = '2024-01-02T00:00:00+00:00'
+
+
+def test_getTagData_continuation():
+    with FakeCanary(pageSize=500) as fake:
+        tags = fake.addSyntheticTags(3, start=START, interval=60)
+        with CanaryView(**fake.connection) as view:
+            tagData = dict(view.getTagData(tags, start=START, end=END))
+
+        assert [len(tagData[tagPath]) for tagPath in tags] == [1440] * 3
+        assert fake.calls['getTagData'] == 9
+        assert tagData[tags[1]][0].value == 1000.0
+        assert tagData[tags[1]][-1].timestamp.isoformat() == '2024-01-01T23:59:00+00:00'
+
+
+def test_maxSize():
+    with FakeCanary() as fake:
+        tags = fake.addSyntheticTags(2, start=START, interval=60)
+        with CanaryView(**fake.connection) as view:
+            assert len(view.getTagData(tags[0], start=START, end=END, maxSize=10)) == 10
+            perTag = dict(view.getTagData2(tags, start=START, end=END, maxSize=7))
+        assert [len(values) for values in perTag.values()] == [7, 7]
+
+
+def test_planned_read_matches_serial():
+    # A server two hours ahead of UTC, with whole numbers - stitching windows shouldn't lose either
+    with FakeCanary(pageSize=500, utcOffset=7200) as fake:
+        # Samples run thru END, so the context's padded latest puts the sub-window edges
+        #   a fraction of a microsecond past 06:00, 12:00 and 18:00 - right next to samples
+        tags = fake.addSyntheticTags(2, start=START, interval=60, end='2024-01-02T00:00:30+00:00',
+                                     valueOf=lambda tagIx, sampleIx: tagIx * 10000 + sampleIx)
+        window = dict(start=START, end='2024-01-02T00:00:30+00:00')
+        with CanaryView(**fake.connection) as view:
+            serial = dict(view.getTagData(tags, **window))
+        planner = QueryPlanner(maxWindows=4, minWindowSpan=3600)
+        with CanaryView(queryPlanner=planner, **fake.connection) as view:
+            planned = dict(view.getTagData(tags, **window))
+
+    assert planner.stats['windows'] == 4
+    for tagPath in tags:
+        assert len(planned[tagPath]) == len(serial[tagPath]) == 1441
+        assert [(value.timestamp.isoformat(), value.value) for value in planned[tagPath]] == \
+               [(value.timestamp.isoformat(), value.value) for value in serial[tagPath]]
+        assert all(type(value.value) is int for value in planned[tagPath])
+    assert planned[tags[0]][0].timestamp.isoformat() == '2024-01-01T02:00:00+02:00'
+
+
+def test_sharded_read_matches_unsharded():
+    with FakeCanary(pageSize=500) as fake:
+        # Whole numbers, to be sure sharding doesn't turn them into floats
+        tags = fake.addSyntheticTags(120, start=START, interval=3600, valueOf=lambda tagIx, sampleIx: tagIx * 100 + sampleIx)
+        with CanaryView(**fake.connection) as view:
+            whole = list(view.getTagData(tags, start=START, end=END))
+        sharder = TagSharder(size=25)
+        with CanaryView(tagSharder=sharder, **fake.connection) as view:
+            sharded = list(view.getTagData(tags, start=START, end=END))
+
+    assert sharder.stats['shards'] == 5
+    assert [tagPath for tagPath, values in sharded] == tags
+    assert [(tagPath, [(value.timestamp, value.value) for value in values]) for tagPath, values in sharded] == \
+           [(tagPath, [(value.timestamp, value.value) for value in values]) for tagPath, values in whole]
+    assert type(sharded[1][1][5].value) is int
+
+
+def test_tag_data_cache():
+    with FakeCanary(pageSize=500) as fake:
+        tags = fake.addSyntheticTags(2, start=START, interval=60)
+        with CanaryView(**fake.connection) as view:
+            uncached = dict(view.getTagData(tags, start=START, end=END))
+
+        cache = TagDataCache()
+        with CanaryView(tagDataCache=cache, **fake.connection) as view:
+            morning = dict(view.getTagData(tags, start=START, end='2024-01-01T12:00:00Z'))
+            view.getTagData(tags, start='2024-01-01T06:00:00Z', end=END)
+            calls = fake.calls['getTagData']
+            # Both halves are cached by now, so the whole day doesn't need a call
+            whole = dict(view.getTagData(tags, start=START, end=END))
+            assert fake.calls['getTagData'] == calls
+            # A failed fetch is raised, rather than handing back a window with a hole in it
+            fake.inject('BadParameters', 'getTagData')
+            try:
+                view.getTagData(tags, start=END, end='2024-01-02T06:00:00+00:00')
+                assert False, 'the failed fetch should have been raised'
+            except RuntimeError:
+                pass
+
+    assert cache.stats['hits'] > 0
+    for tagPath in tags:
+        assert len(morning[tagPath]) == 720
+        assert [(value.timestamp, value.value) for value in whole[tagPath]] == \
+               [(value.timestamp, value.value) for value in uncached[tagPath]]
+
+
+def test_tag_data_cache_matches_uncached_reads():
+    noon = '2024-01-01T12:00:00+00:00'
+    for endInclusive in (False, True):
+        # Whole numbers, in a timezone other than UTC, with a sample right on the window's end
+        with FakeCanary(utcOffset=7200, endInclusive=endInclusive) as fake:
+            tags = fake.addSyntheticTags(2, start=START, interval=3600, end=END, 
+                                         valueOf=lambda tagIx, sampleIx: tagIx * 100 + sampleIx)
+            with CanaryView(**fake.connection) as view:
+                uncached = dict(view.getTagData(tags, start=START, end=noon))
+            with CanaryView(tagDataCache=True, **fake.connection) as view:
+                fetched = dict(view.getTagData(tags, start=START, end=noon))
+                view.getTagData(tags, start=START, end=END)
+                calls = fake.calls['getTagData']
+                served = dict(view.getTagData(tags, start=START, end=noon))
+                # Learning how Canary treats the end takes one call at most, and only once
+                view.getTagData(tags, start=START, end=noon)
+                assert fake.calls['getTagData'] <= calls + 1
+
+        for tagPath in tags:
+            assert len(uncached[tagPath]) == (13 if endInclusive else 12)
+            expected = [(value.timestamp.isoformat(), value.value) for value in uncached[tagPath]]
+            for cached in (fetched, served):
+                assert [(value.timestamp.isoformat(), value.value) for value in cached[tagPath]] == expected
+                assert all(type(value.value) is int for value in cached[tagPath])
+        assert uncached[tags[0]][0].timestamp.isoformat() == '2024-01-01T02:00:00+02:00'
+
+
+def test_storeData_round_trip():
+    with FakeCanary() as fake:
+        with CanarySender(historians=['localhost'], **fake.connection) as send:
+            send.storeData({'Plant.Line1.Speed': [Tvq(START, 1.5, 192), Tvq('2024-01-01T00:01:00Z', 2.5)]},
+                           properties={'Plant.Line1.Speed': [('Units', START, 'm/s', 192)]})
+        with CanaryView(**fake.connection) as view:
+            values = view.getTagData('Plant.Line1.Speed', start=START, end=END)
+            properties = view.getTagProperties('Plant.Line1.Speed')
+
+        assert [value.value for value in values] == [1.5, 2.5]
+        assert properties == {'Units': 'm/s'}
+
+        # Pages are only sized up by their JSON when asked to
+        notes = [Tvq('2024-01-01T00:%02d:00Z' % minute, 'x' * 1000) for minute in range(10)]
+        with CanarySender(historians=['localhost'], **fake.connection) as send:
+            send.storeData({'Plant.Line1.Notes': notes})
+            assert fake.calls['storeData'] == 2
+            send.storeData({'Plant.Line1.Notes': notes}, maxPageBytes=4096)
+            assert fake.calls['storeData'] == 2 + 4
+
+
+def test_bad_tokens_are_renewed():
+    with FakeCanary() as fake:
+        tags = fake.addSyntheticTags(1, start=START, interval=60)
+        with CanaryView(**fake.connection) as view:
+            fake.inject('BadUserToken')
+            assert len(view.getTagData(tags[0], start=START, end='2024-01-01T01:00:00Z')) == 60
+            assert view.retryCounts == {'BadUserToken': 1}
+
+        with CanarySender(historians=['localhost'], **fake.connection) as send:
+            send.storeData({'Plant.Line1.Speed': [Tvq(START, 1.5)]})
+            fake.inject('BadSessionToken', 'storeData')
+            send.storeData({'Plant.Line1.Speed': [Tvq('2024-01-01T00:01:00Z', 2.5)]})
+            assert send.retryCounts == {'BadSessionToken': 1}
+        assert len(fake.samples('Plant.Line1.Speed')) == 2
+
+
+def test_server_errors_are_not_resent_for_storeData():
+    with FakeCanary() as fake:
+        tags = fake.addSyntheticTags(1, start=START, interval=60)
+        with CanaryView(retryPolicy=RetryPolicy(baseDelay=0), **fake.connection) as view:
+            fake.inject(503, 'getTagData')
+            assert len(view.getTagData(tags[0], start=START, end='2024-01-01T01:00:00Z')) == 60
+            assert view.retryCounts == {'transport': 1}
+
+        with CanarySender(historians=['localhost'], retryPolicy=RetryPolicy(baseDelay=0), **fake.connection) as send:
+            fake.inject(503, 'storeData')
+            try:
+                send.storeData({'Plant.Line1.Speed': [Tvq(START, 1.5)]})
+            except requests.HTTPError:
+                pass
+            else:
+                assert False, 'storeData should not have been resent'
+        assert fake.calls['storeData'] == 1
+
+
+def test_failed_buffered_send_still_closes_the_session():
+    with FakeCanary() as fake:
+        try:
+            with CanarySender(historians=['localhost'], buffered=True, **fake.connection) as send:
+                fake.inject(503, 'storeData')
+                send.storeData({'Plant.Line1.Speed': [Tvq(START, 1.5)]})
+        except RuntimeError:
+            pass
+        else:
+            assert False, 'the failed buffered send should have been raised'
+        assert not fake._sessionTokens and not fake._userTokens
+
+
+def test_circuit_closes_after_a_non_transport_error():
+    with FakeCanary() as fake:
+        tags = fake.addSyntheticTags(1, start=START, interval=60)
+        window = dict(start=START, end='2024-01-01T01:00:00Z')
+        with CanaryView(retryPolicy=RetryPolicy(maxRetries=0), **fake.connection) as view:
+            breaker = view.circuitBreaker
+            breaker.failureThreshold, breaker.resetTimeout = 1, 0
+            fake.inject(500, 'getTagData')
+            try:
+                view.getTagData(tags[0], **window)
+            except requests.HTTPError:
+                pass
+            assert breaker.state == 'open'
+
+            # The test call fails, but not at the transport - it still has to settle the circuit
+            fake.inject(CORRUPT_RESPONSE, 'getTagData')
+            try:
+                view.getTagData(tags[0], **window)
+            except requests.RequestException:
+                pass
+            assert breaker.state == 'open'
+
+            assert len(view.getTagData(tags[0], **window)) == 60
+            assert breaker.state == 'closed'
+
+
+def test_token_cache(tmp_path):
+    path = str(tmp_path / 'tokens.json')
+    with FakeCanary() as fake:
+        tags = fake.addSyntheticTags(1, start=START, interval=60)
+        window = dict(start=START, end='2024-01-01T01:00:00Z')
+        with CanaryView(tokenCache=path, **fake.connection) as first, \
+             CanaryView(tokenCache=path, **fake.connection) as second:
+            assert first._tokenCache is second._tokenCache
+            assert len(first.getTagData(tags[0], **window)) == 60
+            assert len(second.getTagData(tags[0], **window)) == 60
+        assert fake.calls['getUserToken'] == 1
+        assert fake.calls['revokeUserToken'] == 0
+
+        # The next run picks the token up, and a rejected one is swapped out in the file too
+        fake.expireTokens()
+        with CanaryView(tokenCache=path, **fake.connection) as view:
+            assert len(view.getTagData(tags[0], **window)) == 60
+            assert view.retryCounts == {'BadUserToken': 1}
+            renewed = view.userToken
+        assert fake.calls['getUserToken'] == 2
+        with open(path) as cacheFile:
+            assert list(json.load(cacheFile).values()) == [renewed]
+        assert os.listdir(str(tmp_path)) == ['tokens.json']
+
+
+def test_metadata_cache_file(tmp_path):
+    path = str(tmp_path / 'metadata.json')
+    with FakeCanary() as fake:
+        fake.setProperties('Plant.Line1.Speed', {'Units': 'm/s'})
+        with CanaryView(metadataCache=path, **fake.connection) as view:
+            assert view.getTagProperties('Plant.Line1.Speed') == {'Units': 'm/s'}
+            # Written out in batches, not on every store
+            assert not os.path.exists(path)
+        with CanaryView(metadataCache=path, **fake.connection) as view:
+            assert view.getTagProperties('Plant.Line1.Speed') == {'Units': 'm/s'}
+        assert fake.calls['getTagProperties'] == 1
+    assert os.listdir(str(tmp_path)) == ['metadata.json']
+
+
+def test_metadata_cache_qualities():
+    with FakeCanary() as fake:
+        with CanaryView(metadataCache=True, **fake.connection) as view:
+            assert view.getQualities([192, 0]) == {'192': 'Good', '0': 'Bad'}
+            # Only the code that isn't cached yet is asked for - as the number it was given as
+            assert view.getQualities([192, 64]) == {'192': 'Good', '64': 'Uncertain'}
+        assert fake.calls['getQualities'] == 2
+
+
+def test_live_data():
+    with FakeCanary() as fake:
+        fake.addSyntheticTags(['Live.A'], start=START, interval=0.05)
+        with CanaryView(liveMinPollInterval=0.05, **fake.connection) as view:
+            subscription = view.subscribeLiveData('Live.A')
+            time.sleep(0.5)
+            subscription.close()
+            values = [value for batch in subscription for value in batch['Live.A']]
+        assert fake.calls['getLiveDataToken'] == 1
+        assert len(values) >= 5
+        assert all(earlier.timestamp < later.timestamp for earlier, later in zip(values, values[1:]))
+
+
+def test_live_data_same_tags_two_modes():
+    with FakeCanary() as fake:
+        fake.addSyntheticTags(['Live.A'], start=START, interval=0.05)
+        with CanaryView(liveMinPollInterval=0.05, **fake.connection) as view:
+            allValues = view.subscribeLiveData('Live.A', mode='AllValues')
+            currentValues = view.subscribeLiveData('Live.A', mode='CurrentValues')
+            assert sorted(token['mode'] for token in fake._liveDataTokens.values()) == ['AllValues', 'CurrentValues']
+
+            # Closing one mode's subscription leaves the other one's token alone
+            currentValues.close()
+            delivered = allValues.delivered
+            time.sleep(0.5)
+            assert allValues.delivered > delivered
+            assert allValues.lastError is None
+            assert [token['mode'] for token in fake._liveDataTokens.values()] == ['AllValues']
+            allValues.close()
+        assert fake.calls['getLiveDataToken'] == 2
+
+
+def test_live_data_regrouping():
+    # With some latency a poll is usually in flight when the token is swapped
+    with FakeCanary(latency=0.03) as fake:
+        fake.addSyntheticTags(['Live.A', 'Live.B', 'Live.C'], start=START, interval=0.05)
+        with CanaryView(liveMinPollInterval=0.05, **fake.connection) as view:
+            wide = view.subscribeLiveData(['Live.A', 'Live.B', 'Live.C'])
+            narrow = view.subscribeLiveData('Live.C')
+            # Live.C is already covered, so the second subscriber shares the first token
+            assert fake.calls['getLiveDataToken'] == 1
+            time.sleep(0.3)
+
+            # Now most of that token is tags nobody wants, so Live.C moves to a token of its own
+            wide.close()
+            assert [token['tags'] for token in fake._liveDataTokens.values()] == [['Live.C']]
+            time.sleep(0.3)
+            narrow.close()
+            assert not fake._liveDataTokens
+
+    values = [value for batch in narrow for value in batch['Live.C']]
+    assert narrow.lastError is None
+    assert len(values) >= 5
+    # Nothing the old token handed out comes around again from the new one, and nothing is skipped
+    assert all(earlier.timestamp < later.timestamp for earlier, later in zip(values, values[1:]))
+    assert round((values[-1].timestamp - values[0].timestamp).total_seconds() / 0.05) + 1 == len(values)
+
+
+def test_async_getTagData():
+    if aiohttp is None:
+        return
+
+    async def read(fake, tags):
+        async with AsyncCanaryView(**fake.connection) as view:
+            return dict(await view.getTagData(tags, start=START, end=END))
+
+    with FakeCanary(pageSize=500) as fake:
+        tags = fake.addSyntheticTags(2, start=START, interval=60)
+        tagData = asyncio.run(read(fake, tags))
+    assert [len(tagData[tagPath]) for tagPath in tags] == [1440] * 2
+
+
+def test_async_live_data_token_is_requested_once():
+    if aiohttp is None:
+        return
+
+    async def requestTokens(fake, tags):
+        view = AsyncCanaryView(**fake.connection)
+        try:
+            await asyncio.gather(*[view._getLiveDataToken(tags) for _ in range(5)])
+            return len(fake._liveDataTokens)
+        finally:
+            await view.aclose()
+
+    with FakeCanary() as fake:
+        tags = fake.addSyntheticTags(2, start=START, interval=60)
+        assert asyncio.run(requestTokens(fake, tags)) == 1
+        # aclose revoked it, like leaving an async with block would
+        assert not fake._liveDataTokens
+
+
+def test_numpy_output_keeps_bools():
+    try:
+        import numpy
+    except ImportError:
+        return
+    with FakeCanary() as fake:
+        flags, = fake.addSyntheticTags(1, start=START, interval=3600, valueOf=lambda tagIx, sampleIx: sampleIx % 2 == 0)
+        with CanaryView(**fake.connection) as view:
+            columns = view.getTagData(flags, start=START, end=END, output='numpy')
+            series = view.getTagData(flags, start=START, end=END, output='series')
+    assert columns['value'].dtype == numpy.bool_
+    assert columns['value'][:3].tolist() == [True, False, True]
+    assert series.arrays()['value'].dtype == numpy.bool_
+
+
+def test_lazy_timestamps_are_per_view():
+    with FakeCanary() as fake:
+        tagPath, = fake.addSyntheticTags(1, start=START, interval=3600)
+        with CanaryView(lazyTimestamps=True, **fake.connection) as lazyView, \
+             CanaryView(**fake.connection) as view:
+            lazy = lazyView.getTagData(tagPath, start=START, end=END)
+            eager = view.getTagData(tagPath, start=START, end=END)
+    assert isinstance(lazy[0]._timestamp, str)
+    assert not isinstance(eager[0]._timestamp, str)
+    assert [value.timestamp for value in lazy] == [value.timestamp for value in eager]
+    assert Tvq('01/01/2024 06:00', 1, timeFormat='MM/DD/YYYY HH:mm').timestamp.hour == 6
+
+
+def test_series_keeps_nan_and_missing_apart(tmp_path):
+    series = TvqSeries([(START, 1.5), ('2024-01-01T00:01:00Z', float('nan')), ('2024-01-01T00:02:00Z', None)])
+    tier = SqliteTier(str(tmp_path / 'tags.db'))
+    tier.save('key', 'tag', TagDataCacheEntry(series, [(0, 1)]))
+    for copy in (series, series[1:], TvqSeries.concat([series[:1], series[1:]]), tier.load('key', 'tag').series):
+        values = [value.value for value in copy]
+        assert values[-1] is None
+        assert values[-2] != values[-2]  # NaN
+    # A sample without a real time (or out of order) has no place in the series
+    for timestamp in (None, '2024-01-01T00:00:30Z'):
+        try:
+            series.append(timestamp, 1.0)
+            assert False, 'the sample should have been rejected'
+        except ValueError:
+            pass
+    tier.close()